@@ -2,18 +2,30 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from abc import ABCMeta, abstractmethod
 from contextlib import contextmanager
+import hashlib
+import imp
+import io
+import multiprocessing
 import os
 import six
+import sys
 import textwrap
+import traceback
 
-from stone.frontend.ir_generator import doc_ref_re
-from stone.ir import (
-    is_alias,
+from six.moves import cPickle as pickle
+
+from stone.frontend.cache import (
+    read_cache_entry,
+    source_hash,
+    write_cache_entry,
 )
+from stone.frontend.ir_generator import doc_ref_re
+from stone.sinks import FileSystemSink
 
 _MYPY = False
 if _MYPY:
-    from stone.ir import Api  # noqa: F401 # pylint: disable=unused-import
+    from stone.ir import Api, ApiNamespace  # noqa: F401 # pylint: disable=unused-import
+    from stone.sinks import OutputSink, OutputWriter  # noqa: F401 # pylint: disable=unused-import
     import typing  # pylint: disable=import-error,useless-suppression
 
     # Generic Dict key-val types
@@ -31,51 +43,46 @@ argparse = importlib.import_module(str('argparse'))  # type: typing.Any
 logging = importlib.import_module(str('logging'))  # type: typing.Any
 open = open  # type: typing.Any # pylint: disable=redefined-builtin
 
+# Set in each worker process by _init_namespace_worker().
+_namespace_worker_state = None  # type: typing.Any
 
-def remove_aliases_from_api(api):
-    for namespace in api.namespaces.values():
-        # Important: Even if this namespace has no aliases, it may reference
-        # an alias in an imported namespace.
-
-        # Remove nested aliases first. This way, when we replace an alias with
-        # its source later on, it too is alias free.
-        for alias in namespace.aliases:
-            data_type = alias
-            while True:
-                # For better or for worse, all non-user-defined types that
-                # reference other types do so with a 'data_type' attribute.
-                if hasattr(data_type, 'data_type'):
-                    if is_alias(data_type.data_type):
-                        # Skip the alias (this looks so terrible...)
-                        data_type.data_type = data_type.data_type.data_type
-                    data_type = data_type.data_type
-                else:
-                    break
-
-        for data_type in namespace.data_types:
-            for field in data_type.fields:
-                data_type = field
-                while True:
-                    if hasattr(data_type, 'data_type'):
-                        if is_alias(data_type.data_type):
-                            data_type.data_type = data_type.data_type.data_type
-                        data_type = data_type.data_type
-                    else:
-                        break
+# A hash of the files of the stone package, computed on first use.
+_stone_files_hash = None  # type: typing.Optional[typing.Text]
 
-        for route in namespace.routes:
-            if is_alias(route.arg_data_type):
-                route.arg_data_type = route.arg_data_type.data_type
-            if is_alias(route.result_data_type):
-                route.result_data_type = route.result_data_type.data_type
-            if is_alias(route.error_data_type):
-                route.error_data_type = route.error_data_type.data_type
 
-        # Clear aliases
-        namespace.aliases = []
-        namespace.alias_by_name = {}
+def remove_aliases_from_api(api):
+    """
+    Returns a view of api without aliases. api isn't modified. See
+    :meth:`stone.ir.Api.without_aliases`.
+    """
+    return api.without_aliases()
 
-    return api
+
+def _get_code_hash(backend_class):
+    # type: (typing.Type[Backend]) -> typing.Optional[typing.Text]
+    """
+    Returns a hash of the files of the stone package, including the resources
+    that backends copy, and of the module that defines backend_class. Returns
+    None if the source of the module isn't available.
+    """
+    global _stone_files_hash  # pylint: disable=global-statement
+    if _stone_files_hash is None:
+        h = hashlib.sha1()
+        package_path = os.path.dirname(os.path.abspath(__file__))
+        for dirpath, dirnames, filenames in os.walk(package_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(('.pyc', '.pyo')):
+                    continue
+                path = os.path.join(dirpath, filename)
+                h.update(os.path.relpath(path, package_path).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+        _stone_files_hash = h.hexdigest()
+    module_hash = source_hash(sys.modules[backend_class.__module__])
+    if module_hash is None:
+        return None
+    return _stone_files_hash + module_hash
 
 
 @six.add_metaclass(ABCMeta)
@@ -111,6 +118,19 @@ class Backend(object):
     # For backwards compatibility with existing backends defaults to false.
     preserve_aliases = False
 
+    # Can be overridden by a subclass to cache its outputs, if they only depend
+    # on the API and the backend's arguments. If 'api', the outputs of
+    # generate() are cached for the whole API. If 'namespace', the backend is a
+    # NamespaceBackendMixin, and the outputs of generate_namespace() are cached
+    # for each namespace. They only depend on the namespace, the namespaces it
+    # references and the route schema.
+    cache_granularity = None  # type: typing.Optional[typing.Text]
+
+    # The size in characters the output buffer may reach while generating a
+    # file before it's written to the sink. Larger files are written in
+    # chunks, rather than kept in memory until they're complete.
+    output_chunk_size = 1 << 20
+
     def __init__(self, target_folder_path, args):
         # type: (str, typing.Optional[typing.Sequence[str]]) -> None
         """
@@ -121,11 +141,27 @@ class Backend(object):
         self.logger = logging.getLogger('Backend<%s>' %
                                         self.__class__.__name__)
         self.target_folder_path = target_folder_path
+        # The sink that files are written to. Set by the compiler, and
+        # otherwise the target folder.
+        self.sink = FileSystemSink(target_folder_path)  # type: OutputSink
         # Output is a list of strings that should be concatenated together for
         # the final output.
         self.output = []  # type: typing.List[typing.Text]
+        self._output_size = 0
+        # The file being generated, and its writer once the output buffer has
+        # been written to it.
+        self._output_path = None  # type: typing.Optional[typing.Text]
+        self._output_writer = None  # type: typing.Optional[OutputWriter]
         self.lineno = 1
         self.cur_indent = 0
+        # The number of processes generate_namespaces() may use. Set by the
+        # compiler.
+        self.jobs = 1
+        # The paths of the files generated so far.
+        self.output_paths = []  # type: typing.List[typing.Text]
+        # The folder to cache outputs in, if they are cached. Set by the
+        # compiler.
+        self.cache_dir = None  # type: typing.Optional[typing.Text]
 
         self.args = None  # type: typing.Optional[argparse.Namespace]
 
@@ -152,27 +188,122 @@ class Backend(object):
         """
         raise NotImplementedError
 
+    def get_cache_key(self, obj):
+        # type: (typing.Any) -> typing.Optional[typing.Text]
+        """
+        Returns the key of the cached outputs that this backend generates from
+        obj, a part of the API, or None if they can't be cached.
+
+        The key is a hash of obj and everything it references, the arguments
+        of the backend, and the code of stone and of the backend.
+        """
+        if self.cache_dir is None:
+            return None
+        code_hash = _get_code_hash(type(self))
+        if code_hash is None:
+            return None
+        h = hashlib.sha1()
+        h.update(code_hash.encode('utf-8'))
+        h.update(type(self).__name__.encode('utf-8'))
+        h.update(repr(self.args).encode('utf-8'))
+        # Pickling is deterministic as long as the IR is built in the same
+        # order, since dicts such as ApiNamespace.data_type_by_name are
+        # pickled in insertion order on Python 3.7+. Where dict order may
+        # vary between runs, a different order only causes a cache miss.
+        h.update(pickle.dumps(obj, 2))
+        return h.hexdigest()
+
+    def restore_cached_outputs(self, cache_key, description):
+        # type: (typing.Optional[typing.Text], typing.Text) -> bool
+        """
+        Writes the outputs cached under cache_key to the sink.
+        Returns False if there are none. description names what the outputs
+        were generated for, in log messages.
+        """
+        if cache_key is None:
+            return False
+        outputs = read_cache_entry(self._get_cache_path(cache_key))
+        if not isinstance(outputs, list):
+            self.logger.info('Build cache miss for %s', description)
+            return False
+        self.logger.info('Build cache hit for %s', description)
+        for relative_path, data in outputs:
+            self._prepare_output_path(relative_path)
+            self.sink.write_file(relative_path, data)
+        return True
+
+    def cache_outputs(self, cache_key, output_paths):
+        # type: (typing.Text, typing.Iterable[typing.Text]) -> None
+        """
+        Caches the files at output_paths under cache_key, if the sink can
+        read them back.
+        """
+        outputs = []
+        for path in output_paths:
+            relative_path = os.path.relpath(path, self.target_folder_path)
+            try:
+                outputs.append((relative_path, self.sink.read_file(relative_path)))
+            except io.UnsupportedOperation:
+                self.logger.debug('Cannot cache outputs written to %r', self.sink)
+                return
+        write_cache_entry(self._get_cache_path(cache_key), outputs)
+
+    def _get_cache_path(self, cache_key):
+        # type: (typing.Text) -> typing.Text
+        assert self.cache_dir is not None
+        return os.path.join(self.cache_dir, 'outputs-%s.pickle' % cache_key)
+
     @contextmanager
     def output_to_relative_path(self, relative_path):
         # type: (typing.Text) -> typing.Iterator[None]
         """
         Sets up backend so that all emits are directed towards the new file
-        created at :param:`relative_path`.
+        created at :param:`relative_path` in the sink. With the default sink,
+        the file is only written if its contents change.
 
-        Clears the output buffer on enter and exit.
+        Clears the output buffer on enter and exit. Once the buffer reaches
+        output_chunk_size, it's written to the sink and cleared, so it only
+        holds the end of large files. If the block raises an exception, the
+        file isn't written.
         """
-        full_path = os.path.join(self.target_folder_path, relative_path)
-        directory = os.path.dirname(full_path)
-        if not os.path.exists(directory):
-            self.logger.info('Creating %s', directory)
-            os.makedirs(directory)
-
+        full_path = self._prepare_output_path(relative_path)
         self.logger.info('Generating %s', full_path)
-        self.output = []
-        yield
-        with open(full_path, 'wb') as f:
-            f.write(''.join(self.output).encode('utf-8'))
-        self.output = []
+        self.clear_output_buffer()
+        self._output_writer = None
+        self._output_path = relative_path
+        try:
+            yield
+            if self._output_writer is None:
+                self.sink.write_file(
+                    relative_path, ''.join(self.output).encode('utf-8'))
+            else:
+                self._flush_output()
+                self._output_writer.close()
+        except Exception:
+            if self._output_writer is not None:
+                self._output_writer.abort()
+            raise
+        finally:
+            self._output_path = None
+            self._output_writer = None
+            self.clear_output_buffer()
+
+    def copy_to_relative_path(self, source_path, relative_path):
+        # type: (typing.Text, typing.Text) -> None
+        """
+        Copies the file at source_path to relative_path in the sink. With
+        the default sink, the file is only written if it isn't already there.
+        """
+        full_path = self._prepare_output_path(relative_path)
+        self.logger.info('Copying %s to %s', source_path, full_path)
+        with open(source_path, 'rb') as f:
+            self.sink.write_file(relative_path, f.read())
+
+    def _prepare_output_path(self, relative_path):
+        # type: (typing.Text) -> typing.Text
+        full_path = os.path.join(self.target_folder_path, relative_path)
+        self.output_paths.append(full_path)
+        return full_path
 
     def output_buffer_to_string(self):
         # type: () -> typing.Text
@@ -181,6 +312,7 @@ class Backend(object):
 
     def clear_output_buffer(self):
         self.output = []
+        self._output_size = 0
 
     @contextmanager
     def indent(self, dent=None):
@@ -229,6 +361,18 @@ class Backend(object):
     def _append_output(self, s):
         # type: (typing.Text) -> None
         self.output.append(s)
+        self._output_size += len(s)
+        if self._output_size >= self.output_chunk_size and self._output_path:
+            if self._output_writer is None:
+                self._output_writer = self.sink.open(self._output_path)
+            self._flush_output()
+
+    def _flush_output(self):
+        # type: () -> None
+        """Writes the output buffer to the file being generated."""
+        assert self._output_writer is not None
+        self._output_writer.write(''.join(self.output).encode('utf-8'))
+        self.clear_output_buffer()
 
     def emit(self, s=''):
         # type: (typing.Text) -> None
@@ -324,6 +468,147 @@ class Backend(object):
         return ''.join(parts)
 
 
+class NamespaceBackendMixin(Backend):
+    """
+    Mix this into a backend whose output for a namespace doesn't depend on
+    the output for other namespaces, and call generate_namespaces() from
+    generate(). The namespaces can then be generated in parallel, and cached
+    separately if the backend's cache_granularity is 'namespace'.
+    """
+
+    @abstractmethod
+    def generate_namespace(self, api, namespace):
+        # type: (Api, ApiNamespace) -> None
+        """
+        Subclasses should override this method to generate the output for a
+        namespace. It's called by generate_namespaces().
+
+        Args:
+            api (stone.api.Api): The API specification.
+            namespace (stone.api.ApiNamespace): The namespace to generate.
+        """
+        raise NotImplementedError
+
+    def generate_namespaces(self, api):
+        # type: (Api) -> None
+        """
+        Calls generate_namespace() for each namespace in api.
+
+        If the backend may use several processes, the namespaces are generated
+        in parallel by worker processes. Each namespace is generated from the
+        state of the backend when this method is called, with an empty output
+        buffer. Changes generate_namespace() makes to other attributes of the
+        backend are not seen by this process, and may or may not be seen by
+        other namespaces. Unless the workers are forked, the backend and api
+        are pickled to send them to the workers.
+        """
+        cache_keys = {}  # type: typing.Dict[typing.Text, typing.Optional[typing.Text]]
+        namespace_names = []
+        for namespace in api.namespaces.values():
+            if self.cache_granularity == 'namespace':
+                cache_keys[namespace.name] = self.get_cache_key(
+                    (api.route_schema, namespace))
+                if self.restore_cached_outputs(cache_keys[namespace.name],
+                                               'namespace ' + namespace.name):
+                    continue
+            namespace_names.append(namespace.name)
+
+        if (self.jobs <= 1 or len(namespace_names) <= 1 or
+                not self.sink.shared_by_processes):
+            for namespace_name in namespace_names:
+                first_output = len(self.output_paths)
+                self.generate_namespace(api, api.namespaces[namespace_name])
+                if cache_keys.get(namespace_name):
+                    self.cache_outputs(cache_keys[namespace_name],
+                                       self.output_paths[first_output:])
+            return
+
+        self.logger.info('Generating %d namespaces in %d processes',
+                         len(namespace_names), min(self.jobs, len(namespace_names)))
+        if _workers_are_forked():
+            # Workers forked from this process share the backend and api
+            # rather than unpickling them.
+            initargs = (self, api)  # type: typing.Tuple[typing.Any, ...]
+        else:
+            # The module of the backend is loaded in the workers before the
+            # backend is unpickled, since it may be a backend file, which
+            # isn't in a package.
+            module = sys.modules[type(self).__module__]
+            initargs = (pickle.dumps(self, pickle.HIGHEST_PROTOCOL),
+                        pickle.dumps(api, pickle.HIGHEST_PROTOCOL),
+                        module.__name__, module.__file__)
+        pool = multiprocessing.Pool(min(self.jobs, len(namespace_names)),
+                                    _init_namespace_worker, initargs)
+        try:
+            results = pool.map(_generate_namespace_in_worker, namespace_names)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for namespace_name, (error, output_paths) in zip(namespace_names, results):
+            self.output_paths.extend(output_paths)
+            if error is None and cache_keys.get(namespace_name):
+                self.cache_outputs(cache_keys[namespace_name], output_paths)
+        # The first failure is raised, like when generating serially.
+        for namespace_name, (error, _) in zip(namespace_names, results):
+            if isinstance(error, SystemExit):
+                raise error
+            elif error is not None:
+                raise RuntimeError('Generating namespace %s raised an exception:\n%s'
+                                   % (namespace_name, error))
+
+
+def _workers_are_forked():
+    # type: () -> bool
+    """Returns whether multiprocessing starts workers by forking this process."""
+    if hasattr(multiprocessing, 'get_start_method'):
+        return multiprocessing.get_start_method() == 'fork'
+    # Python 2 forks workers, except on Windows.
+    return sys.platform != 'win32'
+
+
+def _init_namespace_worker(backend, api, backend_module_name=None,
+                           backend_module_path=None):
+    """
+    Sets up a worker to generate namespaces with backend. Unless the worker
+    was forked, backend and api are pickled, and the module of the backend
+    is loaded before they're unpickled.
+    """
+    global _namespace_worker_state  # pylint: disable=global-statement
+    if backend_module_name is not None:
+        module = sys.modules.get(backend_module_name)
+        if module is None or getattr(module, '__file__', None) != backend_module_path:
+            if backend_module_path.endswith('.pyc'):
+                backend_module_path = backend_module_path[:-1]
+            imp.load_source(backend_module_name, backend_module_path)
+        backend = pickle.loads(backend)
+        api = pickle.loads(api)
+    _namespace_worker_state = (backend, api, backend.lineno, backend.cur_indent)
+
+
+def _generate_namespace_in_worker(namespace_name):
+    """
+    Generates a namespace with the backend the worker was initialized with.
+    Returns the traceback of the exception it raised, if any, or the
+    SystemExit if it exited, and the paths of the files it generated.
+    """
+    backend, api, lineno, cur_indent = _namespace_worker_state
+    backend.output = []
+    backend.lineno = lineno
+    backend.cur_indent = cur_indent
+    backend.output_paths = []
+    try:
+        backend.generate_namespace(api, api.namespaces[namespace_name])
+    except SystemExit as e:
+        # Raised again by generate_namespaces(), like when generating
+        # serially. If it stopped the worker, its result would never arrive.
+        return e, backend.output_paths
+    except Exception:  # pylint: disable=broad-except
+        # Remove the last char of the traceback b/c it's a newline.
+        return traceback.format_exc()[:-1], backend.output_paths
+    return None, backend.output_paths
+
+
 class CodeBackend(Backend):
     """
     Extend this instead of :class:`Backend` when generating source code.
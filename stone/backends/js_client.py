@@ -47,6 +47,8 @@ class JavascriptClientBackend(CodeBackend):
 
     cmdline_parser = _cmdline_parser
 
+    cache_granularity = 'api'
+
     # Instance var of the current namespace being generated
     cur_namespace = None  # type: typing.Optional[ApiNamespace]
 
@@ -79,6 +79,8 @@ class JavascriptTypesBackend(CodeBackend):
 
     cmdline_parser = _cmdline_parser
 
+    cache_granularity = 'api'
+
     preserve_aliases = True
 
     def generate(self, api):
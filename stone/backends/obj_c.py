@@ -9,7 +9,6 @@ from stone.ir import (
     is_union_type,
     is_nullable_type,
     is_user_defined_type,
-    is_void_type,
     unwrap_nullable, )
 from stone.backend import CodeBackend
 from stone.backends.obj_c_helpers import (
@@ -18,6 +17,12 @@ from stone.backends.obj_c_helpers import (
     fmt_class_prefix,
     fmt_import, )
 
+_MYPY = False
+if _MYPY:
+    import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+
+    from stone.ir import ApiReferenceIndex  # noqa: F401 # pylint: disable=unused-import
+
 stone_warning = """\
 ///
 /// Copyright (c) 2016 Dropbox, Inc. All rights reserved.
@@ -41,6 +46,10 @@ class ObjCBaseBackend(CodeBackend):
     """Wrapper class over Stone generator for Obj C logic."""
     # pylint: disable=abstract-method
 
+    # The index of the references between the objects of the API, set by
+    # generate().
+    reference_index = None  # type: typing.Optional[ApiReferenceIndex]
+
     @contextmanager
     def block_m(self, class_name):
         with self.block(
@@ -222,37 +231,27 @@ class ObjCBaseBackend(CodeBackend):
                                      namespace,
                                      include_route_args=True,
                                      include_route_deep_args=False):
+        """
+        Returns the user-defined types that the routes of namespace reference
+        as their result and error, and optionally as their argument. Deep
+        arguments are the types referenced by the fields of struct arguments.
+        """
         result = []
-
-        def _unpack_and_store_data_type(data_type):
-            data_type, _ = unwrap_nullable(data_type)
-            if is_list_type(data_type):
-                while is_list_type(data_type):
-                    data_type = data_type.data_type
-
-            if not is_void_type(data_type) and is_user_defined_type(data_type):
-                result.append(data_type)
-
         for route in namespace.routes:
-            if include_route_args:
-                data_type, _ = unwrap_nullable(route.arg_data_type)
-                _unpack_and_store_data_type(data_type)
-            elif include_route_deep_args:
+            result.extend(self.reference_index.get_route_io_references(
+                route, arg=include_route_args))
+            if not include_route_args and include_route_deep_args:
                 data_type, _ = unwrap_nullable(route.arg_data_type)
-                if is_union_type(data_type) or is_list_type(data_type):
-                    _unpack_and_store_data_type(data_type)
-                elif not is_void_type(data_type):
+                if is_struct_type(data_type):
                     for field in data_type.all_fields:
-                        data_type, _ = unwrap_nullable(field.data_type)
-                        if (is_struct_type(data_type) or
-                                is_union_type(data_type) or
-                                is_list_type(data_type)):
-                            _unpack_and_store_data_type(data_type)
-
-            _unpack_and_store_data_type(route.result_data_type)
-            _unpack_and_store_data_type(route.error_data_type)
+                        result.extend(
+                            self.reference_index.get_references(field))
+                else:
+                    result.extend(self.reference_index.get_route_io_references(
+                        route, result=False, error=False))
 
-        return result
+        return [data_type for data_type in result
+                if is_user_defined_type(data_type)]
 
     def _cstor_name_from_fields(self, fields):
         """Returns an Obj C appropriate name for a constructor based on
@@ -95,10 +95,13 @@ class ObjCBackend(ObjCBaseBackend):
     """Generates ObjC client base that implements route interfaces."""
     cmdline_parser = _cmdline_parser
 
+    cache_granularity = 'api'
+
     obj_name_to_namespace = {}  # type: typing.Dict[str, int]
     namespace_to_has_routes = {}  # type: typing.Dict[typing.Any, bool]
 
     def generate(self, api):
+        self.reference_index = api.get_reference_index()
 
         for namespace in api.namespaces.values():
             self.namespace_to_has_routes[namespace] = False
@@ -2,7 +2,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import json
 import os
-import shutil
 
 from stone.ir import (
     is_list_type,
@@ -97,35 +96,15 @@ class ObjCTypesBackend(ObjCBaseBackend):
         Each namespace will have Obj C classes to represent data types and
         routes in the Stone spec.
         """
+        self.reference_index = api.get_reference_index()
+
         rsrc_folder = os.path.join(os.path.dirname(__file__), 'obj_c_rsrc')
-        rsrc_output_folder = os.path.join(self.target_folder_path, 'Resources')
-
-        if not os.path.exists(rsrc_output_folder):
-            os.makedirs(rsrc_output_folder)
-
-        self.logger.info('Copying DBStoneValidators.{h,m} to output folder')
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBStoneValidators.h'),
-            rsrc_output_folder)
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBStoneValidators.m'),
-            rsrc_output_folder)
-        self.logger.info('Copying DBStoneSerializers.{h,m} to output folder')
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBStoneSerializers.h'),
-            rsrc_output_folder)
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBStoneSerializers.m'),
-            rsrc_output_folder)
-        self.logger.info('Copying DBStoneBase.{h,m} to output folder')
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBStoneBase.h'), rsrc_output_folder)
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBStoneBase.m'), rsrc_output_folder)
-        self.logger.info('Copying DBSerializableProtocol.h to output folder')
-        shutil.copy(
-            os.path.join(rsrc_folder, 'DBSerializableProtocol.h'),
-            rsrc_output_folder)
+        for rsrc in ('DBStoneValidators.h', 'DBStoneValidators.m',
+                     'DBStoneSerializers.h', 'DBStoneSerializers.m',
+                     'DBStoneBase.h', 'DBStoneBase.m',
+                     'DBSerializableProtocol.h'):
+            self.copy_to_relative_path(os.path.join(rsrc_folder, rsrc),
+                                       os.path.join('Resources', rsrc))
 
         jazzy_cfg = None
 
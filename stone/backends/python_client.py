@@ -85,6 +85,12 @@ _cmdline_parser.add_argument(
     type=str,
     help='The output Python package of the python_types backend.',
 )
+_cmdline_parser.add_argument(
+    '--no-docstrings',
+    action='store_true',
+    help=('Omit docstrings from the generated route methods. This makes the '
+          'module smaller and faster to import, for production builds.'),
+)
 
 
 class PythonClientBackend(CodeBackend):
@@ -92,6 +98,8 @@ class PythonClientBackend(CodeBackend):
 
     cmdline_parser = _cmdline_parser
 
+    cache_granularity = 'api'
+
     def generate(self, api):
         """Generates a module called "base".
 
@@ -336,6 +344,8 @@ class PythonClientBackend(CodeBackend):
             will be a tuple of return_data_type and extra_return-arg.
         :param str footer: Additional notes at the end of the docstring.
         """
+        if self.args.no_docstrings:
+            return
         fields = [] if is_void_type(arg_data_type) else arg_data_type.fields
         if not fields and not overview:
             # If we don't have an overview or any input parameters, we skip the
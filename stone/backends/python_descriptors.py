@@ -0,0 +1,265 @@
+"""
+Backend for generating compact, table-driven Python modules that match the
+spec.
+
+Each namespace module contains a data table describing its types, fields,
+validators, aliases and routes. The classes are synthesized from the table on
+first access by the stone_descriptors runtime, and behave like the ones
+generated by the python_types backend.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+_MYPY = False
+if _MYPY:
+    import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+
+from stone.ir import ApiNamespace  # noqa: F401 # pylint: disable=unused-import
+from stone.ir import (
+    is_alias,
+    is_boolean_type,
+    is_bytes_type,
+    is_list_type,
+    is_map_type,
+    is_nullable_type,
+    is_numeric_type,
+    is_string_type,
+    is_struct_type,
+    is_tag_ref,
+    is_timestamp_type,
+    is_union_type,
+    is_user_defined_type,
+    is_void_type,
+    unwrap_aliases,
+)
+from stone.ir import DataType  # noqa: F401 # pylint: disable=unused-import
+from stone.backend import CodeBackend, NamespaceBackendMixin
+from stone.backends.python_helpers import (
+    fmt_class,
+    fmt_func,
+    fmt_var,
+    generate_imports_for_referenced_namespaces,
+)
+
+_descriptors_import = """\
+try:
+    from . import stone_descriptors as sd
+except (SystemError, ValueError):
+    # Catch errors raised when importing a relative module when not in a package.
+    # This makes testing this file directly (outside of a package) easier.
+    import stone_descriptors as sd
+
+"""
+
+
+class PythonDescriptorsBackend(NamespaceBackendMixin, CodeBackend):
+    """
+    Generates Python modules that describe the input Stone spec as data
+    tables, from which classes are synthesized at runtime.
+    """
+
+    preserve_aliases = True
+
+    cache_granularity = 'namespace'
+
+    def generate(self, api):
+        """
+        Generates a module for each namespace.
+
+        Each namespace module holds the table for its data types, aliases and
+        routes, and installs itself with the stone_descriptors runtime.
+        """
+        rsrc_folder = os.path.join(os.path.dirname(__file__), 'python_rsrc')
+        for rsrc in ('stone_validators.py', 'stone_serializers.py',
+                     'stone_base.py', 'stone_descriptors.py'):
+            self.copy_to_relative_path(os.path.join(rsrc_folder, rsrc), rsrc)
+        self.generate_namespaces(api)
+
+    def generate_namespace(self, api, namespace):
+        with self.output_to_relative_path('{}.py'.format(namespace.name)):
+            self._generate_namespace_module(api, namespace)
+
+    def _generate_namespace_module(self, api, namespace):
+        self.emit('# -*- coding: utf-8 -*-')
+        self.emit('# Auto-generated by Stone, do not modify.')
+        self.emit('# flake8: noqa')
+        self.emit('# pylint: skip-file')
+
+        if namespace.doc is not None:
+            self.emit('"""')
+            self.emit_raw(namespace.doc)
+            self.emit('"""')
+            self.emit()
+
+        self.emit_raw(_descriptors_import)
+
+        generate_imports_for_referenced_namespaces(
+            backend=self,
+            namespace=namespace
+        )
+
+        self.generate_multiline_list(
+            [self._fmt_data_type_entry(namespace, data_type)
+             for data_type in namespace.linearize_data_types()],
+            before='_data_types = ',
+            delim=('[', ']'),
+            compact=False)
+        self.emit()
+
+        self.generate_multiline_list(
+            [self._fmt_alias_entry(namespace, alias)
+             for alias in namespace.linearize_aliases()],
+            before='_aliases = ',
+            delim=('[', ']'),
+            compact=False)
+        self.emit()
+
+        self.generate_multiline_list(
+            [self._fmt_route_entry(api.route_schema, namespace, route)
+             for route in namespace.routes],
+            before='_routes = ',
+            delim=('[', ']'),
+            compact=False)
+        self.emit()
+
+        self.emit('sd.install(globals(), _data_types, _aliases, _routes)')
+
+    def _fmt_data_type_entry(self, ns, data_type):
+        fields = ', '.join(
+            self._fmt_field(ns, field) for field in data_type.fields)
+        if data_type.parent_type:
+            parent = fmt_ref(ns, data_type.parent_type)
+        else:
+            parent = 'None'
+        if is_struct_type(data_type):
+            if data_type.has_enumerated_subtypes():
+                subtypes = '({!r}, [{}])'.format(
+                    data_type.is_catch_all(),
+                    ', '.join('({}, {})'.format(tags, fmt_ref(ns, subtype))
+                              for tags, subtype in
+                              data_type.get_all_subtypes_with_tags()))
+            else:
+                subtypes = 'None'
+            return "('struct', '{}', {}, [{}], {})".format(
+                fmt_class(data_type.name), parent, fields, subtypes)
+        else:
+            assert is_union_type(data_type), repr(data_type)
+            if data_type.catch_all_field:
+                catch_all = "'%s'" % data_type.catch_all_field.name
+            else:
+                catch_all = 'None'
+            return "('union', '{}', {}, [{}], {})".format(
+                fmt_class(data_type.name), parent, fields, catch_all)
+
+    def _fmt_field(self, ns, field):
+        name = fmt_var(field.name)
+        extras = []
+        if field.name != name:
+            extras.append("'json_name': '%s'" % field.name)
+        if getattr(field, 'has_default', False):
+            extras.append("'default': %s" % fmt_default(ns, field.default))
+        spec = generate_validator_spec(ns, field.data_type)
+        if extras:
+            return "('{}', {}, {{{}}})".format(name, spec, ', '.join(extras))
+        return "('{}', {})".format(name, spec)
+
+    def _fmt_alias_entry(self, ns, alias):
+        unwrapped_dt, _ = unwrap_aliases(alias)
+        if is_user_defined_type(unwrapped_dt):
+            # If the alias is to a composite type, the class is aliased as
+            # well.
+            class_ref = fmt_ref(ns, alias.data_type)
+        else:
+            class_ref = 'None'
+        return "('{}', {}, {})".format(
+            alias.name, generate_validator_spec(ns, alias.data_type), class_ref)
+
+    def _fmt_route_entry(self, route_schema, ns, route):
+        attrs = []
+        for field in route_schema.fields:
+            attr_key = field.name
+            attrs.append("'%s': %r" % (attr_key, route.attrs.get(attr_key)))
+        return "('{}', '{}', {!r}, {}, {}, {}, {{{}}})".format(
+            fmt_func(route.name),
+            route.name,
+            route.deprecated is not None,
+            generate_validator_spec(ns, route.arg_data_type),
+            generate_validator_spec(ns, route.result_data_type),
+            generate_validator_spec(ns, route.error_data_type),
+            ', '.join(attrs))
+
+
+def fmt_ref(ns, data_type):
+    """
+    Returns a (namespace, name) reference to a user-defined type or alias. The
+    namespace is None when the type is defined in ``ns``.
+    """
+    return '({})'.format(_fmt_ref_items(ns, data_type))
+
+
+def _fmt_ref_items(ns, data_type):
+    if ns.name != data_type.namespace.name:
+        ns_ref = "'%s'" % data_type.namespace.name
+    else:
+        ns_ref = 'None'
+    return "{}, '{}'".format(ns_ref, fmt_class(data_type.name))
+
+
+def fmt_default(ns, value):
+    if is_tag_ref(value):
+        return "('tag', {}, '{}')".format(
+            _fmt_ref_items(ns, value.union_data_type),
+            fmt_var(value.tag_name))
+    return "('value', {!r})".format(value)
+
+
+def generate_validator_spec(ns, data_type):
+    # type: (ApiNamespace, DataType) -> typing.Text
+    """
+    Given a Stone data type, returns a string with the table representation of
+    the validator that the stone_descriptors runtime will construct for it.
+    """
+    if is_nullable_type(data_type):
+        return "('Nullable', {})".format(
+            generate_validator_spec(ns, data_type.data_type))
+    elif is_list_type(data_type):
+        return "('List', {}, {})".format(
+            generate_validator_spec(ns, data_type.data_type),
+            fmt_kwargs([('min_items', data_type.min_items),
+                        ('max_items', data_type.max_items)]))
+    elif is_map_type(data_type):
+        return "('Map', {}, {})".format(
+            generate_validator_spec(ns, data_type.key_data_type),
+            generate_validator_spec(ns, data_type.value_data_type))
+    elif is_numeric_type(data_type):
+        return "('{}', {})".format(
+            data_type.name,
+            fmt_kwargs([('min_value', data_type.min_value),
+                        ('max_value', data_type.max_value)]))
+    elif is_string_type(data_type):
+        return "('String', {})".format(
+            fmt_kwargs([('min_length', data_type.min_length),
+                        ('max_length', data_type.max_length),
+                        ('pattern', data_type.pattern)]))
+    elif is_timestamp_type(data_type):
+        return "('Timestamp', {!r})".format(data_type.format)
+    elif is_user_defined_type(data_type):
+        return "('type', {})".format(_fmt_ref_items(ns, data_type))
+    elif is_alias(data_type):
+        return "('alias', {})".format(_fmt_ref_items(ns, data_type))
+    elif (is_boolean_type(data_type) or is_bytes_type(data_type) or
+          is_void_type(data_type)):
+        return "('{}', {{}})".format(data_type.name)
+    else:
+        raise AssertionError('Unsupported data type: %r' % data_type)
+
+
+def fmt_kwargs(kwargs):
+    """
+    Formats a list of (arg, value) tuples as a dict literal. Arguments with a
+    value of None are omitted.
+    """
+    return '{%s}' % ', '.join(
+        "'{}': {!r}".format(k, v) for k, v in kwargs if v is not None)
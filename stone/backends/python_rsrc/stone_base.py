@@ -8,6 +8,10 @@ than being added to a project.
 
 from __future__ import absolute_import, unicode_literals
 
+import operator
+
+from six.moves import copyreg
+
 try:
     from . import stone_validators as bv
 except (SystemError, ValueError):
@@ -20,6 +24,142 @@ if _MYPY:
     import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
 
 
+class StoneField(object):
+    """
+    A data descriptor for a field of a struct.
+
+    The value of the field is stored in the ``_<name>_value`` and
+    ``_<name>_present`` slots of the instance. Values are validated on
+    assignment with the ``_<name>_validator`` class attribute.
+    """
+
+    def __init__(self, name, nullable=False, default=None, has_default=False,
+                 type_only=False, doc=None):
+        # type: (typing.Text, bool, typing.Any, bool, bool, typing.Optional[typing.Text]) -> None
+        """
+        Args:
+            name (str): The name of the field, used to find its slots and
+                validator.
+            nullable (bool): Whether the field is nullable. A missing value
+                reads as None, and setting it to None clears it.
+            default: The value returned when the field isn't set. A default
+                that can't be constructed when the class is defined, such as a
+                union tag, can be assigned to the default attribute later.
+            has_default (bool): Whether the field has a default. Implied if
+                a default is given.
+            type_only (bool): Whether assignments should only be checked with
+                validate_type_only(), which is the case for structs and unions.
+            doc (str): Docstring of the field.
+        """
+        self.name = name
+        self.nullable = nullable
+        self.default = default
+        self.has_default = has_default or default is not None
+        self.type_only = type_only
+        self.__doc__ = doc
+        self._value_attr = str('_%s_value' % name)
+        self._present_attr = str('_%s_present' % name)
+        self._validator_attr = str('_%s_validator' % name)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if getattr(instance, self._present_attr):
+            return getattr(instance, self._value_attr)
+        elif self.nullable:
+            return None
+        elif self.has_default:
+            return self.default
+        else:
+            raise AttributeError("missing required field '%s'" % self.name)
+
+    def __set__(self, instance, val):
+        if self.nullable and val is None:
+            self.__delete__(instance)
+            return
+        validator = getattr(instance, self._validator_attr)
+        if self.type_only:
+            validator.validate_type_only(val)
+        else:
+            val = validator.validate(val)
+        setattr(instance, self._value_attr, val)
+        setattr(instance, self._present_attr, True)
+
+    def __delete__(self, instance):
+        setattr(instance, self._value_attr, None)
+        setattr(instance, self._present_attr, False)
+
+
+# Maps a struct class to its pickling helpers: a callable that returns the
+# field values in _all_fields_ order, and the (value, present) slot names for
+# each field.
+_struct_pickle_info = {}  # type: typing.Dict[typing.Any, typing.Tuple[typing.Any, typing.Any]]
+
+
+def _get_struct_pickle_info(cls):
+    info = _struct_pickle_info.get(cls)
+    if info is None:
+        field_slots = tuple(
+            (str('_%s_value' % name), str('_%s_present' % name))
+            for name, _ in cls._all_fields_)
+        value_slots = [value_slot for value_slot, _ in field_slots]
+        if len(value_slots) > 1:
+            get_values = operator.attrgetter(*value_slots)
+        elif value_slots:
+            get_value = operator.attrgetter(value_slots[0])
+            get_values = lambda obj: (get_value(obj),)  # noqa: E731
+        else:
+            get_values = lambda obj: ()  # noqa: E731
+        info = get_values, field_slots
+        _struct_pickle_info[cls] = info
+    return info
+
+
+def _is_slot_state(state, field_slots=()):
+    """
+    Returns whether state is (None, {slot: value}), the state the default
+    protocol pickles objects with slots as. Structs and unions were pickled
+    this way before they defined __getstate__. Structs always set all their
+    slots.
+    """
+    return (len(state) == 2 and state[0] is None and isinstance(state[1], dict) and
+            all(present_slot in state[1] for _, present_slot in field_slots))
+
+
+class Struct(object):
+    """
+    Base class for generated structs.
+
+    Instances are pickled as a tuple of field values in _all_fields_ order,
+    rather than by the default protocol, which stores every slot by name.
+    Instances pickled by the default protocol can still be unpickled.
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        # Fields that are present are never None.
+        return _get_struct_pickle_info(type(self))[0](self)
+
+    def __setstate__(self, state):
+        field_slots = _get_struct_pickle_info(type(self))[1]
+        if _is_slot_state(state, field_slots):
+            for slot, value in state[1].items():
+                setattr(self, slot, value)
+            return
+        if len(state) != len(field_slots):
+            raise ValueError('Expected %d field values to unpickle %s, got %d' %
+                             (len(field_slots), type(self).__name__, len(state)))
+        for (value_slot, present_slot), value in zip(field_slots, state):
+            setattr(self, value_slot, value)
+            setattr(self, present_slot, value is not None)
+
+    def __reduce__(self):
+        cls = type(self)
+        return (copyreg.__newobj__, (cls,),
+                _get_struct_pickle_info(cls)[0](self))
+
+
 class Union(object):
     # TODO(kelkabany): Possible optimization is to remove _value if a
     # union is composed of only symbols.
@@ -54,6 +194,17 @@ class Union(object):
     def __hash__(self):
         return hash((self._tag, self._value))
 
+    def __getstate__(self):
+        return self._tag, self._value
+
+    def __setstate__(self, state):
+        if _is_slot_state(state):
+            state = state[1]['_tag'], state[1]['_value']
+        self._tag, self._value = state
+
+    def __reduce__(self):
+        return copyreg.__newobj__, (type(self),), (self._tag, self._value)
+
 class Route(object):
 
     def __init__(self, name, deprecated, arg_type, result_type, error_type, attrs):
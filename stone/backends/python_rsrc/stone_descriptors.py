@@ -0,0 +1,479 @@
+"""
+Runtime support for namespaces generated by the python_descriptors backend.
+
+Instead of spelling out a class body for every data type, each generated
+namespace module holds a compact data table and hands it to :func:`install`.
+The classes, validators, aliases and routes are synthesized from that table the
+first time they are looked up, and behave like the classes generated by the
+python_types backend: they work with isinstance checks and with the
+stone_serializers module.
+
+This module should be dropped into a project that requires the use of Stone,
+next to stone_base.py and stone_validators.py.
+
+Table format
+------------
+
+A validator spec is one of::
+
+    ('Boolean', {}), ('Bytes', {}), ('Void', {})
+    ('String', {'min_length': 1, 'pattern': '...'})
+    ('Int32', {'min_value': 0}) (same for the other numeric types)
+    ('Timestamp', '%Y-%m-%dT%H:%M:%SZ')
+    ('List', item_spec, {'min_items': 1})
+    ('Map', key_spec, value_spec)
+    ('Nullable', spec)
+    ('type', namespace_or_None, 'Name')  # struct or union
+    ('alias', namespace_or_None, 'Name')
+
+A namespace of ``None`` refers to the module the table belongs to. A field is
+``(name, spec)`` or ``(name, spec, extras)`` where name is the Python
+attribute name (without the reserved keyword suffix) and extras may contain:
+
+    'default': ('value', obj) or ('tag', namespace_or_None, 'Union', 'tag')
+    'json_name': the field name in the spec, when it differs from name
+
+Data types are listed in dependency order::
+
+    ('struct', 'Name', parent_ref, fields, subtypes)
+    ('union', 'Name', parent_ref, fields, catch_all)
+
+where parent_ref is ``(namespace_or_None, 'Name')`` or None, subtypes is None
+or ``(is_catch_all, [(tags, ref), ...])`` for structs with enumerated subtypes
+and catch_all is the name of the catch-all tag or None. Aliases are
+``('Name', spec, class_ref_or_None)`` and routes are
+``('var_name', 'route_name', deprecated, arg_spec, result_spec, error_spec,
+attrs)``.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import sys
+import types
+
+import six
+
+try:
+    from . import stone_base as bb
+    from . import stone_validators as bv
+except (SystemError, ValueError):
+    # Catch errors raised when importing a relative module when not in a package.
+    # This makes testing this file directly (outside of a package) easier.
+    import stone_base as bb  # type: ignore
+    import stone_validators as bv  # type: ignore
+
+_MYPY = False
+if _MYPY:
+    import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+
+# Must be kept in sync with stone.backends.python_helpers.
+_reserved_keywords = {
+    'break',
+    'class',
+    'continue',
+    'for',
+    'pass',
+    'while',
+}
+
+
+def _rename_if_reserved(s):
+    if s in _reserved_keywords:
+        return s + '_'
+    else:
+        return s
+
+
+def install(module_globals, data_types, aliases=(), routes=()):
+    """
+    Replaces the module that is being imported with a
+    :class:`LazyNamespace` that synthesizes the described objects on
+    first access.
+
+    Args:
+        module_globals (dict): The globals() of the generated module.
+        data_types (list): Table of structs and unions.
+        aliases (list): Table of aliases.
+        routes (list): Table of routes.
+    """
+    name = module_globals['__name__']
+    module = LazyNamespace(name, module_globals, data_types, aliases, routes)
+    sys.modules[name] = module
+    return module
+
+
+class LazyNamespace(types.ModuleType):
+    """
+    A module whose data types, validators, aliases and routes are created when
+    they are first looked up.
+    """
+
+    def __init__(self, name, module_globals, data_types, aliases, routes):
+        super(LazyNamespace, self).__init__(str(name))
+        self.__dict__.update(module_globals)
+        # Keep the original module alive; on Python 2 the globals of a module
+        # are cleared when the module object is garbage collected.
+        self._sd_module = sys.modules.get(name)
+        self._sd_data_types = {entry[1]: entry for entry in data_types}
+        self._sd_aliases = {entry[0]: entry for entry in aliases}
+        self._sd_routes = {entry[0]: entry for entry in routes}
+        self._sd_route_order = [entry[0] for entry in routes]
+        self._sd_validators = {}  # type: typing.Dict[typing.Text, bv.Validator]
+        self._sd_pending = []  # type: typing.List[typing.Any]
+        self._sd_finalized = set()  # type: typing.Set[typing.Any]
+        names = ['ROUTES']
+        for type_name in self._sd_data_types:
+            names.extend([type_name, type_name + '_validator'])
+        for alias_name, _, class_ref in aliases:
+            names.append(alias_name + '_validator')
+            if class_ref is not None:
+                names.append(alias_name)
+        names.extend(self._sd_route_order)
+        self.__all__ = sorted(str(n) for n in names)
+
+    def __getattr__(self, attr):
+        if attr.startswith(('__', '_sd_')):
+            raise AttributeError(attr)
+        if attr.endswith('_validator'):
+            name = attr[:-len('_validator')]
+        else:
+            name = attr
+        if name in self._sd_data_types:
+            self._sd_get_class(name)
+        elif name in self._sd_aliases:
+            self._sd_make_alias(name)
+        elif attr in self._sd_routes:
+            self._sd_make_route(attr)
+        elif attr == 'ROUTES':
+            routes = {}
+            for var_name in self._sd_route_order:
+                route = self._sd_make_route(var_name)
+                routes[route.name] = route
+            self.__dict__[attr] = routes
+        self._sd_drain()
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            six.raise_from(AttributeError(
+                "module '%s' has no attribute '%s'" % (self.__name__, attr)), None)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self.__all__))
+
+    #
+    # Lookups
+    #
+
+    def _sd_namespace(self, ns):
+        if ns is None:
+            return self
+        return getattr(self, str(ns))
+
+    def _sd_get_class(self, name):
+        """Returns the class for a struct or union, creating it if needed."""
+        cls = self.__dict__.get(name)
+        if cls is not None:
+            return cls
+        entry = self._sd_data_types[name]
+        kind, _, parent_ref, fields, extra = entry
+        parent = self._sd_resolve_class(parent_ref) if parent_ref else None
+        if kind == 'struct':
+            cls = _make_struct_class(self.__name__, name, parent, fields)
+            if extra is not None:
+                validator = bv.StructTree(cls)
+            else:
+                validator = bv.Struct(cls)
+        else:
+            cls = _make_union_class(
+                self.__name__, name, parent, fields, extra)
+            validator = bv.Union(cls)
+        self.__dict__[name] = cls
+        self.__dict__[name + '_validator'] = validator
+        # Reflection attributes may refer to types that don't exist yet, so
+        # they are filled in once the requested type has been created.
+        self._sd_pending.append(cls)
+        return cls
+
+    def _sd_resolve_class(self, ref):
+        ns, name = ref
+        if ns is None:
+            if name in self._sd_aliases:
+                self._sd_make_alias(name)
+                return self.__dict__[name]
+            return self._sd_get_class(name)
+        return getattr(self._sd_namespace(ns), str(name))
+
+    def _sd_build_validator(self, spec, shared=True):
+        kind = spec[0]
+        if kind == 'type':
+            _, ns, name = spec
+            if ns is None:
+                self._sd_get_class(name)
+                return self.__dict__[name + '_validator']
+            return getattr(self._sd_namespace(ns), str(name + '_validator'))
+        elif kind == 'alias':
+            _, ns, name = spec
+            if ns is None:
+                return self._sd_make_alias(name)
+            return getattr(self._sd_namespace(ns), str(name + '_validator'))
+        # Identical validators are shared within the namespace, except for
+        # those of aliases, which are used as keys for custom alias validation.
+        key = repr(spec)
+        validator = self._sd_validators.get(key) if shared else None
+        if validator is not None:
+            return validator
+        if kind == 'Nullable':
+            validator = bv.Nullable(self._sd_build_validator(spec[1]))
+        elif kind == 'List':
+            validator = bv.List(
+                self._sd_build_validator(spec[1]), **_kwargs(spec[2]))
+        elif kind == 'Map':
+            validator = bv.Map(self._sd_build_validator(spec[1]),
+                               self._sd_build_validator(spec[2]))
+        elif kind == 'Timestamp':
+            validator = bv.Timestamp(spec[1])
+        else:
+            validator = getattr(bv, str(kind))(**_kwargs(spec[1]))
+        if shared:
+            self._sd_validators[key] = validator
+        return validator
+
+    def _sd_make_alias(self, name):
+        validator_name = name + '_validator'
+        if validator_name not in self.__dict__:
+            _, spec, class_ref = self._sd_aliases[name]
+            self.__dict__[validator_name] = self._sd_build_validator(
+                spec, shared=False)
+            if class_ref is not None:
+                self.__dict__[name] = self._sd_resolve_class(class_ref)
+        return self.__dict__[validator_name]
+
+    def _sd_make_route(self, var_name):
+        route = self.__dict__.get(var_name)
+        if route is None:
+            _, name, deprecated, arg, result, error, attrs = \
+                self._sd_routes[var_name]
+            route = bb.Route(
+                name,
+                deprecated,
+                self._sd_build_validator(arg),
+                self._sd_build_validator(result),
+                self._sd_build_validator(error),
+                attrs)
+            self.__dict__[var_name] = route
+        return route
+
+    def _sd_resolve_tag(self, ns, union_name, tag):
+        cls = self._sd_resolve_class((ns, union_name))
+        if ns is None:
+            # Symbols are created when the union is finalized.
+            self._sd_finalize(cls)
+        return getattr(cls, str(tag))
+
+    #
+    # Reflection attributes
+    #
+
+    def _sd_drain(self):
+        while self._sd_pending:
+            self._sd_finalize(self._sd_pending.pop())
+
+    def _sd_finalize(self, cls):
+        if cls in self._sd_finalized:
+            return
+        self._sd_finalized.add(cls)
+        entry = self._sd_data_types[cls.__name__]
+        kind, _, parent_ref, fields, extra = entry
+        parent = cls.__bases__[0] if parent_ref else None
+        if parent_ref and parent_ref[0] is None:
+            # Inherited reflection attributes are needed below.
+            self._sd_finalize(parent)
+        validators = []
+        for field in fields:
+            validator = self._sd_build_validator(field[1])
+            setattr(cls, str('_%s_validator' % field[0]), validator)
+            validators.append((field[0], validator))
+        if kind == 'struct':
+            self._sd_finalize_struct(cls, parent, fields, extra, validators)
+        else:
+            cls._tagmap = dict(validators)
+            if parent is not None:
+                cls._tagmap.update(parent._tagmap)
+            for field in fields:
+                if field[1][0] == 'Void':
+                    setattr(cls, str(field[0]), cls(field[0]))
+
+    def _sd_finalize_struct(self, cls, parent, fields, subtypes, validators):
+        for field in fields:
+            default = _extras(field).get('default')
+            if default is not None and default[0] == 'tag':
+                getattr(cls, str(_rename_if_reserved(field[0]))).default = \
+                    self._sd_resolve_tag(*default[1:])
+        field_names = set(_json_name(field) for field in fields)
+        if parent is not None:
+            cls._all_field_names_ = parent._all_field_names_.union(field_names)
+            cls._all_fields_ = parent._all_fields_ + validators
+        else:
+            cls._all_field_names_ = field_names
+            cls._all_fields_ = validators
+        if subtypes is not None or _is_tree_member(parent):
+            cls._field_names_ = field_names
+            cls._fields_ = validators
+        if subtypes is not None:
+            is_catch_all, subtype_refs = subtypes
+            cls._tag_to_subtype_ = {}
+            cls._pytype_to_tag_and_subtype_ = {}
+            for tags, ref in subtype_refs:
+                subtype = self._sd_resolve_class(ref)
+                validator = self._sd_build_validator(('type',) + tuple(ref))
+                cls._tag_to_subtype_[tags] = validator
+                cls._pytype_to_tag_and_subtype_[subtype] = (tags, validator)
+            cls._is_catch_all_ = is_catch_all
+
+
+def _kwargs(d):
+    return {str(k): v for k, v in d.items()}
+
+
+def _extras(field):
+    return field[2] if len(field) > 2 else {}
+
+
+def _json_name(field):
+    return _extras(field).get('json_name', field[0])
+
+
+def _is_tree_member(cls):
+    return cls is not None and (
+        hasattr(cls, '_tag_to_subtype_') or hasattr(cls, '_fields_'))
+
+
+#
+# Structs
+#
+
+def _make_struct_class(module_name, name, parent, fields):
+    own = []
+    for field in fields:
+        nullable = field[1][0] == 'Nullable'
+        own.append((
+            field[0],
+            _rename_if_reserved(field[0]),
+            not nullable and 'default' not in _extras(field),
+        ))
+    hierarchy = (parent._sd_fields if parent is not None else []) + own
+    attrs = {
+        '__module__': module_name,
+        '__slots__': [str(s) for var_name, _, _ in own
+                      for s in ('_%s_value' % var_name,
+                                '_%s_present' % var_name)],
+        '_has_required_fields': any(required for _, _, required in hierarchy),
+        '_sd_fields': hierarchy,
+        # Constructor arguments follow the order of Struct.all_fields.
+        '_sd_args': ([prop for _, prop, required in hierarchy if required] +
+                     [prop for _, prop, required in hierarchy if not required]),
+        '__init__': _struct_init,
+        '__repr__': _struct_repr,
+    }
+    for field, (var_name, prop_name, _) in zip(fields, own):
+        default = _extras(field).get('default')
+        attrs[str(prop_name)] = bb.StoneField(
+            var_name,
+            nullable=field[1][0] == 'Nullable',
+            default=default[1] if default and default[0] == 'value' else None,
+            has_default=default is not None,
+            type_only=_is_user_defined(field[1]))
+    bases = (parent,) if parent is not None else (bb.Struct,)
+    return type(str(name), bases, attrs)
+
+
+def _is_user_defined(spec):
+    if spec[0] == 'Nullable':
+        spec = spec[1]
+    return spec[0] == 'type'
+
+
+def _struct_init(self, *args, **kwargs):
+    cls = type(self)
+    arg_names = cls._sd_args
+    if len(args) > len(arg_names):
+        raise TypeError('__init__() takes at most %d positional arguments '
+                        '(%d given)' % (len(arg_names) + 1, len(args) + 1))
+    values = dict(zip(arg_names, args))
+    for k, v in kwargs.items():
+        if k not in arg_names:
+            raise TypeError(
+                "__init__() got an unexpected keyword argument '%s'" % k)
+        if k in values:
+            raise TypeError(
+                "__init__() got multiple values for argument '%s'" % k)
+        values[k] = v
+    for var_name, prop_name, _ in cls._sd_fields:
+        setattr(self, '_%s_value' % var_name, None)
+        setattr(self, '_%s_present' % var_name, False)
+        val = values.get(prop_name)
+        if val is not None:
+            setattr(self, prop_name, val)
+
+
+def _struct_repr(self):
+    return '%s(%s)' % (type(self).__name__, ', '.join(
+        '%s=%r' % (prop_name, getattr(self, '_%s_value' % var_name))
+        for var_name, prop_name in _args_with_var_names(type(self))))
+
+
+def _args_with_var_names(cls):
+    var_names = {prop_name: var_name
+                 for var_name, prop_name, _ in cls._sd_fields}
+    return [(var_names[prop_name], prop_name) for prop_name in cls._sd_args]
+
+
+#
+# Unions
+#
+
+def _make_union_class(module_name, name, parent, fields, catch_all):
+    attrs = {
+        '__module__': module_name,
+        '__repr__': _union_repr,
+    }
+    if catch_all is not None:
+        attrs['_catch_all'] = catch_all
+    elif parent is None:
+        attrs['_catch_all'] = None
+    for field in fields:
+        var_name = field[0]
+        if field[1][0] == 'Void':
+            # Overwritten with an instance once _tagmap is populated.
+            attrs[str(var_name)] = None
+        else:
+            attrs[str(_rename_if_reserved(var_name))] = \
+                _make_union_variant_creator(var_name)
+            attrs[str('get_%s' % var_name)] = _make_union_get_helper(var_name)
+        attrs[str('is_%s' % var_name)] = _make_union_is_set(var_name)
+    bases = (parent,) if parent is not None else (bb.Union,)
+    return type(str(name), bases, attrs)
+
+
+def _union_repr(self):
+    return '%s(%r, %r)' % (type(self).__name__, self._tag, self._value)
+
+
+def _make_union_variant_creator(tag):
+    def creator(cls, val):
+        return cls(tag, val)
+    return classmethod(creator)
+
+
+def _make_union_is_set(tag):
+    def is_set(self):
+        return self._tag == tag
+    return is_set
+
+
+def _make_union_get_helper(tag):
+    def get(self):
+        if self._tag != tag:
+            raise AttributeError("tag '%s' not set" % tag)
+        return self._value
+    return get
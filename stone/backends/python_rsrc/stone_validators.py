@@ -259,6 +259,23 @@ class Float64(Real):
     pass
 
 
+# Compiled regexes for String patterns, shared by all validators in the
+# process. Specs tend to repeat the same few patterns across many fields.
+_pattern_cache = {}  # type: typing.Dict[typing.Text, typing.Any]
+
+
+def _compile_pattern(pattern):
+    pattern_re = _pattern_cache.get(pattern)
+    if pattern_re is None:
+        try:
+            pattern_re = re.compile(r"\A(?:" + pattern + r")\Z")
+        except re.error as e:
+            raise AssertionError('Regex {!r} failed: {}'.format(
+                pattern, e.args[0]))
+        _pattern_cache[pattern] = pattern_re
+    return pattern_re
+
+
 class String(Primitive):
     """Represents a unicode string."""
 
@@ -283,11 +300,7 @@ class String(Primitive):
         self.pattern_re = None
 
         if pattern:
-            try:
-                self.pattern_re = re.compile(r"\A(?:" + pattern + r")\Z")
-            except re.error as e:
-                raise AssertionError('Regex {!r} failed: {}'.format(
-                    pattern, e.args[0]))
+            self.pattern_re = _compile_pattern(pattern)
 
     def validate(self, val):
         """
@@ -24,7 +24,7 @@ from stone.ir import (  # noqa: F401 # pylint: disable=unused-import
     is_void_type,
     unwrap_aliases,
 )
-from stone.backend import CodeBackend
+from stone.backend import CodeBackend, NamespaceBackendMixin
 from stone.backends.python_helpers import (
     class_name_for_data_type,
     fmt_func,
@@ -79,12 +79,13 @@ class ImportTracker(object):
         self.cur_namespace_adhoc_imports.add(s)
 
 
-class PythonTypeStubsBackend(CodeBackend):
+class PythonTypeStubsBackend(NamespaceBackendMixin, CodeBackend):
     """Generates Python modules to represent the input Stone spec."""
 
     # Instance var of the current namespace being generated
     cur_namespace = None
     preserve_aliases = True
+    cache_granularity = 'namespace'
     import_tracker = ImportTracker()
 
     def __init__(self, *args, **kwargs):
@@ -100,9 +101,12 @@ class PythonTypeStubsBackend(CodeBackend):
         Each namespace will have Python classes to represent data types and
         routes in the Stone spec.
         """
-        for namespace in api.namespaces.values():
-            with self.output_to_relative_path('{}.pyi'.format(namespace.name)):
-                self._generate_base_namespace_module(namespace)
+        self.generate_namespaces(api)
+
+    def generate_namespace(self, api, namespace):
+        # type: (Api, ApiNamespace) -> None
+        with self.output_to_relative_path('{}.pyi'.format(namespace.name)):
+            self._generate_base_namespace_module(namespace)
 
     def _generate_base_namespace_module(self, namespace):
         # type: (ApiNamespace) -> None
@@ -244,11 +248,11 @@ class PythonTypeStubsBackend(CodeBackend):
         if data_type.parent_type:
             extends = class_name_for_data_type(data_type.parent_type, ns)
         else:
+            # Use a handwritten base class
             if is_union_type(data_type):
-                # Use a handwritten base class
                 extends = 'bb.Union'
             else:
-                extends = 'object'
+                extends = 'bb.Struct'
         return 'class {}({}):'.format(
             class_name_for_data_type(data_type), extends)
 
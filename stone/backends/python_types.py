@@ -6,7 +6,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import os
 import re
-import shutil
+
+from collections import OrderedDict
 
 _MYPY = False
 if _MYPY:
@@ -42,7 +43,7 @@ from stone.ir import (
     unwrap_nullable,
 )
 from stone.ir import DataType  # noqa: F401 # pylint: disable=unused-import
-from stone.backend import CodeBackend
+from stone.backend import CodeBackend, NamespaceBackendMixin
 from stone.backends.python_helpers import (
     class_name_for_data_type,
     fmt_class,
@@ -66,18 +67,32 @@ _cmdline_parser.add_argument(
           '{route} for the route name. This is used to translate Stone doc '
           'references to routes to references in Python docstrings.'),
 )
+_cmdline_parser.add_argument(
+    '--no-docstrings',
+    action='store_true',
+    help=('Omit docstrings from the generated code. This makes the modules '
+          'smaller and faster to import, for production builds.'),
+)
 
 
-class PythonTypesBackend(CodeBackend):
+class PythonTypesBackend(NamespaceBackendMixin, CodeBackend):
     """Generates Python modules to represent the input Stone spec."""
 
     cmdline_parser = _cmdline_parser
 
+    cache_granularity = 'namespace'
+
     # Instance var of the current namespace being generated
     cur_namespace = None  # type: typing.Optional[ApiNamespace]
 
     preserve_aliases = True
 
+    def __init__(self, *args, **kwargs):
+        # type: (...) -> None
+        super(PythonTypesBackend, self).__init__(*args, **kwargs)
+        # The validator constants of the namespace being generated.
+        self._validator_constants = ValidatorConstants()
+
     def generate(self, api):
         """
         Generates a module for each namespace.
@@ -86,18 +101,14 @@ class PythonTypesBackend(CodeBackend):
         routes in the Stone spec.
         """
         rsrc_folder = os.path.join(os.path.dirname(__file__), 'python_rsrc')
-        self.logger.info('Copying stone_validators.py to output folder')
-        shutil.copy(os.path.join(rsrc_folder, 'stone_validators.py'),
-                    self.target_folder_path)
-        self.logger.info('Copying stone_serializers.py to output folder')
-        shutil.copy(os.path.join(rsrc_folder, 'stone_serializers.py'),
-                    self.target_folder_path)
-        self.logger.info('Copying stone_base.py to output folder')
-        shutil.copy(os.path.join(rsrc_folder, 'stone_base.py'),
-                    self.target_folder_path)
-        for namespace in api.namespaces.values():
-            with self.output_to_relative_path('{}.py'.format(namespace.name)):
-                self._generate_base_namespace_module(api, namespace)
+        for rsrc in ('stone_validators.py', 'stone_serializers.py',
+                     'stone_base.py'):
+            self.copy_to_relative_path(os.path.join(rsrc_folder, rsrc), rsrc)
+        self.generate_namespaces(api)
+
+    def generate_namespace(self, api, namespace):
+        with self.output_to_relative_path('{}.py'.format(namespace.name)):
+            self._generate_base_namespace_module(api, namespace)
 
     def _generate_base_namespace_module(self, api, namespace):
         """Creates a module for the namespace. All data types and routes are
@@ -109,7 +120,7 @@ class PythonTypesBackend(CodeBackend):
         self.emit('# flake8: noqa')
         self.emit('# pylint: skip-file')
 
-        if namespace.doc is not None:
+        if namespace.doc is not None and not self.args.no_docstrings:
             self.emit('"""')
             self.emit_raw(namespace.doc)
             self.emit('"""')
@@ -131,6 +142,8 @@ class PythonTypesBackend(CodeBackend):
         for alias in namespace.linearize_aliases():
             self._generate_alias_definition(namespace, alias)
 
+        self._generate_validator_constants(namespace)
+
         # Generate the struct->subtype tag mapping at the end so that
         # references to later-defined subtypes don't cause errors.
         for data_type in namespace.linearize_data_types():
@@ -161,6 +174,31 @@ class PythonTypesBackend(CodeBackend):
                 alias.name,
                 class_name_for_data_type(alias.data_type, namespace)))
 
+    def _generate_validator_constants(self, namespace):
+        """
+        Emits a module-level constant for each distinct validator used by the
+        fields and routes of the namespace, so that identical validators are
+        only constructed once. Aliases keep their own validators, since they
+        are used as keys for custom alias validation.
+        """
+        self._validator_constants = ValidatorConstants()
+        for data_type in namespace.linearize_data_types():
+            for field in data_type.fields:
+                self._validator(namespace, field.data_type)
+        for route in namespace.routes:
+            for data_type in (route.arg_data_type, route.result_data_type,
+                              route.error_data_type):
+                self._validator(namespace, data_type)
+        for expr, name in self._validator_constants.items():
+            self.emit('{} = {}'.format(name, expr))
+        if self._validator_constants:
+            self.emit()
+
+    def _validator(self, ns, data_type):
+        """Returns a reference to the validator for a field or route type."""
+        return generate_validator_constructor(
+            ns, data_type, self._validator_constants)
+
     def _generate_imports_for_referenced_namespaces(self, namespace):
         # type: (ApiNamespace) -> None
         generate_imports_for_referenced_namespaces(
@@ -208,11 +246,11 @@ class PythonTypesBackend(CodeBackend):
         if data_type.parent_type:
             extends = class_name_for_data_type(data_type.parent_type, ns)
         else:
+            # Use a handwritten base class
             if is_union_type(data_type):
-                # Use a handwritten base class
                 extends = 'bb.Union'
             else:
-                extends = 'object'
+                extends = 'bb.Struct'
         return 'class {}({}):'.format(
             class_name_for_data_type(data_type), extends)
 
@@ -225,7 +263,8 @@ class PythonTypesBackend(CodeBackend):
         """Defines a Python class that represents a struct in Stone."""
         self.emit(self._class_declaration_for_type(ns, data_type))
         with self.indent():
-            if data_type.has_documented_type_or_fields():
+            if (data_type.has_documented_type_or_fields() and
+                    not self.args.no_docstrings):
                 self.emit('"""')
                 if data_type.doc:
                     self.emit_wrapped_text(
@@ -245,6 +284,7 @@ class PythonTypesBackend(CodeBackend):
             self._generate_struct_class_slots(data_type)
             self._generate_struct_class_has_required_fields(data_type)
             self._generate_struct_class_init(data_type)
+            self._generate_struct_class_setstate(data_type)
             self._generate_struct_class_properties(ns, data_type)
             self._generate_struct_class_repr(data_type)
         if data_type.has_enumerated_subtypes():
@@ -307,7 +347,7 @@ class PythonTypesBackend(CodeBackend):
 
         for field in data_type.fields:
             field_name = fmt_var(field.name)
-            validator_name = generate_validator_constructor(ns, field.data_type)
+            validator_name = self._validator(ns, field.data_type)
             self.emit('{}._{}_validator = {}'.format(
                 class_name, field_name, validator_name))
 
@@ -378,6 +418,13 @@ class PythonTypesBackend(CodeBackend):
             self.generate_multiline_list(
                 items, before=before, delim=('[', ']'), compact=False)
 
+        for field in data_type.fields:
+            if field.has_default and is_tag_ref(field.default):
+                self.emit('{}.{}.default = {}'.format(
+                    class_name,
+                    fmt_var(field.name, True),
+                    self._generate_python_value(ns, field.default)))
+
         self.emit()
 
     def _generate_struct_class_init(self, data_type):
@@ -421,6 +468,42 @@ class PythonTypesBackend(CodeBackend):
                 self.emit('pass')
             self.emit()
 
+    def _generate_struct_class_setstate(self, data_type):
+        """
+        Generates __setstate__, which restores the fields of an unpickled
+        instance from the tuple returned by bb.Struct.__getstate__. It unpacks
+        the values directly into the slots, which is considerably faster than
+        setting them one by one, and leaves other states, such as those of
+        instances pickled by the default protocol, to bb.Struct.
+        """
+        fields = []
+        dt = data_type
+        while dt:
+            fields[:0] = dt.fields
+            dt = dt.parent_type
+        if not fields:
+            return
+
+        self.emit('def __setstate__(self, state):')
+        with self.indent():
+            check = 'len(state) != {}'.format(len(fields))
+            if len(fields) == 2:
+                # The state of an instance pickled by the default protocol.
+                check += ' or state[0] is None and isinstance(state[1], dict)'
+            self.emit('if {}:'.format(check))
+            with self.indent():
+                self.emit('bb.Struct.__setstate__(self, state)')
+                self.emit('return')
+            self.generate_multiline_list(
+                ['self._{}_value'.format(fmt_var(f.name)) for f in fields],
+                delim=('[', ']'),
+                after=' = state')
+            # Fields that are present are never None.
+            for f in fields:
+                self.emit('self._{0}_present = self._{0}_value is not None'
+                          .format(fmt_var(f.name)))
+        self.emit()
+
     def _generate_python_value(self, ns, value):
         if is_tag_ref(value):
             ref = '{}.{}'.format(
@@ -434,12 +517,12 @@ class PythonTypesBackend(CodeBackend):
 
     def _generate_struct_class_properties(self, ns, data_type):
         """
-        Each field of the struct has a corresponding setter and getter.
-        The setter validates the value being set.
+        Each field of the struct is a bb.StoneField descriptor, which
+        validates values on assignment.
         """
         for field in data_type.fields:
-            field_name = fmt_func(field.name)
-            field_name_reserved_check = fmt_func(field.name, True)
+            field_name = fmt_var(field.name)
+            field_name_reserved_check = fmt_var(field.name, True)
             if is_nullable_type(field.data_type):
                 field_dt = field.data_type.data_type
                 dt_nullable = True
@@ -447,62 +530,31 @@ class PythonTypesBackend(CodeBackend):
                 field_dt = field.data_type
                 dt_nullable = False
 
-            # generate getter for field
-            self.emit('@property')
-            self.emit('def {}(self):'.format(field_name_reserved_check))
-            with self.indent():
-                self.emit('"""')
+            args = ["'%s'" % field_name]
+            if dt_nullable:
+                args.append('nullable=True')
+            if field.has_default:
+                if is_tag_ref(field.default):
+                    # Union tags are assigned as defaults once they have been
+                    # created; see _generate_struct_class_reflection_attributes.
+                    args.append('has_default=True')
+                else:
+                    args.append('default={}'.format(
+                        self._generate_python_value(ns, field.default)))
+            if is_user_defined_type(field_dt):
+                args.append('type_only=True')
+            if not self.args.no_docstrings:
+                doc = ':rtype: {}'.format(
+                    self._python_type_mapping(ns, field_dt))
                 if field.doc:
-                    self.emit_wrapped_text(
-                        self.process_doc(field.doc, self._docf))
                     # Sphinx wants an extra line between the text and the
                     # rtype declaration.
-                    self.emit()
-                self.emit(':rtype: {}'.format(
-                    self._python_type_mapping(ns, field_dt)))
-                self.emit('"""')
-                self.emit('if self._{}_present:'.format(field_name))
-                with self.indent():
-                    self.emit('return self._{}_value'.format(field_name))
-
-                self.emit('else:')
-                with self.indent():
-                    if dt_nullable:
-                        self.emit('return None')
-                    elif field.has_default:
-                        self.emit('return {}'.format(
-                            self._generate_python_value(ns, field.default)))
-                    else:
-                        self.emit(
-                            "raise AttributeError(\"missing required field '%s'\")"
-                            % field_name
-                        )
-            self.emit()
-
-            # generate setter for field
-            self.emit('@{}.setter'.format(field_name_reserved_check))
-            self.emit('def {}(self, val):'.format(field_name_reserved_check))
-            with self.indent():
-                if dt_nullable:
-                    self.emit('if val is None:')
-                    with self.indent():
-                        self.emit('del self.{}'.format(field_name_reserved_check))
-                        self.emit('return')
-                if is_user_defined_type(field_dt):
-                    self.emit('self._%s_validator.validate_type_only(val)' %
-                              field_name)
-                else:
-                    self.emit('val = self._{}_validator.validate(val)'.format(field_name))
-                self.emit('self._{}_value = val'.format(field_name))
-                self.emit('self._{}_present = True'.format(field_name))
-            self.emit()
-
-            # generate deleter for field
-            self.emit('@{}.deleter'.format(field_name_reserved_check))
-            self.emit('def {}(self):'.format(field_name_reserved_check))
-            with self.indent():
-                self.emit('self._{}_value = None'.format(field_name))
-                self.emit('self._{}_present = False'.format(field_name))
+                    doc = '{}\n\n{}'.format(
+                        self.process_doc(field.doc, self._docf), doc)
+                args.append('doc={!r}'.format(doc))
+            self.generate_multiline_list(
+                args,
+                before='{} = bb.StoneField'.format(field_name_reserved_check))
             self.emit()
 
     def _generate_struct_class_repr(self, data_type):
@@ -589,40 +641,8 @@ class PythonTypesBackend(CodeBackend):
         """Defines a Python class that represents a union in Stone."""
         self.emit(self._class_declaration_for_type(ns, data_type))
         with self.indent():
-            self.emit('"""')
-            if data_type.doc:
-                self.emit_wrapped_text(
-                    self.process_doc(data_type.doc, self._docf))
-                self.emit()
-
-            self.emit_wrapped_text(
-                'This class acts as a tagged union. Only one of the ``is_*`` '
-                'methods will return true. To get the associated value of a '
-                'tag (if one exists), use the corresponding ``get_*`` method.')
-
-            if data_type.has_documented_fields():
-                self.emit()
-
-            for field in data_type.fields:
-                if not field.doc:
-                    continue
-                if is_void_type(field.data_type):
-                    ivar_doc = ':ivar {}: {}'.format(
-                        fmt_var(field.name),
-                        self.process_doc(field.doc, self._docf))
-                elif is_user_defined_type(field.data_type):
-                    ivar_doc = ':ivar {} {}: {}'.format(
-                        fmt_class(field.data_type.name),
-                        fmt_var(field.name),
-                        self.process_doc(field.doc, self._docf))
-                else:
-                    ivar_doc = ':ivar {} {}: {}'.format(
-                        self._python_type_mapping(ns, field.data_type),
-                        fmt_var(field.name), field.doc)
-                self.emit_wrapped_text(ivar_doc, subsequent_prefix='    ')
-            self.emit('"""')
-            self.emit()
-
+            if not self.args.no_docstrings:
+                self._generate_union_class_docstring(ns, data_type)
             self._generate_union_class_vars(data_type)
             self._generate_union_class_variant_creators(ns, data_type)
             self._generate_union_class_is_set(data_type)
@@ -633,6 +653,41 @@ class PythonTypesBackend(CodeBackend):
         ))
         self.emit()
 
+    def _generate_union_class_docstring(self, ns, data_type):
+        self.emit('"""')
+        if data_type.doc:
+            self.emit_wrapped_text(
+                self.process_doc(data_type.doc, self._docf))
+            self.emit()
+
+        self.emit_wrapped_text(
+            'This class acts as a tagged union. Only one of the ``is_*`` '
+            'methods will return true. To get the associated value of a '
+            'tag (if one exists), use the corresponding ``get_*`` method.')
+
+        if data_type.has_documented_fields():
+            self.emit()
+
+        for field in data_type.fields:
+            if not field.doc:
+                continue
+            if is_void_type(field.data_type):
+                ivar_doc = ':ivar {}: {}'.format(
+                    fmt_var(field.name),
+                    self.process_doc(field.doc, self._docf))
+            elif is_user_defined_type(field.data_type):
+                ivar_doc = ':ivar {} {}: {}'.format(
+                    fmt_class(field.data_type.name),
+                    fmt_var(field.name),
+                    self.process_doc(field.doc, self._docf))
+            else:
+                ivar_doc = ':ivar {} {}: {}'.format(
+                    self._python_type_mapping(ns, field.data_type),
+                    fmt_var(field.name), field.doc)
+            self.emit_wrapped_text(ivar_doc, subsequent_prefix='    ')
+        self.emit('"""')
+        self.emit()
+
     def _generate_union_class_vars(self, data_type):
         """
         Adds a _catch_all_ attribute to each class. Also, adds a placeholder
@@ -664,8 +719,7 @@ class PythonTypesBackend(CodeBackend):
 
         for field in data_type.fields:
             field_name = fmt_var(field.name)
-            validator_name = generate_validator_constructor(
-                ns, field.data_type)
+            validator_name = self._validator(ns, field.data_type)
             self.emit('{}._{}_validator = {}'.format(
                 class_name, field_name, validator_name))
 
@@ -699,16 +753,17 @@ class PythonTypesBackend(CodeBackend):
                 self.emit('@classmethod')
                 self.emit('def {}(cls, val):'.format(field_name_reserved_check))
                 with self.indent():
-                    self.emit('"""')
-                    self.emit_wrapped_text(
-                        'Create an instance of this class set to the ``%s`` '
-                        'tag with value ``val``.' % field_name)
-                    self.emit()
-                    self.emit(':param {} val:'.format(
-                        self._python_type_mapping(ns, field_dt)))
-                    self.emit(':rtype: {}'.format(
-                        fmt_class(data_type.name)))
-                    self.emit('"""')
+                    if not self.args.no_docstrings:
+                        self.emit('"""')
+                        self.emit_wrapped_text(
+                            'Create an instance of this class set to the '
+                            '``%s`` tag with value ``val``.' % field_name)
+                        self.emit()
+                        self.emit(':param {} val:'.format(
+                            self._python_type_mapping(ns, field_dt)))
+                        self.emit(':rtype: {}'.format(
+                            fmt_class(data_type.name)))
+                        self.emit('"""')
                     self.emit("return cls('{}', val)".format(field_name))
                 self.emit()
 
@@ -717,11 +772,12 @@ class PythonTypesBackend(CodeBackend):
             field_name = fmt_func(field.name)
             self.emit('def is_{}(self):'.format(field_name))
             with self.indent():
-                self.emit('"""')
-                self.emit('Check if the union tag is ``%s``.' % field_name)
-                self.emit()
-                self.emit(':rtype: bool')
-                self.emit('"""')
+                if not self.args.no_docstrings:
+                    self.emit('"""')
+                    self.emit('Check if the union tag is ``%s``.' % field_name)
+                    self.emit()
+                    self.emit(':rtype: bool')
+                    self.emit('"""')
                 self.emit("return self._tag == '{}'".format(field_name))
             self.emit()
 
@@ -741,19 +797,20 @@ class PythonTypesBackend(CodeBackend):
                         field_dt = field.data_type.data_type
                     else:
                         field_dt = field.data_type
-                    self.emit('"""')
-                    if field.doc:
-                        self.emit_wrapped_text(
-                            self.process_doc(field.doc, self._docf))
+                    if not self.args.no_docstrings:
+                        self.emit('"""')
+                        if field.doc:
+                            self.emit_wrapped_text(
+                                self.process_doc(field.doc, self._docf))
+                            self.emit()
+                        self.emit("Only call this if :meth:`is_%s` is true." %
+                                  field_name)
+                        # Sphinx wants an extra line between the text and the
+                        # rtype declaration.
                         self.emit()
-                    self.emit("Only call this if :meth:`is_%s` is true." %
-                              field_name)
-                    # Sphinx wants an extra line between the text and the
-                    # rtype declaration.
-                    self.emit()
-                    self.emit(':rtype: {}'.format(
-                        self._python_type_mapping(ns, field_dt)))
-                    self.emit('"""')
+                        self.emit(':rtype: {}'.format(
+                            self._python_type_mapping(ns, field_dt)))
+                        self.emit('"""')
 
                     self.emit('if not self.is_{}():'.format(field_name))
                     with self.indent():
@@ -799,8 +856,7 @@ class PythonTypesBackend(CodeBackend):
                 self.emit("'%s'," % route.name)
                 self.emit("%r," % (route.deprecated is not None))
                 for data_type in data_types:
-                    self.emit(
-                        generate_validator_constructor(namespace, data_type) + ',')
+                    self.emit(self._validator(namespace, data_type) + ',')
                 attrs = []
                 for field in route_schema.fields:
                     attr_key = field.name
@@ -818,17 +874,51 @@ class PythonTypesBackend(CodeBackend):
         self.emit()
 
 
-def generate_validator_constructor(ns, data_type):
+class ValidatorConstants(OrderedDict):
+    """
+    Maps validator constructor expressions to the names of the module-level
+    constants that hold them, in the order they must be defined.
+    """
+
+    def __init__(self):
+        super(ValidatorConstants, self).__init__()
+        self._counts = {}  # type: typing.Dict[typing.Text, int]
+        # Map of data type -> name of its constant. Identical data types are
+        # interned in the IR, so each one is only formatted once.
+        self.name_by_data_type = {}  # type: typing.Dict[DataType, typing.Text]
+
+    def ref(self, expr):
+        """Returns the name of the constant for expr, adding it if needed."""
+        name = self.get(expr)
+        if name is None:
+            base = expr[len('bv.'):expr.index('(')]
+            count = self._counts.get(base, 0)
+            self._counts[base] = count + 1
+            name = '_{}_validator'.format(base)
+            if count:
+                name += str(count + 1)
+            self[expr] = name
+        return name
+
+
+def generate_validator_constructor(ns, data_type, constants=None):
     """
     Given a Stone data type, returns a string that can be used to construct
     the appropriate validation object in Python.
+
+    If a ValidatorConstants is given, every constructor expression (including
+    nested ones) is added to it and the name of its constant is returned
+    instead.
     """
+    if constants is not None and data_type in constants.name_by_data_type:
+        return constants.name_by_data_type[data_type]
     dt, nullable_dt = unwrap_nullable(data_type)
+    is_ref = is_user_defined_type(dt) or is_alias(dt)
     if is_list_type(dt):
         v = generate_func_call(
             'bv.List',
             args=[
-                generate_validator_constructor(ns, dt.data_type)],
+                generate_validator_constructor(ns, dt.data_type, constants)],
             kwargs=[
                 ('min_items', dt.min_items),
                 ('max_items', dt.max_items)],
@@ -837,8 +927,10 @@ def generate_validator_constructor(ns, data_type):
         v = generate_func_call(
             'bv.Map',
             args=[
-                generate_validator_constructor(ns, dt.key_data_type),
-                generate_validator_constructor(ns, dt.value_data_type),
+                generate_validator_constructor(
+                    ns, dt.key_data_type, constants),
+                generate_validator_constructor(
+                    ns, dt.value_data_type, constants),
             ]
         )
     elif is_numeric_type(dt):
@@ -879,10 +971,16 @@ def generate_validator_constructor(ns, data_type):
     else:
         raise AssertionError('Unsupported data type: %r' % dt)
 
+    if constants is not None and not is_ref:
+        v = constants.ref(v)
+
     if nullable_dt:
-        return generate_func_call('bv.Nullable', args=[v])
-    else:
-        return v
+        v = generate_func_call('bv.Nullable', args=[v])
+        if constants is not None:
+            v = constants.ref(v)
+    if constants is not None and (nullable_dt or not is_ref):
+        constants.name_by_data_type[data_type] = v
+    return v
 
 
 def generate_func_call(name, args=None, kwargs=None):
@@ -120,6 +120,8 @@ class SwiftBackend(SwiftBaseBackend):
 
     cmdline_parser = _cmdline_parser
 
+    cache_granularity = 'api'
+
     def generate(self, api):
         for namespace in api.namespaces.values():
             ns_class = fmt_class(namespace.name)
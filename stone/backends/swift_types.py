@@ -2,7 +2,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import json
 import os
-import shutil
 
 from contextlib import contextmanager
 
@@ -15,6 +14,7 @@ from stone.ir import (
     is_void_type,
     unwrap_nullable,
 )
+from stone.backend import NamespaceBackendMixin
 from stone.backends.swift_helpers import (
     fmt_class,
     fmt_default_value,
@@ -52,7 +52,7 @@ _cmdline_parser.add_argument(
 )
 
 
-class SwiftTypesBackend(SwiftBaseBackend):
+class SwiftTypesBackend(NamespaceBackendMixin, SwiftBaseBackend):
     """
     Generates Swift modules to represent the input Stone spec.
 
@@ -118,26 +118,23 @@ class SwiftTypesBackend(SwiftBaseBackend):
     """
 
     cmdline_parser = _cmdline_parser
+
+    cache_granularity = 'namespace'
+
     def generate(self, api):
         rsrc_folder = os.path.join(os.path.dirname(__file__), 'swift_rsrc')
-        self.logger.info('Copying StoneValidators.swift to output folder')
-        shutil.copy(os.path.join(rsrc_folder, 'StoneValidators.swift'),
-                    self.target_folder_path)
-        self.logger.info('Copying StoneSerializers.swift to output folder')
-        shutil.copy(os.path.join(rsrc_folder, 'StoneSerializers.swift'),
-                    self.target_folder_path)
-        self.logger.info('Copying StoneBase.swift to output folder')
-        shutil.copy(os.path.join(rsrc_folder, 'StoneBase.swift'),
-                    self.target_folder_path)
+        for rsrc in ('StoneValidators.swift', 'StoneSerializers.swift',
+                     'StoneBase.swift'):
+            self.copy_to_relative_path(os.path.join(rsrc_folder, rsrc), rsrc)
 
         jazzy_cfg_path = os.path.join('../Format', 'jazzy.json')
         with open(jazzy_cfg_path) as jazzy_file:
             jazzy_cfg = json.load(jazzy_file)
 
+        self.generate_namespaces(api)
+
         for namespace in api.namespaces.values():
             ns_class = fmt_class(namespace.name)
-            with self.output_to_relative_path('{}.swift'.format(ns_class)):
-                self._generate_base_namespace_module(api, namespace)
             jazzy_cfg['custom_categories'][1]['children'].append(ns_class)
 
             if namespace.routes:
@@ -146,6 +143,11 @@ class SwiftTypesBackend(SwiftBaseBackend):
         with self.output_to_relative_path('../../../../.jazzy.json'):
             self.emit_raw(json.dumps(jazzy_cfg, indent=2) + '\n')
 
+    def generate_namespace(self, api, namespace):
+        ns_class = fmt_class(namespace.name)
+        with self.output_to_relative_path('{}.swift'.format(ns_class)):
+            self._generate_base_namespace_module(api, namespace)
+
     def _generate_base_namespace_module(self, api, namespace):
         self.emit_raw(base)
 
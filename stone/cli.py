@@ -9,21 +9,37 @@ import imp
 import io
 import logging
 import os
+import re
+import shlex
 import six
 import sys
+import time
 import traceback
 
 from .cli_helpers import parse_route_attr_filter
 from .compiler import (
     BackendException,
     Compiler,
+    remove_stale_outputs,
+)
+from .frontend.cache import (
+    get_cache_dir,
+    prune_cache,
 )
 from .frontend.exception import InvalidSpec
-from .frontend.frontend import specs_to_ir
+from .frontend.frontend import (
+    IRBuilder,
+    specs_to_ir,
+)
+from .sinks import (
+    is_archive_path,
+    sink_for_path,
+)
 
 _MYPY = False
 if _MYPY:
     import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+    from .sinks import OutputSink  # noqa: F401 # pylint: disable=unused-import
 
 # Hack to get around some of Python 2's standard library modules that
 # accept ascii-encodable unicode literals in lieu of strs, but where
@@ -43,19 +59,26 @@ _builtin_backends = (
     'tsd_client',
     'tsd_types',
     'python_types',
+    'python_descriptors',
     'python_type_stubs',
     'python_client',
     'swift_types',
     'swift_client',
 )
 
+# Matches a Windows drive letter at the start of the output of a target.
+_drive_re = re.compile(r'[A-Za-z]:[\\/]')
+
 # The parser for command line arguments
 _cmdline_description = (
     'Write your APIs in Stone. Use backends to translate your specification '
     'into a target language or format. The following describes arguments to '
     'the Stone CLI. To specify arguments that are specific to a backend, '
     'add "--" followed by arguments. For example, "stone python_client . '
-    'example.spec -- -h".'
+    'example.spec -- -h". To run several backends on the same specification, '
+    'give each of them with --target instead of the backend and output '
+    'arguments. For example, "stone -t python_types:py -t "python_client:py:-m '
+    'client" example.spec".'
 )
 _cmdline_parser = argparse.ArgumentParser(description=_cmdline_description)
 _cmdline_parser.add_argument(
@@ -70,13 +93,16 @@ _backend_help = (
     'The following backends are built-in: ' + ', '.join(_builtin_backends))
 _cmdline_parser.add_argument(
     'backend',
+    nargs='?',
     type=six.text_type,
-    help=_backend_help,
+    help=_backend_help + '. Omitted if --target is used.',
 )
 _cmdline_parser.add_argument(
     'output',
+    nargs='?',
     type=six.text_type,
-    help='The folder to save generated files to.',
+    help=('The folder to save generated files to, or a .zip, .tar, .tar.gz or .tgz '
+          'archive to write them to. Omitted if --target is used.'),
 )
 _cmdline_parser.add_argument(
     'spec',
@@ -87,11 +113,35 @@ _cmdline_parser.add_argument(
           'namespaces can be provided over stdin by concatenating multiple '
           'specs together.'),
 )
+_cmdline_parser.add_argument(
+    '-t',
+    '--target',
+    action='append',
+    type=six.text_type,
+    default=[],
+    help=('A backend to run, the folder to save its generated files to, and '
+          'optionally its arguments, separated by colons. Can be repeated to '
+          'run several backends on the specification, which is only parsed '
+          'once. Each backend and output are given in the same way as the '
+          'backend and output arguments, and its arguments are split like in '
+          'a shell. The output may start with a Windows drive letter, as in '
+          '"python_types:C:\\out". The options that filter the API, such as '
+          '-f, -a, -w, -b and --prune-unreachable, apply to all targets.'),
+)
 _cmdline_parser.add_argument(
     '--clean-build',
     action='store_true',
     help='The path to the template SDK for the target language.',
 )
+_cmdline_parser.add_argument(
+    '--remove-stale',
+    action='store_true',
+    help=('Remove the files that the previous run with this option generated '
+          'in the output folder, but that this run does not. Unlike '
+          '--clean-build, this leaves the files that are generated again '
+          'untouched. The generated files are listed in .stone-manifest in the '
+          'output folder.'),
+)
 _cmdline_parser.add_argument(
     '-f',
     '--filter-by-route-attr',
@@ -115,6 +165,41 @@ _cmdline_parser.add_argument(
           'attributes defined in stone_cfg.Route. Note that you can filter '
           '(-f) by attributes that are not listed here.'),
 )
+_cmdline_parser.add_argument(
+    '--prune-unreachable',
+    action='store_true',
+    help=('Remove the data types and aliases that cannot be reached from the '
+          'routes left after filtering (-f, -w and -b), so that backends do '
+          'not generate code for them. Types are reached through fields, '
+          'parent types, enumerated subtypes and aliases.'),
+)
+_cmdline_parser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=1,
+    help=('Number of processes to parse specs and run backends with. '
+          'Defaults to 1.'),
+)
+_cmdline_parser.add_argument(
+    '--cache-dir',
+    type=six.text_type,
+    help=('The folder to cache parsed specs, parse tables and generated files '
+          'in. Defaults to $STONE_CACHE_DIR if set, or stone/ in the user '
+          'cache folder.'),
+)
+_cmdline_parser.add_argument(
+    '--no-cache',
+    action='store_true',
+    help=('Parse all specs and run all backends again, rather than using '
+          'cached results.'),
+)
+_cmdline_parser.add_argument(
+    '--watch',
+    action='store_true',
+    help=('Keep running, and generate code again whenever a specification '
+          'changes. Only the changed specifications are parsed again.'),
+)
 
 _filter_ns_group = _cmdline_parser.add_mutually_exclusive_group()
 _filter_ns_group.add_argument(
@@ -146,6 +231,19 @@ def main():
         backend_args = []
 
     args = _cmdline_parser.parse_args(cli_args)
+    if args.target:
+        # The positional arguments are all specs.
+        args.spec = [arg for arg in (args.backend, args.output)
+                     if arg is not None] + args.spec
+        args.backend = args.output = None
+        if backend_args:
+            print('error: Backend arguments for a target must be given in '
+                  'the target, as backend:output:args.', file=sys.stderr)
+            sys.exit(1)
+    elif args.output is None:
+        _cmdline_parser.error('the following arguments are required: backend, output')
+    targets = _get_targets(args, backend_args)
+
     debug = False
     if args.verbose is None:
         logging_level = logging.WARNING
@@ -165,6 +263,10 @@ def main():
         # Use this if you want to define a Stone spec using a Python module.
         # The module should should contain an api variable that references a
         # :class:`stone.api.Api` object.
+        if args.watch:
+            print('error: Cannot watch an API description defined in Python.',
+                  file=sys.stderr)
+            sys.exit(1)
         try:
             api = imp.load_source('api', args.api[0]).api  # pylint: disable=redefined-outer-name
         except ImportError as e:
@@ -196,6 +298,11 @@ def main():
                 sys.exit(1)
 
         if not args.spec or read_from_stdin:
+            if args.watch:
+                print('error: Cannot watch a specification read from stdin.',
+                      file=sys.stderr)
+                sys.exit(1)
+
             specs = []
             if debug:
                 print('Reading specification from stdin.')
@@ -220,7 +327,7 @@ def main():
 
         if args.filter_by_route_attr:
             route_filter, route_filter_errors = parse_route_attr_filter(
-                args.filter_by_route_attr, debug)
+                args.filter_by_route_attr, debug, get_cache_dir(args.cache_dir))
             if route_filter_errors:
                 print('Error(s) in route filter:', file=sys.stderr)
                 for err in route_filter_errors:
@@ -230,127 +337,387 @@ def main():
         else:
             route_filter = None
 
+        if args.watch:
+            watch(specs, args, targets, route_filter, debug)
+            return None
+
         try:
             # TODO: Needs version
-            api = specs_to_ir(specs, debug=debug)
+            api = specs_to_ir(
+                specs, debug=debug, jobs=args.jobs,
+                cache_dir=_get_cache_dir(args))
         except InvalidSpec as e:
-            print('%s:%s: error: %s' % (e.path, e.lineno, e.msg), file=sys.stderr)
-            if debug:
-                print('A traceback is included below in case this is a bug in '
-                      'Stone.\n', traceback.format_exc(), file=sys.stderr)
+            _print_invalid_spec(e, debug)
             sys.exit(1)
+
         if api is None:
             print('You must fix the above parsing errors for generation to '
                   'continue.', file=sys.stderr)
             sys.exit(1)
 
-        if args.whitelist_namespace_routes:
-            for namespace_name in args.whitelist_namespace_routes:
-                if namespace_name not in api.namespaces:
-                    print('error: Whitelisted namespace missing from spec: %s' %
-                          namespace_name, file=sys.stderr)
-                    sys.exit(1)
-            for namespace in api.namespaces.values():
-                if namespace.name not in args.whitelist_namespace_routes:
-                    namespace.routes = []
-                    namespace.route_by_name = {}
-
-        if args.blacklist_namespace_routes:
-            for namespace_name in args.blacklist_namespace_routes:
-                if namespace_name not in api.namespaces:
-                    print('error: Blacklisted namespace missing from spec: %s' %
-                          namespace_name, file=sys.stderr)
-                    sys.exit(1)
-                else:
-                    api.namespaces[namespace_name].routes = []
-                    api.namespaces[namespace_name].route_by_name = {}
-
-        if route_filter:
-            for namespace in api.namespaces.values():
-                filtered_routes = []
-                for route in namespace.routes:
-                    if route_filter.eval(route):
-                        filtered_routes.append(route)
-                    else:
-                        del namespace.route_by_name[route.name]
-                namespace.routes = filtered_routes
-
-        if args.attribute:
-            attrs = set(args.attribute)
-            if ':all' in attrs:
-                attrs = {field.name for field in api.route_schema.fields}
-        else:
-            attrs = set()
+        error = _filter_api(api, args, route_filter)
+        if error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+
+    if not _run_backends(api, _load_backend_modules(targets), args.clean_build,
+                         args.jobs, args.remove_stale,
+                         _get_cache_dir(args)):
+        sys.exit(1)
+
+    if not sys.argv[0].endswith('stone'):
+        # If we aren't running from an entry_point, then return api to make it
+        # easier to do debugging.
+        return api
 
+
+def watch(specs, args, targets, route_filter, debug=False,
+          poll_interval=0.5, max_builds=None):
+    """
+    Generates code for specs, then regenerates it whenever one of the spec
+    files changes, until interrupted.
+
+    The parsed specs, the IR and the backend modules are kept between builds,
+    so only edited specs are parsed again, and only the namespaces affected by
+    them are regenerated (see :class:`stone.frontend.frontend.IRBuilder`).
+    The backends are only run again if the IR changed. Errors are reported
+    like in a normal run, and the specs are watched until they are fixed.
+
+    :param list((str, str)) specs: The path and text of each spec file.
+    :param args: The parsed command-line arguments.
+    :param list((str, str, list(str))) targets: The backend, output folder and
+        backend arguments of each target, as returned by :func:`_get_targets`.
+    :param route_filter: The parsed --filter-by-route-attr expression, if any.
+    :param bool debug: Whether to print debugging output.
+    :param float poll_interval: Seconds between checks for changed specs.
+    :param int max_builds: If set, return after this many builds, whether they
+        succeeded or not.
+    """
+    builder = IRBuilder(debug=debug, jobs=args.jobs,
+                        cache_dir=_get_cache_dir(args))
+    backend_modules = None
+    paths = [path for path, _ in specs]
+    mtimes = _get_mtimes(paths)
+    api = None
+    builds = 0
+    try:
+        while True:
+            try:
+                new_api = builder.build(specs)
+            except InvalidSpec as e:
+                _print_invalid_spec(e, debug)
+                api = None
+            else:
+                if new_api is not api:
+                    api = new_api
+                    if backend_modules is None:
+                        backend_modules = _load_backend_modules(targets)
+                    if not _generate(api, backend_modules, args, route_filter):
+                        # Generate again once the specs change, even if their
+                        # IR doesn't.
+                        api = None
+            builds += 1
+            if max_builds is not None and builds >= max_builds:
+                return
+            print('Watching %d specification(s) for changes...' % len(paths),
+                  file=sys.stderr)
+
+            specs = None
+            while specs is None:
+                while True:
+                    time.sleep(poll_interval)
+                    new_mtimes = _get_mtimes(paths)
+                    if new_mtimes != mtimes:
+                        break
+                mtimes = new_mtimes
+                specs = _read_spec_files(paths)
+    except KeyboardInterrupt:
+        pass
+
+
+def _read_spec_files(paths):
+    """
+    Returns the path and text of each spec file, or None if one of them can't
+    be read, such as while it's being replaced by an editor.
+    """
+    specs = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                specs.append((path, f.read()))
+        except IOError:
+            print("error: Specification '%s' cannot be found." % path,
+                  file=sys.stderr)
+            return None
+    return specs
+
+
+def _get_cache_dir(args):
+    """
+    Returns the folder to cache parsed specs and generated files in, or None
+    if args disable caching.
+    """
+    return None if args.no_cache else get_cache_dir(args.cache_dir)
+
+
+def _get_mtimes(paths):
+    """Returns the modification time and size of each file, to detect changes."""
+    mtimes = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            mtimes.append((stat.st_mtime, stat.st_size))
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def _generate(api, targets, args, route_filter):
+    """
+    Filters api as requested by args and runs the backends of targets on it,
+    leaving api as it was. Returns whether code was generated.
+    """
+    # The compilers freeze api while the backends run.
+    api.thaw()
+    restore_api = _save_api_state(api)
+    try:
+        error = _filter_api(api, args, route_filter)
+        if error:
+            print(error, file=sys.stderr)
+            return False
+        return _run_backends(api, targets, args.clean_build, args.jobs,
+                             args.remove_stale,
+                             _get_cache_dir(args))
+    finally:
+        api.thaw()
+        restore_api()
+
+
+def _print_invalid_spec(e, debug):
+    print('%s:%s: error: %s' % (e.path, e.lineno, e.msg), file=sys.stderr)
+    if debug:
+        print('A traceback is included below in case this is a bug in '
+              'Stone.\n', traceback.format_exc(), file=sys.stderr)
+
+
+def _filter_api(api, args, route_filter):
+    """
+    Removes the routes, route attributes and route schema fields from api that
+    args exclude, and the data types and aliases they leave unreachable if
+    args ask to. Returns an error message if args are invalid for api.
+
+    Lists and dicts are replaced rather than modified, so that the changes can
+    be undone with :func:`_save_api_state`.
+    """
+    if args.whitelist_namespace_routes:
+        for namespace_name in args.whitelist_namespace_routes:
+            if namespace_name not in api.namespaces:
+                return ('error: Whitelisted namespace missing from spec: %s' %
+                        namespace_name)
         for namespace in api.namespaces.values():
-            for route in namespace.routes:
-                for k in list(route.attrs.keys()):
-                    if k not in attrs:
-                        del route.attrs[k]
-
-        # Remove attrs that weren't specified from the route schema
-        for field in api.route_schema.fields[:]:
-            if field.name not in attrs:
-                api.route_schema.fields.remove(field)
-                del api.route_schema._fields_by_name[field.name]
+            if namespace.name not in args.whitelist_namespace_routes:
+                namespace.routes = []
+                namespace.route_by_name = {}
+
+    if args.blacklist_namespace_routes:
+        for namespace_name in args.blacklist_namespace_routes:
+            if namespace_name not in api.namespaces:
+                return ('error: Blacklisted namespace missing from spec: %s' %
+                        namespace_name)
             else:
-                attrs.remove(field.name)
+                api.namespaces[namespace_name].routes = []
+                api.namespaces[namespace_name].route_by_name = {}
 
-        # Error if specified attr isn't even a field in the route schema
-        if attrs:
-            attr = attrs.pop()
-            print('error: Attribute not defined in stone_cfg.Route: %s' %
-                  attr, file=sys.stderr)
+    if route_filter:
+        for namespace in api.namespaces.values():
+            namespace.routes = [route for route in namespace.routes
+                                if route_filter.eval(route)]
+            namespace.route_by_name = {
+                route.name: route for route in namespace.routes}
+
+    if args.attribute:
+        attrs = set(args.attribute)
+        if ':all' in attrs:
+            attrs = {field.name for field in api.route_schema.fields}
+    else:
+        attrs = set()
+
+    for namespace in api.namespaces.values():
+        for route in namespace.routes:
+            route.attrs = {k: v for k, v in route.attrs.items() if k in attrs}
+
+    # Remove attrs that weren't specified from the route schema
+    route_schema = api.route_schema
+    route_schema.fields = [
+        field for field in route_schema.fields if field.name in attrs]
+    route_schema._fields_by_name = {
+        field.name: field for field in route_schema.fields}
+    attrs.difference_update(route_schema._fields_by_name)
+
+    # Error if specified attr isn't even a field in the route schema
+    if attrs:
+        return ('error: Attribute not defined in stone_cfg.Route: %s' %
+                attrs.pop())
+
+    if args.prune_unreachable:
+        api.prune_unreachable()
+
+    return None
+
+
+def _save_api_state(api):
+    """
+    Returns a function that restores the routes, data types, aliases, imports,
+    route attributes and route schema fields of api to what they are now.
+    """
+    # The attributes of namespaces are replaced rather than modified, so a
+    # copy of them can be restored.
+    namespaces = [(namespace, vars(namespace).copy())
+                  for namespace in api.namespaces.values()]
+    routes = [(route, route.attrs)
+              for namespace in api.namespaces.values()
+              for route in namespace.routes]
+    route_schema = api.route_schema
+    fields = route_schema.fields
+    fields_by_name = route_schema._fields_by_name
+
+    def restore():
+        for namespace, attributes in namespaces:
+            vars(namespace).update(attributes)
+        for route, attrs in routes:
+            route.attrs = attrs
+        route_schema.fields = fields
+        route_schema._fields_by_name = fields_by_name
+
+    return restore
+
+
+def _get_targets(args, backend_args):
+    """
+    Returns the backend, output folder and backend arguments of each target
+    given by args.
+    """
+    if args.backend is not None:
+        return [(args.backend, args.output, backend_args)]
+    targets = []
+    for target in args.target:
+        backend, _, rest = target.partition(':')
+        # The colon of a drive letter, as in C:\out, is part of the output.
+        drive = _drive_re.match(rest)
+        end = rest.find(':', drive.end() if drive else 0)
+        output = rest if end < 0 else rest[:end]
+        if not backend or not output:
+            print("error: Target '%s' must be of the form backend:output[:args]."
+                  % target, file=sys.stderr)
             sys.exit(1)
-
-    if args.backend in _builtin_backends:
-        backend_module = __import__(
-            'stone.backends.%s' % args.backend, fromlist=[''])
-    elif not os.path.exists(args.backend):
-        print("error: Backend '%s' cannot be found." % args.backend,
+        targets.append((backend, output,
+                        shlex.split(rest[end + 1:]) if end >= 0 else []))
+    return targets
+
+
+def _load_backend_modules(targets):
+    """
+    Returns the backend, backend module, output folder and backend arguments
+    of each target.
+    """
+    backend_modules = {}  # type: typing.Dict[typing.Text, typing.Any]
+    loaded_targets = []
+    for backend, output, backend_args in targets:
+        if backend not in backend_modules:
+            backend_modules[backend] = _load_backend_module(backend)
+        loaded_targets.append((backend, backend_modules[backend], output, backend_args))
+    return loaded_targets
+
+
+def _load_backend_module(backend):
+    """Imports the module of a built-in backend or of a backend file."""
+    if backend in _builtin_backends:
+        return __import__('stone.backends.%s' % backend, fromlist=[''])
+    elif not os.path.exists(backend):
+        print("error: Backend '%s' cannot be found." % backend,
               file=sys.stderr)
         sys.exit(1)
-    elif not os.path.isfile(args.backend):
-        print("error: Backend '%s' must be a file." % args.backend,
+    elif not os.path.isfile(backend):
+        print("error: Backend '%s' must be a file." % backend,
               file=sys.stderr)
         sys.exit(1)
-    elif not Compiler.is_stone_backend(args.backend):
+    elif not Compiler.is_stone_backend(backend):
         print("error: Backend '%s' must have a .stoneg.py extension." %
-              args.backend, file=sys.stderr)
+              backend, file=sys.stderr)
         sys.exit(1)
     else:
         # A bit hacky, but we add the folder that the backend is in to our
         # python path to support the case where the backend imports other
         # files in its local directory.
-        new_python_path = os.path.dirname(args.backend)
+        new_python_path = os.path.dirname(backend)
         if new_python_path not in sys.path:
             sys.path.append(new_python_path)
         try:
-            backend_module = imp.load_source('user_backend', args.backend)
+            return imp.load_source('user_backend', backend)
         except:
             print("error: Importing backend '%s' module raised an exception:" %
-                  args.backend, file=sys.stderr)
+                  backend, file=sys.stderr)
             raise
 
-    c = Compiler(
-        api,
-        backend_module,
-        backend_args,
-        args.output,
-        clean_build=args.clean_build,
-    )
-    try:
-        c.build()
-    except BackendException as e:
-        print('%s: error: %s raised an exception:\n%s' %
-              (args.backend, e.backend_name, e.traceback),
-              file=sys.stderr)
-        sys.exit(1)
 
-    if not sys.argv[0].endswith('stone'):
-        # If we aren't running from an entry_point, then return api to make it
-        # easier to do debugging.
-        return api
+def _run_backends(api, targets, clean_build=False, jobs=1, remove_stale=False,
+                  cache_dir=None):
+    """
+    Runs the backends of each target on api. Returns whether they succeeded.
+    If remove_stale is set and they did, the files that the previous run
+    generated but that this run didn't are removed from each output folder.
+    If cache_dir is set, the outputs of backends are cached in it, and the
+    least recently used entries are then removed from it.
+
+    :param list targets: The backend, backend module, output folder or
+        archive and backend arguments of each target.
+    """
+    # Targets may share an output archive.
+    archive_sinks = {}  # type: typing.Dict[typing.Text, OutputSink]
+    try:
+        compilers = []
+        for backend, backend_module, output, backend_args in targets:
+            sink = None
+            if is_archive_path(output):
+                key = os.path.abspath(output)
+                if key not in archive_sinks:
+                    archive_sinks[key] = sink_for_path(output)
+                sink = archive_sinks[key]
+            compilers.append((backend, Compiler(
+                api,
+                backend_module,
+                backend_args,
+                output,
+                clean_build=clean_build,
+                jobs=jobs,
+                cache_dir=cache_dir,
+                sink=sink,
+            )))
+        for backend, c in compilers:
+            try:
+                c.build()
+            except BackendException as e:
+                print('%s: error: %s raised an exception:\n%s' %
+                      (backend, e.backend_name, e.traceback),
+                      file=sys.stderr)
+                return False
+    finally:
+        for sink in archive_sinks.values():
+            sink.close()
+        if cache_dir is not None:
+            prune_cache(cache_dir)
+
+    if remove_stale:
+        # Targets may share an output folder. Archives are written from
+        # scratch, so they have no stale outputs.
+        output_paths_by_folder = {}  # type: typing.Dict[typing.Text, typing.Set[typing.Text]]
+        for _, c in compilers:
+            if not is_archive_path(c.build_path):
+                output_paths_by_folder.setdefault(
+                    os.path.abspath(c.build_path), set()).update(c.output_paths)
+        for folder, output_paths in sorted(output_paths_by_folder.items()):
+            remove_stale_outputs(folder, output_paths)
+    return True
 
 
 if __name__ == '__main__':
@@ -1,7 +1,9 @@
 import abc
 import six
 
-from ply import lex, yacc
+from ply import lex
+
+from stone.frontend.cache import build_parser
 
 _MYPY = False
 if _MYPY:
@@ -120,9 +122,9 @@ class FilterExprParser(object):
         ('left', 'AND'),
     )
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, cache_dir=None):
         self.debug = debug
-        self.yacc = yacc.yacc(module=self, debug=debug, write_tables=debug)
+        self.yacc = build_parser(self, debug=debug, cache_dir=cache_dir)
         self.lexer = FilterExprLexer(debug)
         self.errors = []
 
@@ -223,15 +225,16 @@ class FilterExprPredicate(object):
         return 'EvalPred(%r, %r, %r)' % (self.op, self.lhs, self.rhs)
 
 
-def parse_route_attr_filter(route_attr_filter, debug=False):
+def parse_route_attr_filter(route_attr_filter, debug=False, cache_dir=None):
     """
     Args:
         route_attr_filter (str): The raw command-line input of the route
             filter.
+        cache_dir (str): The folder to cache the parse tables in.
 
     Returns:
         Tuple[FilterExpr, List[str]]: The second element is a list of errors.
     """
     assert isinstance(route_attr_filter, six.text_type), type(route_attr_filter)
-    parser = FilterExprParser(debug)
+    parser = FilterExprParser(debug, cache_dir)
     return parser.parse(route_attr_filter)
@@ -1,16 +1,35 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import imp
+import io
+import json
 import logging
 import inspect
+import multiprocessing
 import os
 import shutil
+import sys
 import traceback
 
-from stone.backend import (
-    Backend,
-    remove_aliases_from_api,
+import six
+from six.moves import cPickle as pickle
+
+from stone.backend import Backend
+from stone.sinks import (
+    FileSystemSink,
+    write_if_changed,
 )
 
+_MYPY = False
+if _MYPY:
+    import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+
+# Set in each worker process by _init_backend_worker().
+_worker_state = None  # type: typing.Any
+
+# The file in a build folder that lists the files generated in it.
+_manifest_name = '.stone-manifest'
+
 
 class BackendException(Exception):
     """Saves the traceback of an exception raised by a backend."""
@@ -38,7 +57,10 @@ class Compiler(object):
                  backend_module,
                  backend_args,
                  build_path,
-                 clean_build=False):
+                 clean_build=False,
+                 jobs=1,
+                 cache_dir=None,
+                 sink=None):
         """
         Creates a Compiler.
 
@@ -52,6 +74,17 @@ class Compiler(object):
             source files are compiled into the same directories.
         :param bool clean_build: If True, the build_path is removed before
             source files are compiled into them.
+        :param int jobs: The number of processes to run the backends in. If
+            greater than 1, each backend class runs in a worker process, or if
+            there's only one, it may generate namespaces in parallel.
+        :param str cache_dir: If set, the outputs of backends that declare a
+            cache_granularity are cached in this folder, and restored from it
+            instead of running the backends again.
+        :param stone.sinks.OutputSink sink: The sink that backends write
+            files to. Defaults to a FileSystemSink for build_path. Otherwise,
+            build_path is only used to name the generated files, and the
+            backends run in a single process unless the sink is shared by
+            processes.
         """
         self._logger = logging.getLogger('stone.compiler')
 
@@ -59,20 +92,36 @@ class Compiler(object):
         self.backend_module = backend_module
         self.backend_args = backend_args
         self.build_path = build_path
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.sink = sink if sink is not None else FileSystemSink(build_path)
+        # The paths of the files generated by the backends so far.
+        self.output_paths = set()  # type: typing.Set[typing.Text]
 
         # Remove existing build directory if it's a clean build
-        if clean_build and os.path.exists(self.build_path):
+        if (clean_build and isinstance(self.sink, FileSystemSink) and
+                os.path.exists(self.build_path)):
             logging.info('Cleaning existing build directory %s...',
                          self.build_path)
             shutil.rmtree(self.build_path)
 
-    def build(self):
-        """Creates outputs. Outputs are files made by a backend."""
-        if os.path.exists(self.build_path) and not os.path.isdir(self.build_path):
-            self._logger.error('Output path must be a folder if it already exists')
-            return
-        Compiler._mkdir(self.build_path)
-        self._execute_backend_on_spec()
+    def build(self, preserve_aliases=None):
+        """
+        Creates outputs. Outputs are files made by a backend.
+
+        The API is frozen first, so backends share the views derived from
+        it, and can't modify it.
+
+        :param bool preserve_aliases: If set, only runs the backends whose
+            preserve_aliases attribute is equal to it.
+        """
+        self.api.freeze()
+        if isinstance(self.sink, FileSystemSink):
+            if os.path.exists(self.build_path) and not os.path.isdir(self.build_path):
+                self._logger.error('Output path must be a folder if it already exists')
+                return
+            Compiler._mkdir(self.build_path)
+        self._execute_backend_on_spec(preserve_aliases)
 
     @staticmethod
     def _mkdir(path):
@@ -97,30 +146,185 @@ class Compiler(object):
         _, second_ext = os.path.splitext(path_without_ext)
         return second_ext == cls.backend_extension
 
-    def _execute_backend_on_spec(self):
+    def _execute_backend_on_spec(self, preserve_aliases=None):
         """Renders a source file into its final form."""
 
-        api_no_aliases_cache = None
+        backend_classes = []
         for attr_key in dir(self.backend_module):
             attr_value = getattr(self.backend_module, attr_key)
             if (inspect.isclass(attr_value) and
                     issubclass(attr_value, Backend) and
-                    not inspect.isabstract(attr_value)):
-                self._logger.info('Running backend: %s', attr_value.__name__)
-                backend = attr_value(self.build_path, self.backend_args)
-
-                if backend.preserve_aliases:
-                    api = self.api
-                else:
-                    if not api_no_aliases_cache:
-                        api_no_aliases_cache = remove_aliases_from_api(self.api)
-                    api = api_no_aliases_cache
-
-                try:
-                    backend.generate(api)
-                except:
-                    # Wrap this exception so that it isn't thought of as a bug
-                    # in the stone parser, but rather a bug in the backend.
-                    # Remove the last char of the traceback b/c it's a newline.
-                    raise BackendException(
-                        attr_value.__name__, traceback.format_exc()[:-1])
+                    not inspect.isabstract(attr_value) and
+                    preserve_aliases in (None, attr_value.preserve_aliases)):
+                backend_classes.append(attr_value)
+
+        if (self.jobs > 1 and len(backend_classes) > 1 and
+                self.sink.shared_by_processes):
+            self._execute_backends_in_parallel(backend_classes)
+            return
+
+        for backend_class in backend_classes:
+            self._logger.info('Running backend: %s', backend_class.__name__)
+            backend = backend_class(self.build_path, self.backend_args)
+            backend.jobs = self.jobs
+            backend.cache_dir = self.cache_dir
+            backend.sink = self.sink
+
+            if backend.preserve_aliases:
+                api = self.api
+            else:
+                api = self.api.without_aliases()
+
+            try:
+                _generate(backend, api)
+                self.output_paths.update(backend.output_paths)
+            except Exception:  # pylint: disable=broad-except
+                # Wrap this exception so that it isn't thought of as a bug
+                # in the stone parser, but rather a bug in the backend.
+                # Remove the last char of the traceback b/c it's a newline.
+                # The traceback is part of the exception, so it isn't chained.
+                six.raise_from(BackendException(
+                    backend_class.__name__, traceback.format_exc()[:-1]), None)
+
+    def _execute_backends_in_parallel(self, backend_classes):
+        """
+        Runs each backend class in a worker process.
+
+        The API is serialized once for all backends that preserve aliases, and
+        its view without aliases once for all others. Exceptions are raised in
+        the order of backend_classes, like when running them serially.
+        """
+        for backend_class in backend_classes:
+            # Catches invalid backend arguments before starting the workers.
+            backend_class(self.build_path, self.backend_args)
+
+        api_data = pickle.dumps(self.api, pickle.HIGHEST_PROTOCOL)
+        api_data_by_preserve_aliases = {True: api_data}
+        if not all(cls.preserve_aliases for cls in backend_classes):
+            api_data_by_preserve_aliases[False] = pickle.dumps(
+                self.api.without_aliases(), pickle.HIGHEST_PROTOCOL)
+
+        self._logger.info('Running %d backends in %d processes',
+                          len(backend_classes), min(self.jobs, len(backend_classes)))
+        pool = multiprocessing.Pool(
+            min(self.jobs, len(backend_classes)),
+            _init_backend_worker,
+            (self.backend_module.__name__, self.backend_module.__file__,
+             self.build_path, self.backend_args, self.cache_dir, self.sink,
+             api_data_by_preserve_aliases))
+        try:
+            results = pool.map(
+                _run_backend_in_worker,
+                [(cls.__name__, cls.preserve_aliases) for cls in backend_classes])
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for backend_class, (error, output_paths) in zip(backend_classes, results):
+            self.output_paths.update(output_paths)
+            if isinstance(error, SystemExit):
+                raise error
+            elif error is not None:
+                raise BackendException(backend_class.__name__, error)
+
+
+def _generate(backend, api):
+    """
+    Runs backend on api, unless its outputs are restored from the build
+    cache.
+    """
+    cache_key = None
+    if backend.cache_granularity == 'api':
+        cache_key = backend.get_cache_key(api)
+    if not backend.restore_cached_outputs(cache_key, 'the API'):
+        backend.generate(api)
+        if cache_key is not None:
+            backend.cache_outputs(cache_key, backend.output_paths)
+
+
+def _init_backend_worker(backend_module_name, backend_module_path, build_path,
+                         backend_args, cache_dir, sink, api_data_by_preserve_aliases):
+    global _worker_state  # pylint: disable=global-statement
+    module = sys.modules.get(backend_module_name)
+    if module is None or getattr(module, '__file__', None) != backend_module_path:
+        # The worker was spawned rather than forked, so the module must be
+        # loaded again. It may be a backend file, which isn't in a package.
+        if backend_module_path.endswith('.pyc'):
+            backend_module_path = backend_module_path[:-1]
+        module = imp.load_source(backend_module_name, backend_module_path)
+    _worker_state = (module, build_path, backend_args, cache_dir, sink,
+                     api_data_by_preserve_aliases, {})
+
+
+def _run_backend_in_worker(task):
+    """
+    Runs a backend class of the module the worker was initialized with.
+    Returns the traceback of its exception if it raised one, or the
+    SystemExit if it exited, and the paths of the files it generated.
+    """
+    backend_class_name, preserve_aliases = task
+    (module, build_path, backend_args, cache_dir, sink,
+     api_data_by_preserve_aliases, apis) = _worker_state
+    backend = None
+    try:
+        if preserve_aliases not in apis:
+            apis[preserve_aliases] = pickle.loads(
+                api_data_by_preserve_aliases[preserve_aliases])
+        backend = getattr(module, backend_class_name)(build_path, backend_args)
+        backend.cache_dir = cache_dir
+        backend.sink = sink
+        _generate(backend, apis[preserve_aliases])
+    except SystemExit as e:
+        # Raised again by the compiler, like when running the backend
+        # serially. If it stopped the worker, its result would never arrive.
+        return e, backend.output_paths if backend is not None else []
+    except Exception:  # pylint: disable=broad-except
+        # Remove the last char of the traceback b/c it's a newline.
+        return (traceback.format_exc()[:-1],
+                backend.output_paths if backend is not None else [])
+    return None, backend.output_paths
+
+
+def remove_stale_outputs(build_path, output_paths):
+    """
+    Removes the files that the manifest of build_path lists, but that aren't
+    in output_paths, as well as folders left empty. Then lists output_paths in
+    the manifest, so that the files that later builds don't generate are
+    removed in turn.
+
+    Unlike removing build_path before building, this leaves the files that
+    are generated again untouched.
+
+    :param str build_path: The folder that files were generated in.
+    :param output_paths: The paths of the files generated in build_path.
+        Paths outside of build_path are ignored.
+    """
+    logger = logging.getLogger('stone.compiler')
+    build_path = os.path.abspath(build_path)
+    relative_paths = set()
+    for path in output_paths:
+        relative_path = os.path.relpath(os.path.abspath(path), build_path)
+        if not (relative_path == os.pardir or
+                relative_path.startswith(os.pardir + os.sep)):
+            relative_paths.add(relative_path.replace(os.sep, '/'))
+
+    manifest_path = os.path.join(build_path, _manifest_name)
+    try:
+        with io.open(manifest_path, encoding='utf-8') as f:
+            previous_paths = json.load(f)
+    except (IOError, ValueError):
+        previous_paths = []
+
+    for relative_path in sorted(set(previous_paths) - relative_paths):
+        path = os.path.normpath(os.path.join(build_path, *relative_path.split('/')))
+        if not path.startswith(build_path + os.sep) or not os.path.isfile(path):
+            continue
+        logger.info('Removing stale output %s', path)
+        os.remove(path)
+        folder = os.path.dirname(path)
+        while folder != build_path and not os.listdir(folder):
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+
+    write_if_changed(
+        manifest_path, json.dumps(sorted(relative_paths), indent=0).encode('utf-8'))
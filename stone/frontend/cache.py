@@ -0,0 +1,259 @@
+"""
+Helpers for caching generated artifacts, such as parse tables and parsed
+specs, across stone invocations.
+
+Cached files live in a per-user cache directory. Every entry is keyed by a
+hash of everything it depends on, so stale entries are never read, and entries
+are written to a temporary file and renamed into place so that concurrent
+stone processes never see a partially written file. Stale entries are removed
+by prune_cache(), which keeps the directory under a size limit.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import inspect
+import logging
+import os
+import re
+import time
+import uuid
+
+import ply.yacc as yacc
+from six.moves import cPickle as pickle
+
+_MYPY = False
+if _MYPY:
+    import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+
+logger = logging.getLogger(str('stone.frontend.cache'))
+
+# The size, in bytes, that prune_cache() shrinks a cache directory to by
+# default.
+_max_cache_size = 256 * 1024 * 1024
+
+# The age, in seconds, after which a temporary file is assumed to be left over
+# from an interrupted write rather than being written.
+_max_temp_file_age = 60 * 60
+
+# Matches the names of cache entries and of their temporary files, so that
+# prune_cache() leaves other files in the directory alone.
+_cache_file_re = re.compile(
+    r'[a-z]+-[0-9a-f]{40}\.pickle(?P<temp>\.[0-9a-f]{32}\.tmp)?$')
+
+
+def get_cache_dir(cache_dir=None):
+    # type: (typing.Optional[typing.Text]) -> typing.Optional[typing.Text]
+    """
+    Returns the directory for cached files, creating it if needed.
+
+    The directory is cache_dir if set, $STONE_CACHE_DIR if set, and otherwise
+    stone/ under the user cache directory ($XDG_CACHE_HOME or ~/.cache).
+    Returns None if the directory can't be created.
+    """
+    if not cache_dir:
+        cache_dir = os.environ.get('STONE_CACHE_DIR')
+    if not cache_dir:
+        base_dir = (os.environ.get('XDG_CACHE_HOME') or
+                    os.path.join(os.path.expanduser('~'), '.cache'))
+        cache_dir = os.path.join(base_dir, 'stone')
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                logger.debug('Cannot create cache directory %s', cache_dir)
+                return None
+    return cache_dir
+
+
+def grammar_hash(module):
+    # type: (typing.Any) -> typing.Text
+    """
+    Returns a hash of the PLY grammar defined by module: its tokens,
+    precedence, start symbol and the BNF rules of its p_* methods, as well as
+    the version of PLY, which determines the format of the tables.
+    """
+    parts = [
+        yacc.__version__,
+        repr(getattr(module, 'start', None)),
+        repr(list(module.tokens)),
+        repr(getattr(module, 'precedence', None)),
+    ]
+    for name in sorted(dir(module)):
+        if name.startswith('p_'):
+            parts.append(name)
+            parts.append(getattr(module, name).__doc__ or '')
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def source_hash(*modules):
+    # type: (typing.Any) -> typing.Optional[typing.Text]
+    """
+    Returns a hash of the source code of modules, or None if the source of
+    one of them isn't available.
+    """
+    parts = []
+    for module in modules:
+        try:
+            parts.append(inspect.getsource(module))
+        except (IOError, TypeError):
+            return None
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def read_cache_entry(path):
+    # type: (typing.Text) -> typing.Any
+    """
+    Returns the object pickled in the file at path, or None if the file
+    doesn't exist or can't be unpickled. The modification time of the file is
+    updated, so that prune_cache() keeps recently used entries.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            obj = pickle.load(f)
+    except Exception:  # pylint: disable=broad-except
+        # A corrupt entry is treated as missing, and is overwritten.
+        logger.debug('Ignoring unreadable cache entry %s', path, exc_info=True)
+        return None
+    try:
+        os.utime(path, None)
+    except OSError:
+        # The entry was removed by another process, or is read-only.
+        pass
+    return obj
+
+
+def write_cache_entry(path, obj):
+    # type: (typing.Text, typing.Any) -> None
+    """
+    Pickles obj to the file at path. Failures are logged and otherwise
+    ignored, since the cache is only an optimization.
+    """
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        replace_file(temp_path, path)
+    except Exception:  # pylint: disable=broad-except
+        logger.debug('Cannot write cache entry %s', path, exc_info=True)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def prune_cache(cache_dir, max_size=None):
+    # type: (typing.Text, typing.Optional[int]) -> None
+    """
+    Removes the least recently used entries in cache_dir until the others
+    take up at most max_size bytes, which defaults to 256 MiB, as well as the
+    temporary files of interrupted writes. Failures are logged and otherwise
+    ignored, since entries may be removed by other stone processes.
+    """
+    if max_size is None:
+        max_size = _max_cache_size
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        logger.debug('Cannot list cache directory %s', cache_dir, exc_info=True)
+        return
+
+    now = time.time()
+    entries = []  # type: typing.List[typing.Tuple[float, int, typing.Text]]
+    removed_paths = []
+    for name in names:
+        match = _cache_file_re.match(name)
+        if not match:
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if not match.group('temp'):
+            entries.append((stat.st_mtime, stat.st_size, path))
+        elif now - stat.st_mtime > _max_temp_file_age:
+            removed_paths.append(path)
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        removed_paths.append(path)
+        total_size -= size
+
+    for path in removed_paths:
+        try:
+            os.remove(path)
+        except OSError:
+            logger.debug('Cannot remove cache entry %s', path, exc_info=True)
+
+
+def replace_file(src, dst):
+    # type: (typing.Text, typing.Text) -> None
+    """Atomically renames src to dst, replacing dst if it exists."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)  # pylint: disable=no-member,useless-suppression
+    else:
+        # Python 2 only replaces atomically on POSIX.
+        try:
+            os.rename(src, dst)
+        except OSError:
+            if not os.path.exists(dst):
+                raise
+            os.remove(dst)
+            os.rename(src, dst)
+
+
+def temp_path_for(path):
+    # type: (typing.Text) -> typing.Text
+    """Returns a unique temporary path next to path, to write it atomically."""
+    return '%s.%s.tmp' % (path, uuid.uuid4().hex)
+
+
+def build_parser(module, debug=False, cache_dir=None):
+    # type: (typing.Any, bool, typing.Optional[typing.Text]) -> typing.Any
+    """
+    Builds a PLY parser from module, like yacc.yacc(module=module), but reads
+    the LALR tables from the cache if they have been generated before. They
+    are cached in cache_dir, or by default in the directory returned by
+    :func:`get_cache_dir`.
+
+    In debug mode the tables are always generated, and written along with
+    the debug output next to the module, as yacc.yacc() does by default.
+    """
+    if debug:
+        return yacc.yacc(module=module, debug=True, write_tables=True)
+
+    cache_dir = get_cache_dir(cache_dir)
+    if cache_dir is None:
+        return yacc.yacc(module=module, debug=False, write_tables=False)
+
+    path = os.path.join(
+        cache_dir, 'parsetab-%s.pickle' % grammar_hash(module))
+    if os.path.exists(path):
+        try:
+            parser = yacc.yacc(module=module, debug=False, write_tables=False,
+                               picklefile=path)
+        except Exception:  # pylint: disable=broad-except
+            # A corrupt entry is regenerated below.
+            logger.debug('Ignoring unreadable parse tables %s', path,
+                         exc_info=True)
+        else:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return parser
+
+    temp_path = temp_path_for(path)
+    parser = yacc.yacc(module=module, debug=False, write_tables=False,
+                       picklefile=temp_path)
+    try:
+        replace_file(temp_path, path)
+    except OSError:
+        logger.debug('Cannot cache parse tables in %s', path, exc_info=True)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return parser
@@ -1,16 +1,42 @@
+from collections import OrderedDict
+import hashlib
 import logging
+import multiprocessing
+import os
 
+from . import (
+    ast as ast_module,
+    lexer as lexer_module,
+    parser as parser_module,
+)
+from .cache import (
+    grammar_hash,
+    read_cache_entry,
+    source_hash,
+    write_cache_entry,
+)
+from .ast import AstNamespace
 from .exception import InvalidSpec
 from .parser import (
     ParserFactory,
 )
-from .ir_generator import IRGenerator
+from .ir_generator import (
+    FullRebuildRequired,
+    IRGenerator,
+)
 
 logger = logging.getLogger('stone.frontend.frontend')
 
+# ParserFactory used to parse specs in each worker process.
+_worker_parser_factory = None
+
+# Hash of the code that parses specs, computed on first use. Cached ASTs are
+# only valid for the same code.
+_frontend_hash = None
+
 
 # FIXME: Version should not have a default.
-def specs_to_ir(specs, version='0.1b1', debug=False):
+def specs_to_ir(specs, version='0.1b1', debug=False, jobs=1, cache_dir=None):
     """
     Converts a collection of Stone specifications into the intermediate
     representation used by Stone backends.
@@ -25,30 +51,263 @@ def specs_to_ir(specs, version='0.1b1', debug=False):
     :param specs: `path` is never accessed and is only used to report the
         location of a bad spec to the user. `spec` is the text contents of
         a spec (.stone) file.
+    :param int jobs: Number of processes to parse the specs with. The specs
+        are parsed in the calling process if this is 1, or in debug mode.
+    :param str cache_dir: Directory to cache the ASTs of parsed specs and
+        the parse tables in, so that unchanged specs aren't parsed again. If
+        None, the ASTs aren't cached, and the parse tables are cached in the
+        default directory. Nothing is cached in debug mode.
 
     :raises: InvalidSpec
 
     :returns: stone.ir.Api
     """
 
-    parser_factory = ParserFactory(debug=debug)
-    partial_asts = []
+    partial_asts = [partial_ast for partial_ast in
+                    _parse_specs(specs, debug, jobs, cache_dir) if partial_ast]
+    return IRGenerator(partial_asts, version, debug=debug).generate_IR()
 
-    for path, text in specs:
-        logger.info('Parsing spec %s', path)
-        parser = parser_factory.get_parser()
-        if debug:
-            parser.test_lexing(text)
 
-        partial_ast = parser.parse(text, path)
+class IRBuilder(object):
+    """
+    Converts specs to IR like :func:`specs_to_ir`, but keeps the IR of the
+    last build so that the next one only generates again the namespaces
+    affected by the specs that changed, which is much faster for large APIs.
 
-        if parser.got_errors_parsing():
-            # TODO(kelkabany): Show more than one error at a time.
-            msg, lineno, path = parser.get_errors()[0]
-            raise InvalidSpec(msg, lineno, path)
-        elif len(partial_ast) == 0:
-            logger.info('Empty spec: %s', path)
+    Namespaces that weren't affected are shared with the IR of the previous
+    build, so the IR must not be modified.
+    """
+
+    def __init__(self, version='0.1b1', debug=False, jobs=1, cache_dir=None):
+        """
+        See :func:`specs_to_ir` for the parameters.
+        """
+        self.version = version
+        self.debug = debug
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        # Generator of the last successful build, its specs, and the name of
+        # the namespace of each spec, or None for empty specs.
+        self._generator = None
+        self._specs = []
+        self._namespace_name_by_spec = {}
+
+    def build(self, specs):
+        """
+        Returns the IR for the specs. The result is the same as a call to
+        :func:`specs_to_ir`.
+
+        :type specs: List[Tuple[path: str, text: str]]
+        :raises: InvalidSpec
+        :rtype: stone.ir.Api
+        """
+        specs = list(specs)
+        if self._generator is None:
+            return self._build_all(specs)
+
+        new_specs = [spec for spec in specs
+                     if spec not in self._namespace_name_by_spec]
+        namespace_name_by_spec = {}
+        partial_ast_by_spec = {}
+        for spec, partial_ast in zip(
+                new_specs, self._parse_specs(new_specs)):
+            if partial_ast and not isinstance(partial_ast[0], AstNamespace):
+                # Let the full build report the error.
+                return self._build_all(specs)
+            namespace_name_by_spec[spec] = (
+                partial_ast[0].name if partial_ast else None)
+            partial_ast_by_spec[spec] = partial_ast
+        for spec in specs:
+            if spec not in namespace_name_by_spec:
+                namespace_name_by_spec[spec] = \
+                    self._namespace_name_by_spec[spec]
+
+        # A namespace changed if its specs, or their order, changed.
+        old_specs_by_namespace = self._group_by_namespace(
+            self._specs, self._namespace_name_by_spec)
+        new_specs_by_namespace = self._group_by_namespace(
+            specs, namespace_name_by_spec)
+        common_namespace_names = (set(old_specs_by_namespace) &
+                                  set(new_specs_by_namespace))
+        if ([namespace_name for namespace_name in old_specs_by_namespace
+             if namespace_name in common_namespace_names] !=
+                [namespace_name for namespace_name in new_specs_by_namespace
+                 if namespace_name in common_namespace_names]):
+            # Namespaces are generated in order, which can affect the order
+            # of the subtypes of structs.
+            return self._build_all(specs)
+        changed = set(
+            namespace_name
+            for namespace_name in (set(old_specs_by_namespace) |
+                                   set(new_specs_by_namespace))
+            if (old_specs_by_namespace.get(namespace_name) !=
+                new_specs_by_namespace.get(namespace_name)))
+        if not changed:
+            return self._generator.api
+
+        affected = self._generator.get_affected_namespaces(changed)
+        logger.info('Generating namespaces %s again',
+                    ', '.join(sorted(affected)))
+        affected_specs = [spec for spec in specs
+                          if namespace_name_by_spec[spec] in affected]
+        unparsed_specs = [spec for spec in affected_specs
+                          if spec not in partial_ast_by_spec]
+        partial_ast_by_spec.update(
+            zip(unparsed_specs, self._parse_specs(unparsed_specs)))
+
+        generator = IRGenerator(
+            [partial_ast_by_spec[spec] for spec in affected_specs],
+            self.version, debug=self.debug, previous=self._generator,
+            regenerate=affected)
+        try:
+            api = generator.generate_IR()
+        except (InvalidSpec, FullRebuildRequired) as e:
+            # Errors are reported by a full build, so that they're the same
+            # as the ones specs_to_ir() would report.
+            logger.info('Generating all namespaces again: %s', e)
+            return self._build_all(specs)
+        self._generator = generator
+        self._specs = specs
+        self._namespace_name_by_spec = namespace_name_by_spec
+        return api
+
+    def _build_all(self, specs):
+        # The state of the last successful build is kept if this one fails,
+        # since that IR is left untouched.
+        partial_asts = self._parse_specs(specs)
+        # The generator removes the namespace declaration from each AST.
+        namespace_name_by_spec = {
+            spec: (partial_ast[0].name
+                   if partial_ast and isinstance(partial_ast[0], AstNamespace)
+                   else None)
+            for spec, partial_ast in zip(specs, partial_asts)}
+        generator = IRGenerator(
+            [partial_ast for partial_ast in partial_asts if partial_ast],
+            self.version, debug=self.debug)
+        api = generator.generate_IR()
+        self._generator = generator
+        self._specs = specs
+        self._namespace_name_by_spec = namespace_name_by_spec
+        return api
+
+    def _parse_specs(self, specs):
+        return _parse_specs(specs, self.debug, self.jobs, self.cache_dir)
+
+    @staticmethod
+    def _group_by_namespace(specs, namespace_name_by_spec):
+        specs_by_namespace = OrderedDict()
+        for spec in specs:
+            namespace_name = namespace_name_by_spec[spec]
+            if namespace_name is not None:
+                specs_by_namespace.setdefault(namespace_name, []).append(spec)
+        return specs_by_namespace
+
+
+def _parse_specs(specs, debug=False, jobs=1, cache_dir=None):
+    """
+    Parses the specs. Returns the partial AST of each spec, which is empty
+    for empty specs. See :func:`specs_to_ir` for the parameters.
+
+    :raises: InvalidSpec
+    """
+    specs = list(specs)
+    if debug:
+        cache_dir = None
+
+    cache_paths = [None] * len(specs)
+    cached_asts = {}
+    if cache_dir is not None:
+        for i, (path, text) in enumerate(specs):
+            cache_paths[i] = _ast_cache_path(cache_dir, path, text)
+            if cache_paths[i] is not None:
+                partial_ast = read_cache_entry(cache_paths[i])
+                if isinstance(partial_ast, list):
+                    logger.info('Using cached AST for spec %s', path)
+                    cached_asts[i] = partial_ast
+
+    uncached_specs = [
+        spec for i, spec in enumerate(specs) if i not in cached_asts]
+    if jobs > 1 and len(uncached_specs) > 1 and not debug:
+        # Results are returned in the order of the specs, so the first error
+        # reported is the same as when parsing serially.
+        pool = multiprocessing.Pool(min(jobs, len(uncached_specs)),
+                                    _init_parse_worker, (cache_dir,))
+        try:
+            results = iter(pool.map(_parse_spec_in_worker, uncached_specs))
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        parser_factory = ParserFactory(debug=debug, cache_dir=cache_dir)
+        results = (_parse_spec(parser_factory, path, text, debug)
+                   for path, text in uncached_specs)
+
+    partial_asts = []
+    for i, (path, _) in enumerate(specs):
+        if i in cached_asts:
+            partial_ast = cached_asts[i]
         else:
-            partial_asts.append(partial_ast)
+            partial_ast, error = next(results)
+            if error:
+                # TODO(kelkabany): Show more than one error at a time.
+                msg, lineno, path = error
+                raise InvalidSpec(msg, lineno, path)
+            if cache_paths[i] is not None:
+                write_cache_entry(cache_paths[i], partial_ast)
 
-    return IRGenerator(partial_asts, version, debug=debug).generate_IR()
+        if len(partial_ast) == 0:
+            logger.info('Empty spec: %s', path)
+        partial_asts.append(partial_ast)
+
+    return partial_asts
+
+
+def _ast_cache_path(cache_dir, path, text):
+    """
+    Returns the path of the cache entry for the AST of a spec, or None if
+    ASTs can't be cached.
+
+    The entry is keyed by the path of the spec, since it's recorded in the
+    AST for error reporting, as well as by its text and the code that parses
+    it.
+    """
+    global _frontend_hash  # pylint: disable=global-statement
+    if _frontend_hash is None:
+        frontend_source_hash = source_hash(
+            ast_module, lexer_module, parser_module)
+        if frontend_source_hash is None:
+            return None
+        _frontend_hash = '%s-%s' % (
+            frontend_source_hash, grammar_hash(ParserFactory))
+    key = hashlib.sha1()
+    for part in (_frontend_hash, path, text):
+        key.update(part.encode('utf-8'))
+        key.update(b'\0')
+    return os.path.join(cache_dir, 'ast-%s.pickle' % key.hexdigest())
+
+
+def _parse_spec(parser_factory, path, text, debug=False):
+    """
+    Parses a spec. Returns its partial AST and its first error, or None if
+    there were no errors.
+    """
+    logger.info('Parsing spec %s', path)
+    parser = parser_factory.get_parser()
+    if debug:
+        parser.test_lexing(text)
+
+    partial_ast = parser.parse(text, path)
+
+    if parser.got_errors_parsing():
+        return None, parser.get_errors()[0]
+    return partial_ast, None
+
+
+def _init_parse_worker(cache_dir):
+    global _worker_parser_factory  # pylint: disable=global-statement
+    _worker_parser_factory = ParserFactory(cache_dir=cache_dir)
+
+
+def _parse_spec_in_worker(spec):
+    path, text = spec
+    return _parse_spec(_worker_parser_factory, path, text)
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from collections import defaultdict
 import copy
 import inspect
 import logging
@@ -81,6 +82,29 @@ class Environment(dict):
     namespace_name = None  # type: typing.Optional[typing.Text]
 
 
+class FullRebuildRequired(Exception):
+    """
+    Raised when the namespaces to generate again can't be spliced into the IR
+    of a previous generator, and the whole IR must be generated instead.
+    """
+
+
+# Map of data type class -> names of the arguments of its constructor, and the
+# defaults of the last ones.
+_init_args_by_class = {}  # type: typing.Dict[type, typing.Tuple[typing.List[str], tuple]]
+
+
+def _get_init_args(data_type_class):
+    if data_type_class not in _init_args_by_class:
+        argspec = inspect.getargspec(  # pylint: disable=deprecated-method,useless-suppression
+            data_type_class.__init__)
+        argspec.args.remove('self')
+        # Unfortunately, argspec.defaults is None if there are no defaults
+        _init_args_by_class[data_type_class] = (
+            argspec.args, argspec.defaults or ())
+    return _init_args_by_class[data_type_class]
+
+
 class IRGenerator(object):
 
     data_types = [
@@ -103,13 +127,21 @@ class IRGenerator(object):
         **{data_type.__name__: data_type for data_type in data_types})
 
     # FIXME: Version should not have a default.
-    def __init__(self, partial_asts, version, debug=False):
+    def __init__(self, partial_asts, version, debug=False, previous=None,
+                 regenerate=()):
         """Creates a new tower of stone.
 
         :type specs: List[Tuple[path: str, text: str]]
         :param specs: `path` is never accessed and is only used to report the
             location of a bad spec to the user. `spec` is the text contents of
             a spec (.stone) file.
+        :param IRGenerator previous: A generator that has generated the IR of
+            a previous version of the specs. Its namespaces are reused, except
+            for the ones in `regenerate`.
+        :param Set[str] regenerate: Names of the namespaces of `previous` to
+            generate again. The partial ASTs must include all the specs of
+            these namespaces, and only them. Use
+            :meth:`get_affected_namespaces` to find them.
         """
 
         self._partial_asts = partial_asts
@@ -124,19 +156,42 @@ class IRGenerator(object):
         self._resolution_in_progress = set()  # Set[DataType]
 
         self._item_by_canonical_name = {}
+        # Map of canonical name (str) -> name of the namespace of the item
+        self._namespace_name_by_canonical_name = {}
 
         self._patch_data_by_canonical_name = {}
 
+        # Map of namespace name (str) -> names of the namespaces it imports
+        self._imports_by_namespace = {}
+
+        # Map of structural key -> data type. Parameterized data types, such
+        # as String(), List(...) and Nullable(...), are interned, so that all
+        # the references to identical types share one instance.
+        self._data_type_by_key = {}
+
+        self._previous = previous
+        self._regenerate = set(regenerate)
+        # Names of the namespaces reused from the previous generator.
+        self._reused_namespace_names = set()
+
     def generate_IR(self):
         """Parses the text of each spec and returns an API description. Returns
         None if an error was encountered during parsing."""
 
+        if self._previous is not None:
+            self._reuse_previous_namespaces()
+
         raw_api = []
         for partial_ast in self._partial_asts:
             namespace_ast_node = self._extract_namespace_ast_node(partial_ast)
+            if namespace_ast_node.name in self._reused_namespace_names:
+                raise AssertionError(
+                    'Namespace %s is reused from the previous IR.' %
+                    quote(namespace_ast_node.name))
             namespace = self.api.ensure_namespace(namespace_ast_node.name)
             base_name = self._get_base_name(namespace.name, namespace.name)
             self._item_by_canonical_name[base_name] = namespace_ast_node
+            self._namespace_name_by_canonical_name[base_name] = namespace.name
             if namespace_ast_node.doc is not None:
                 namespace.add_doc(namespace_ast_node.doc)
             raw_api.append((namespace, partial_ast))
@@ -155,6 +210,89 @@ class IRGenerator(object):
 
         return self.api
 
+    def get_affected_namespaces(self, namespace_names):
+        """
+        Returns the names of the namespaces that must be generated again if
+        the specs of the given namespaces change: the namespaces themselves,
+        the namespaces that import them, directly or not, and the namespaces
+        with structs that their structs extend, since structs keep track of
+        their subtypes.
+
+        Only valid once :meth:`generate_IR` has returned.
+
+        :param Iterable[str] namespace_names: Names of the namespaces whose
+            specs changed, were added or were removed.
+        :rtype: Set[str]
+        """
+        importers_by_namespace = defaultdict(set)
+        for namespace_name, imports in self._imports_by_namespace.items():
+            for imported_namespace_name in imports:
+                importers_by_namespace[imported_namespace_name].add(
+                    namespace_name)
+
+        parents_by_namespace = defaultdict(set)
+        for namespace in self.api.namespaces.values():
+            for data_type in namespace.data_types:
+                if (isinstance(data_type, Struct) and data_type.parent_type and
+                        data_type.parent_type.namespace.name != namespace.name):
+                    parents_by_namespace[namespace.name].add(
+                        data_type.parent_type.namespace.name)
+
+        affected = set()  # type: typing.Set[typing.Text]
+        pending = list(namespace_names)
+        while pending:
+            namespace_name = pending.pop()
+            if namespace_name not in affected:
+                affected.add(namespace_name)
+                pending.extend(importers_by_namespace[namespace_name])
+                pending.extend(parents_by_namespace[namespace_name])
+        return affected
+
+    def _reuse_previous_namespaces(self):
+        """
+        Adds the namespaces of the previous generator that aren't generated
+        again to the API, along with everything needed to resolve references
+        to them.
+        """
+        previous = self._previous
+        if 'stone_cfg' in self._regenerate:
+            # The route schema applies to the routes of every namespace.
+            raise FullRebuildRequired('The stone_cfg namespace changed.')
+        # The reused namespaces are normalized again along with the new ones,
+        # so the previous IR can't stay frozen.
+        previous.api.thaw()
+        for namespace in previous.api.namespaces.values():
+            if namespace.name in self._regenerate:
+                continue
+            self.api.namespaces[namespace.name] = namespace
+            self._reused_namespace_names.add(namespace.name)
+            self._env_by_namespace[namespace.name] = \
+                previous._env_by_namespace[namespace.name]
+            if namespace.name in previous._imports_by_namespace:
+                self._imports_by_namespace[namespace.name] = \
+                    previous._imports_by_namespace[namespace.name]
+        # The interned data types that the reused namespaces reference are
+        # shared with the namespaces generated again.
+        reused_ids = set(id(obj) for obj in self.api._get_ir_objects())
+        self._data_type_by_key = {
+            key: data_type
+            for key, data_type in previous._data_type_by_key.items()
+            if id(data_type) in reused_ids}
+        for base_name, item in previous._item_by_canonical_name.items():
+            namespace_name = previous._namespace_name_by_canonical_name[base_name]
+            if namespace_name not in self._regenerate:
+                self._item_by_canonical_name[base_name] = item
+                self._namespace_name_by_canonical_name[base_name] = \
+                    namespace_name
+
+    def _get_generated_namespaces(self):
+        """
+        Returns the namespaces to generate, which excludes the ones reused
+        from the previous generator.
+        """
+        return [namespace for namespace in self.api.namespaces.values()
+                if namespace.name not in self._reused_namespace_names]
+
     def _extract_namespace_ast_node(self, desc):
         """
         Checks that the namespace is declared first in the spec, and that only
@@ -222,6 +360,7 @@ class IRGenerator(object):
 
         if base_name not in self._item_by_canonical_name:
             self._item_by_canonical_name[base_name] = item
+            self._namespace_name_by_canonical_name[base_name] = namespace_name
         else:
             stored_item = self._item_by_canonical_name[base_name]
             msg = ("Name of %s '%s' conflicts with name of "
@@ -283,6 +422,8 @@ class IRGenerator(object):
                             (quote(namespace.name), quote(item.target)),
                             item.lineno, item.path)
                     env[item.target] = imported_env
+                    self._imports_by_namespace.setdefault(
+                        namespace.name, set()).add(item.target)
 
     def _create_alias(self, env, item):
         # NOTE: I don't like supporting forward references for aliases
@@ -404,7 +545,7 @@ class IRGenerator(object):
         Converts each struct, union, and route from a forward reference to a
         full definition.
         """
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             env = self._get_or_create_env(namespace.name)
 
             for alias in namespace.aliases:
@@ -455,6 +596,12 @@ class IRGenerator(object):
                     'A struct can only extend another struct: '
                     '%s is not a struct.' % quote(parent_type.name),
                     data_type._ast_node.lineno, data_type._ast_node.path)
+            if parent_type.namespace.name in self._reused_namespace_names:
+                # The struct would be added to the subtypes of a struct of
+                # the previous IR.
+                raise FullRebuildRequired(
+                    'Struct %s extends a struct in namespace %s.' %
+                    (quote(data_type.name), quote(parent_type.namespace.name)))
         api_type_fields = []
         for stone_field in data_type._ast_node.fields:
             api_type_field = self._create_struct_field(env, stone_field)
@@ -511,7 +658,8 @@ class IRGenerator(object):
             if not parent_type or parent_type.closed:
                 # Create a catch-all field
                 catch_all_field = UnionField(
-                    name='other', data_type=Void(), doc=None,
+                    name='other', data_type=self._intern_data_type(Void, {}),
+                    doc=None,
                     ast_node=data_type._ast_node, catch_all=True)
                 api_type_fields.append(catch_all_field)
 
@@ -524,7 +672,7 @@ class IRGenerator(object):
         because defaults that specify a union tag require the union to have
         been defined.
         """
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             for data_type in namespace.data_types:
                 # Only struct fields can have default
                 if not isinstance(data_type, Struct):
@@ -554,9 +702,12 @@ class IRGenerator(object):
         """
         Converts all routes from forward references to complete definitions.
         """
-        route_schema = self._validate_stone_cfg()
+        if self._previous is not None:
+            route_schema = self._previous.api.route_schema
+        else:
+            route_schema = self._validate_stone_cfg()
         self.api.add_route_schema(route_schema)
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             env = self._get_or_create_env(namespace.name)
             for route in namespace.routes:
                 self._populate_route_attributes_helper(env, route, route_schema)
@@ -659,8 +810,9 @@ class IRGenerator(object):
         """
         if isinstance(stone_field, AstVoidField):
             api_type_field = UnionField(
-                name=stone_field.name, data_type=Void(), doc=stone_field.doc,
-                ast_node=stone_field)
+                name=stone_field.name,
+                data_type=self._intern_data_type(Void, {}),
+                doc=stone_field.doc, ast_node=stone_field)
         else:
             data_type = self._resolve_type(env, stone_field.type_ref)
             if isinstance(data_type, Void):
@@ -685,16 +837,15 @@ class IRGenerator(object):
                 as keyword arguments.
 
         Returns:
-            stone.data_type.DataType: A parameterized instance.
+            stone.data_type.DataType: A parameterized instance. Instances
+            with the same arguments are interned, and shared.
         """
         assert issubclass(data_type_class, DataType), \
             'Expected stone.data_type.DataType, got %r' % data_type_class
 
-        argspec = inspect.getargspec(data_type_class.__init__)  # noqa: E501 # pylint: disable=deprecated-method,useless-suppression
-        argspec.args.remove('self')
-        num_args = len(argspec.args)
-        # Unfortunately, argspec.defaults is None if there are no defaults
-        num_defaults = len(argspec.defaults or ())
+        arg_names, defaults = _get_init_args(data_type_class)
+        num_args = len(arg_names)
+        num_defaults = len(defaults)
 
         pos_args, kw_args = data_type_args
 
@@ -702,7 +853,7 @@ class IRGenerator(object):
             # Report if a positional argument is missing
             raise InvalidSpec(
                 'Missing positional argument %s for %s type' %
-                (quote(argspec.args[len(pos_args)]),
+                (quote(arg_names[len(pos_args)]),
                  quote(data_type_class.__name__)),
                 *loc)
         elif (num_args - num_defaults) < len(pos_args):
@@ -714,7 +865,7 @@ class IRGenerator(object):
 
         # Map from arg name to bool indicating whether the arg has a default
         args = {}
-        for i, key in enumerate(argspec.args):
+        for i, key in enumerate(arg_names):
             args[key] = (i >= num_args - num_defaults)
 
         for key in kw_args:
@@ -731,8 +882,10 @@ class IRGenerator(object):
                     *loc)
             del args[key]
 
+        named_args = dict(zip(arg_names, pos_args))
+        named_args.update(kw_args)
         try:
-            return data_type_class(*pos_args, **kw_args)
+            return self._intern_data_type(data_type_class, named_args)
         except ParameterError as e:
             # Each data type validates its own attributes, and will raise a
             # ParameterError if the type or value is bad.
@@ -818,10 +971,35 @@ class IRGenerator(object):
                 raise InvalidSpec(
                     'Cannot mark reference to nullable type as nullable.',
                     *loc)
-            data_type = Nullable(data_type)
+            data_type = self._intern_data_type(
+                Nullable, {'data_type': data_type})
 
         return data_type
 
+    def _intern_data_type(self, data_type_class, named_args):
+        """
+        Returns the instance of data_type_class constructed with the keyword
+        arguments in named_args, which is shared with the other references
+        to the same type.
+
+        The key of an instance is its class and its arguments. Data types
+        given as arguments are part of the key by identity, since they're
+        interned as well, or are user-defined types and aliases. Arguments
+        that can't be hashed aren't interned.
+        """
+        key = (data_type_class, tuple(sorted(
+            (name, value if isinstance(value, DataType) else
+             (type(value), value))
+            for name, value in named_args.items())))
+        try:
+            data_type = self._data_type_by_key.get(key)
+        except TypeError:
+            return data_type_class(**named_args)
+        if data_type is None:
+            data_type = data_type_class(**named_args)
+            self._data_type_by_key[key] = data_type
+        return data_type
+
     def _resolve_args(self, env, args):
         """
         Resolves type references in data type arguments to data types in
@@ -878,7 +1056,7 @@ class IRGenerator(object):
     def _populate_enumerated_subtypes(self):
         # Since enumerated subtypes require forward references, resolve them
         # now that all types are populated in the environment.
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             env = self._get_or_create_env(namespace.name)
             for data_type in namespace.data_types:
                 if not (isinstance(data_type, Struct) and
@@ -929,24 +1107,31 @@ class IRGenerator(object):
         This is done in two passes. The first pass assigns examples to their
         associated types, but does not resolve references between examples for
         different types. This is because the referenced examples may not yet
-        exist. The second pass resolves references.
+        exist. The second pass resolves references, computing each referenced
+        example once.
         """
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             for data_type in namespace.data_types:
                 for example in data_type._ast_node.examples.values():
                     data_type._add_example(example)
 
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             for data_type in namespace.data_types:
                 data_type._compute_examples()
 
+        # Examples are memoized while they are computed, which also includes
+        # the types of reused namespaces that other examples reference.
+        for namespace in self.api.namespaces.values():
+            for data_type in namespace.data_types:
+                data_type._clear_computed_examples()
+
     def _validate_doc_refs(self):
         """
         Validates that all the documentation references across every docstring
         in every spec are formatted properly, have valid values, and make
         references to valid symbols.
         """
-        for namespace in self.api.namespaces.values():
+        for namespace in self._get_generated_namespaces():
             env = self._get_or_create_env(namespace.name)
             # Validate the doc refs of each api entity that has a doc
             for data_type in namespace.data_types:
@@ -1,7 +1,8 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from collections import deque
 import logging
-import os
+import re
 
 import ply.lex as lex
 
@@ -21,6 +22,26 @@ class MultiToken(object):
 # and null in several places.
 NullToken = object()
 
+# Matches the whitespace that a line starts with, without going past its end.
+_indent_re = re.compile(r'[^\S\n]*', re.UNICODE)
+
+
+# The PLY lexer built from the rules of Lexer. Building it compiles the master
+# regex of all the rules, so it's done once per process, and each Lexer gets a
+# clone bound to itself.
+_ply_lexer = None
+
+
+def _get_ply_lexer(lexer):
+    global _ply_lexer  # pylint: disable=global-statement
+    if _ply_lexer is None:
+        _ply_lexer = lex.lex(module=lexer)
+    ply_lexer = _ply_lexer.clone(lexer)
+    # Cloning rebinds the rules to lexer, but they only take effect once the
+    # state is entered again.
+    ply_lexer.begin('INITIAL')
+    return ply_lexer
+
 
 class Lexer(object):
     """
@@ -31,6 +52,8 @@ class Lexer(object):
         self.lex = None
         self.tokens_queue = None
         self.cur_indent = None
+        # Position in the input of the start of the line being lexed.
+        self._line_start = None
         self._logger = logging.getLogger('stone.stone.lexer')
         self.last_token = None
         # [(character, line number), ...]
@@ -42,9 +65,14 @@ class Lexer(object):
 
         :param str file_data: Contents of the file to lex.
         """
-        self.lex = lex.lex(module=self, **kwargs)
-        self.tokens_queue = []
+        if kwargs:
+            self.lex = lex.lex(module=self, **kwargs)
+        elif self.lex is None:
+            self.lex = _get_ply_lexer(self)
+        self.lex.lineno = 1
+        self.tokens_queue = deque()
         self.cur_indent = 0
+        self._line_start = 0
         # Hack to avoid tokenization bugs caused by files that do not end in a
         # new line.
         self.lex.input(file_data + '\n')
@@ -56,12 +84,12 @@ class Lexer(object):
         """
 
         if self.tokens_queue:
-            self.last_token = self.tokens_queue.pop(0)
+            self.last_token = self.tokens_queue.popleft()
         else:
             r = self.lex.token()
             if isinstance(r, MultiToken):
                 self.tokens_queue.extend(r.tokens)
-                self.last_token = self.tokens_queue.pop(0)
+                self.last_token = self.tokens_queue.popleft()
             else:
                 if r is None and self.cur_indent > 0:
                     if self.last_token and self.last_token.type not in ('NEWLINE', 'LINE'):
@@ -74,7 +102,7 @@ class Lexer(object):
                     self.tokens_queue.extend([dedent_token] * dedent_count)
 
                     self.cur_indent = 0
-                    self.last_token = self.tokens_queue.pop(0)
+                    self.last_token = self.tokens_queue.popleft()
                 else:
                     self.last_token = r
         return self.last_token
@@ -236,6 +264,9 @@ class Lexer(object):
         r'\"([^\\"]|(\\.))*\"'
         escaped = 0
         t.lexer.lineno += t.value.count('\n')
+        last_newline = t.value.rfind('\n')
+        if last_newline >= 0:
+            self._line_start = t.lexpos + last_newline + 1
         s = t.value[1:-1]
         new_str = ""
         for i in range(0, len(s)):
@@ -269,26 +300,29 @@ class Lexer(object):
     def t_comment(self, token):
         r'[#][^\n]*\n+'
         token.lexer.lineno += token.value.count('\n')
-        # Scan backwards from the comment to the start of the line to figure
-        # out which type of comment this is.
-        i = token.lexpos - 1
-        while i >= 0:
-            if token.lexer.lexdata[i] == '\n' or token.lexer.lexdata[i] != ' ':
-                newline_token = self._create_token('NEWLINE', '\n',
-                    token.lineno, token.lexpos + len(token.value) - 1)
-                newline_token.lexer = token.lexer
-                dent_tokens = self._search_for_next_line_dent(newline_token)
-                if token.lexer.lexdata[i] == '\n':
-                    # Comment takes the full line so ignore entirely.
-                    return dent_tokens
-                elif token.lexer.lexdata[i] != ' ':
-                    # Comment is only a partial line. Preserve newline token.
-                    if dent_tokens:
-                        dent_tokens.tokens.insert(0, newline_token)
-                        return dent_tokens
-                    else:
-                        return newline_token
-            i -= 1
+        # The comment takes the full line if it's only preceded by spaces
+        # since the start of the line.
+        line_start = self._line_start
+        full_line = (token.lexer.lexdata.count(' ', line_start, token.lexpos) ==
+                     token.lexpos - line_start)
+        self._line_start = token.lexpos + len(token.value)
+        if full_line and line_start == 0:
+            # Comment on the first line is ignored entirely.
+            return None
+        newline_token = self._create_token('NEWLINE', '\n',
+            token.lineno, token.lexpos + len(token.value) - 1)
+        newline_token.lexer = token.lexer
+        dent_tokens = self._search_for_next_line_dent(newline_token)
+        if full_line:
+            # Comment takes the full line so ignore entirely.
+            return dent_tokens
+        else:
+            # Comment is only a partial line. Preserve newline token.
+            if dent_tokens:
+                dent_tokens.tokens.insert(0, newline_token)
+                return dent_tokens
+            else:
+                return newline_token
 
     # Define a rule so we can track line numbers
     def t_NEWLINE(self, newline_token):
@@ -309,24 +343,24 @@ class Lexer(object):
         """
         assert newline_token.type == 'NEWLINE', \
             'Can only search for a dent starting from a newline.'
+        lexdata = newline_token.lexer.lexdata
         next_line_pos = newline_token.lexpos + len(newline_token.value)
-        if next_line_pos == len(newline_token.lexer.lexdata):
+        self._line_start = next_line_pos
+        if next_line_pos == len(lexdata):
             # Reached end of file
             return None
 
-        line = newline_token.lexer.lexdata[next_line_pos:].split(os.linesep, 1)[0]
-        if not line:
-            return None
-        lstripped_line = line.lstrip()
-        lstripped_line_length = len(lstripped_line)
-        if lstripped_line_length == 0:
+        # Only look at the start of the next line, rather than copying the
+        # rest of the input, so that lexing stays linear in its size.
+        content_pos = _indent_re.match(lexdata, next_line_pos).end()
+        if content_pos == len(lexdata) or lexdata[content_pos] == '\n':
             # If the next line is composed of only spaces, ignore indentation.
             return None
-        if lstripped_line[0] == '#':
+        if lexdata[content_pos] == '#':
             # If it's a comment line, ignore indentation.
             return None
 
-        indent = len(line) - lstripped_line_length
+        indent = content_pos - next_line_pos
         indent_spaces = indent - self.cur_indent
         if indent_spaces % 4 > 0:
             self.errors.append(
@@ -3,8 +3,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from collections import OrderedDict
 import logging
 
-import ply.yacc as yacc
-
+from .cache import build_parser
 from .lexer import (
     Lexer,
     NullToken,
@@ -53,9 +52,9 @@ class ParserFactory(object):
     # Ply feature: Starting grammar rule
     start = str('spec')  # PLY wants a 'str' instance; this makes it work in Python 2 and 3
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, cache_dir=None):
         self.debug = debug
-        self.yacc = yacc.yacc(module=self, debug=self.debug, write_tables=self.debug)
+        self.yacc = build_parser(self, debug=self.debug, cache_dir=cache_dir)
         self.lexer = Lexer()
         # [(token type, token value, line number), ...]
         self.errors = []
@@ -87,6 +86,8 @@ class ParserFactory(object):
         """
         assert not self.exhausted, 'Must call get_parser() to reset state.'
         self.path = path
+        self.errors = []
+        self.lexer.errors = []
         parsed_data = self.yacc.parse(data, lexer=self.lexer, debug=self.debug)
         # It generally makes sense for lexer errors to come first, because
         # those can be the root of parser errors. Also, since we only show one
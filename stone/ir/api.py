@@ -1,16 +1,25 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 # See <https://github.com/PyCQA/pylint/issues/73>
 from distutils.version import StrictVersion  # pylint: disable=import-error,no-name-in-module
 import six
 
 from .data_types import (
+    DataType,
+    Field,
+    Freezable,
+    TagRef,
+    cached_while_frozen,
     doc_unwrap,
     is_alias,
     is_composite_type,
     is_list_type,
+    is_map_type,
     is_nullable_type,
+    is_primitive_type,
+    is_struct_type,
+    is_user_defined_type,
 )
 
 _MYPY = False
@@ -19,7 +28,6 @@ if _MYPY:
 
     from .data_types import (  # noqa: F401 # pylint: disable=unused-import
         Alias,
-        DataType,
         List as DataTypeList,
         Nullable,
         UserDefined,
@@ -37,7 +45,7 @@ if _MYPY:
         NamespaceDict = typing.Dict[typing.Text, b'ApiNamespace']
 
 
-class Api(object):
+class Api(Freezable):
     """
     A full description of an API's namespaces, data types, and routes.
     """
@@ -80,6 +88,378 @@ class Api(object):
         assert self.route_schema is None
         self.route_schema = route_schema
 
+    @property
+    def frozen(self):
+        # type: () -> bool
+        """Whether the IR is frozen by :meth:`freeze`."""
+        return self._frozen
+
+    def freeze(self):
+        # type: () -> None
+        """
+        Makes the IR read-only, once it's complete. Setting an attribute of
+        the API, or of one of its namespaces, routes, data types or fields,
+        raises FrozenError, as does modifying their lists of routes, data
+        types, aliases and fields.
+
+        While the IR is frozen, the views that backends derive from it, such
+        as all_fields of structs and the linearized data types of namespaces,
+        are computed once and shared.
+        """
+        if self._frozen:
+            return
+        for obj in self._get_ir_objects():
+            obj._freeze()
+
+    def thaw(self):
+        # type: () -> None
+        """
+        Makes a frozen IR modifiable again, and forgets the views computed
+        while it was frozen.
+        """
+        for obj in self._get_ir_objects():
+            obj._thaw()
+
+    @cached_while_frozen
+    def without_aliases(self):
+        # type: () -> Api
+        """
+        Returns a view of the API without aliases, for the backends that
+        don't preserve them. References to aliases are replaced by the data
+        types they alias, and namespaces have no aliases.
+
+        The API isn't modified, so both can be used side by side. The view
+        has its own namespaces, routes, user-defined types and fields, and
+        its own lists, maps and nullables of them or of aliases, but shares
+        everything else with the API, such as primitive types, docs and
+        examples. While the API is frozen, the view is computed once, and is
+        frozen as well.
+        """
+        view = _AliasRemover().project_api(self)
+        if self._frozen:
+            view.freeze()
+        return view
+
+    @cached_while_frozen
+    def get_reference_index(self):
+        # type: () -> ApiReferenceIndex
+        """
+        Returns an index of the references between the objects of the API.
+        While the API is frozen, it's built once and shared.
+        """
+        return ApiReferenceIndex(self)
+
+    def prune_unreachable(self):
+        # type: () -> None
+        """
+        Removes the data types and aliases that the routes don't reach, and
+        the imports of namespaces that are no longer referenced.
+
+        The lists and dicts of the namespaces are replaced rather than
+        modified, so the ones saved beforehand are left as they were.
+        """
+        index = self.get_reference_index()
+        reachable = set()  # type: typing.Set[typing.Any]
+        pending = [data_type
+                   for namespace in self.namespaces.values()
+                   for route in namespace.routes
+                   for data_type in index.get_references(route)]
+        while pending:
+            data_type = pending.pop()
+            if data_type in reachable:
+                continue
+            reachable.add(data_type)
+            # The parent type and the types of the fields, or the aliased type.
+            pending.extend(index.get_references(data_type))
+            if is_struct_type(data_type) and data_type.has_enumerated_subtypes():
+                pending.extend(index.get_subtypes(data_type))
+
+        for namespace in self.namespaces.values():
+            namespace.data_types = [data_type for data_type in namespace.data_types
+                                    if data_type in reachable]
+            namespace.data_type_by_name = {
+                data_type.name: data_type for data_type in namespace.data_types}
+            namespace.aliases = [alias for alias in namespace.aliases
+                                 if alias in reachable]
+            namespace.alias_by_name = {
+                alias.name: alias for alias in namespace.aliases}
+
+        for namespace in self.namespaces.values():
+            namespace._prune_imports(index)
+
+    def _get_ir_objects(self):
+        # type: () -> typing.List[Freezable]
+        """
+        Returns the objects of the IR: the API, its namespaces, their routes
+        and aliases, and the data types and fields they reference.
+        """
+        ir_objects = [self]  # type: typing.List[typing.Any]
+        pending = []  # type: typing.List[typing.Any]
+        if self.route_schema is not None:
+            pending.append(self.route_schema)
+        for namespace in self.namespaces.values():
+            ir_objects.append(namespace)
+            ir_objects.extend(namespace.routes)
+            pending.extend(namespace.data_types)
+            pending.extend(namespace.aliases)
+            for route in namespace.routes:
+                pending.extend((route.arg_data_type, route.result_data_type,
+                                route.error_data_type))
+        seen = set()  # type: typing.Set[int]
+        while pending:
+            data_type = pending.pop()
+            if data_type is None or id(data_type) in seen:
+                continue
+            seen.add(id(data_type))
+            ir_objects.append(data_type)
+            if is_user_defined_type(data_type):
+                ir_objects.extend(data_type.fields)
+                pending.extend(field.data_type for field in data_type.fields)
+            elif is_map_type(data_type):
+                pending.extend((data_type.key_data_type,
+                                data_type.value_data_type))
+            else:
+                # Aliases, lists and nullables wrap a data type.
+                pending.append(getattr(data_type, 'data_type', None))
+        return ir_objects
+
+
+# The attributes of IR objects that aren't copied to the alias-free view,
+# which is frozen separately.
+_unprojected_attributes = ('_frozen', '_frozen_views')
+
+
+class _AliasRemover(object):
+    """
+    Builds the view of an API returned by :meth:`Api.without_aliases`. Each
+    object of the API is copied once, so that the view has the same
+    structure as the API.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        # Map of id of an object of the API -> its copy in the view.
+        self._copies = {}  # type: typing.Dict[int, typing.Any]
+        # Map of structural key -> composite type of the view, so that types
+        # that only differ by the aliases they reference are interned.
+        self._composite_by_key = {}  # type: typing.Dict[typing.Any, DataType]
+        # Copies whose references to other objects remain to be projected.
+        # User-defined types reference each other in cycles, so they're
+        # projected iteratively rather than recursively.
+        self._pending = []  # type: typing.List[typing.Any]
+
+    def project_api(self, api):
+        # type: (Api) -> Api
+        view = self._project(api)
+        while self._pending:
+            self._project_references(self._pending.pop())
+        return view
+
+    def _project(self, value):
+        # type: (typing.Any) -> typing.Any
+        """Returns the counterpart of value in the view."""
+        while is_alias(value):
+            value = value.data_type
+        if (not isinstance(value, (Freezable, TagRef, DeprecationInfo)) or
+                is_primitive_type(value)):
+            return value
+        view_value = self._copies.get(id(value))
+        if view_value is None:
+            cls = type(value)
+            view_value = cls.__new__(cls)
+            view_value.__dict__.update(value.__dict__)
+            if is_composite_type(value) and not is_user_defined_type(value):
+                # Lists, maps and nullables only wrap other types. They're
+                # shared with the API if the types they wrap are.
+                self._project_references(view_value)
+                state = view_value.__dict__
+                if all(state.get(name) is attr
+                       for name, attr in value.__dict__.items()
+                       if name not in _unprojected_attributes):
+                    view_value = value
+                key = (cls, tuple(sorted(
+                    (name, id(attr) if isinstance(attr, DataType) else attr)
+                    for name, attr in state.items())))
+                view_value = self._composite_by_key.setdefault(key, view_value)
+            else:
+                self._pending.append(view_value)
+            self._copies[id(value)] = view_value
+        return view_value
+
+    def _project_references(self, view_value):
+        # type: (typing.Any) -> None
+        state = view_value.__dict__
+        for name in _unprojected_attributes:
+            state.pop(name, None)
+        if isinstance(view_value, ApiNamespace):
+            state['aliases'] = []
+            state['alias_by_name'] = {}
+        for name, attr in list(state.items()):
+            if isinstance(attr, list):
+                state[name] = [self._project(item) for item in attr]
+            elif type(attr) in (dict, OrderedDict):
+                state[name] = type(attr)(
+                    (self._project(k), self._project(v))
+                    for k, v in attr.items())
+            else:
+                state[name] = self._project(attr)
+
+
+class ApiReferenceIndex(object):
+    """
+    Cross references between the objects of an API, built by
+    :meth:`Api.get_reference_index`.
+
+    A field, alias or route references the user-defined types and aliases
+    that its data types are, or wrap in lists, nullables and maps. A
+    user-defined type references what its own fields reference and its
+    parent type, and a namespace references what its data types, aliases and
+    routes do. References to an alias are to the alias itself, which in turn
+    references the type it aliases.
+    """
+
+    def __init__(self, api):
+        # type: (Api) -> None
+        self._references = {}  # type: typing.Dict[typing.Any, typing.List[DataType]]
+        self._referrers = defaultdict(list)  # type: typing.Dict[DataType, typing.List[typing.Any]]
+        self._subtypes = defaultdict(list)  # type: typing.Dict[DataType, typing.List[UserDefined]]
+        self._owners = {}  # type: typing.Dict[typing.Any, typing.Any]
+        # Map of route -> references of its argument, result and error.
+        self._route_io_references = {}  # type: typing.Dict[ApiRoute, typing.Tuple[typing.Any, ...]]
+
+        data_types = []  # type: typing.List[UserDefined]
+        for namespace in api.namespaces.values():
+            for data_type in namespace.data_types:
+                self._owners[data_type] = namespace
+                data_types.append(data_type)
+            for alias in namespace.aliases:
+                self._owners[alias] = namespace
+                self._add(alias, _get_wrapped_references(alias.data_type))
+            for route in namespace.routes:
+                self._owners[route] = namespace
+                io_references = tuple(
+                    _get_wrapped_references(data_type)
+                    for data_type in (route.arg_data_type,
+                                      route.result_data_type,
+                                      route.error_data_type))
+                self._route_io_references[route] = io_references
+                self._add(route, [ref for refs in io_references for ref in refs])
+        if api.route_schema is not None:
+            data_types.append(api.route_schema)
+        for data_type in data_types:
+            references = []  # type: typing.List[DataType]
+            if data_type.parent_type is not None:
+                references.append(data_type.parent_type)
+                self._subtypes[data_type.parent_type].append(data_type)
+            for field in data_type.fields:
+                self._owners[field] = data_type
+                field_references = _get_wrapped_references(field.data_type)
+                self._add(field, field_references)
+                references.extend(field_references)
+            self._add(data_type, references)
+        for namespace in api.namespaces.values():
+            references = []
+            for obj in namespace.data_types + namespace.aliases + namespace.routes:
+                references.extend(self._references[obj])
+            self._add(namespace, references)
+
+    def _add(self, referrer, references):
+        # type: (typing.Any, typing.List[DataType]) -> None
+        unique_references = []  # type: typing.List[DataType]
+        seen = set()  # type: typing.Set[int]
+        for data_type in references:
+            if id(data_type) not in seen:
+                seen.add(id(data_type))
+                unique_references.append(data_type)
+                self._referrers[data_type].append(referrer)
+        self._references[referrer] = unique_references
+
+    def get_references(self, obj):
+        # type: (typing.Any) -> typing.List[DataType]
+        """
+        Returns the user-defined types and aliases that a field, alias, route,
+        user-defined type or namespace references, in the order they're
+        referenced.
+        """
+        return self._references[obj]
+
+    def get_route_io_references(self, route, arg=True, result=True,
+                                error=True):
+        # type: (ApiRoute, bool, bool, bool) -> typing.List[DataType]
+        """
+        Returns the user-defined types and aliases that a route references as
+        the selected ones of its argument, result and error.
+        """
+        references = []  # type: typing.List[DataType]
+        for selected, io_references in zip(
+                (arg, result, error), self._route_io_references[route]):
+            if selected:
+                references.extend(io_references)
+        return references
+
+    def get_referrers(self, data_type):
+        # type: (DataType) -> typing.List[typing.Any]
+        """
+        Returns the fields, aliases, routes, user-defined types and namespaces
+        that reference a user-defined type or alias.
+        """
+        return self._referrers.get(data_type, [])
+
+    def get_referencing_fields(self, data_type):
+        # type: (DataType) -> typing.List[Field]
+        return [obj for obj in self.get_referrers(data_type)
+                if isinstance(obj, Field)]
+
+    def get_referencing_aliases(self, data_type):
+        # type: (DataType) -> typing.List[Alias]
+        return [obj for obj in self.get_referrers(data_type) if is_alias(obj)]
+
+    def get_referencing_routes(self, data_type):
+        # type: (DataType) -> typing.List[ApiRoute]
+        return [obj for obj in self.get_referrers(data_type)
+                if isinstance(obj, ApiRoute)]
+
+    def get_referencing_namespaces(self, data_type):
+        # type: (DataType) -> typing.List[ApiNamespace]
+        return [obj for obj in self.get_referrers(data_type)
+                if isinstance(obj, ApiNamespace)]
+
+    def get_subtypes(self, data_type):
+        # type: (UserDefined) -> typing.List[UserDefined]
+        """
+        Returns the structs or unions that directly extend a user-defined
+        type.
+        """
+        return self._subtypes.get(data_type, [])
+
+    def get_owner(self, obj):
+        # type: (typing.Any) -> typing.Any
+        """
+        Returns the user-defined type that defines a field, or the namespace
+        that defines a route, user-defined type or alias.
+        """
+        return self._owners[obj]
+
+
+def _get_wrapped_references(data_type):
+    # type: (DataType) -> typing.List[DataType]
+    """
+    Returns the user-defined types and aliases that data_type is, or wraps
+    in lists, nullables and maps.
+    """
+    references = []  # type: typing.List[DataType]
+    pending = [data_type]
+    while pending:
+        data_type = pending.pop()
+        if is_user_defined_type(data_type) or is_alias(data_type):
+            references.append(data_type)
+        elif is_map_type(data_type):
+            pending.append(data_type.value_data_type)
+            pending.append(data_type.key_data_type)
+        elif is_list_type(data_type) or is_nullable_type(data_type):
+            pending.append(data_type.data_type)
+    return references
+
 
 class _ImportReason(object):
     """
@@ -92,11 +472,13 @@ class _ImportReason(object):
         self.data_type = False
 
 
-class ApiNamespace(object):
+class ApiNamespace(Freezable):
     """
     Represents a category of API endpoints and their associated data types.
     """
 
+    _frozen_lists = ('routes', 'data_types', 'aliases')
+
     def __init__(self, name):
         # type: (typing.Text) -> None
         self.name = name
@@ -164,6 +546,31 @@ class ApiNamespace(object):
         if imported_data_type:
             reason.data_type = True
 
+    def _prune_imports(self, index):
+        # type: (ApiReferenceIndex) -> None
+        """
+        Drops the imports of the namespaces that the routes, data types and
+        aliases of this namespace no longer reference.
+        """
+        referenced = []  # type: typing.List[typing.Any]
+        for obj in self.data_types + self.aliases + self.routes:
+            referenced.extend(index.get_references(obj))
+            if is_struct_type(obj) and obj.has_enumerated_subtypes():
+                referenced.extend(index.get_subtypes(obj))
+        imported_namespaces = {}  # type: typing.Dict[ApiNamespace, _ImportReason]
+        for data_type in referenced:
+            imported_namespace = index.get_owner(data_type)
+            if imported_namespace not in self._imported_namespaces:
+                continue
+            reason = imported_namespaces.setdefault(
+                imported_namespace, _ImportReason())
+            if is_alias(data_type):
+                reason.alias = True
+            else:
+                reason.data_type = True
+        self._imported_namespaces = imported_namespaces
+
+    @cached_while_frozen
     def linearize_data_types(self):
         # type: () -> typing.List[UserDefined]
         """
@@ -193,6 +600,7 @@ class ApiNamespace(object):
 
         return linearized_data_types
 
+    @cached_while_frozen
     def linearize_aliases(self):
         # type: () -> typing.List[Alias]
         """
@@ -219,6 +627,7 @@ class ApiNamespace(object):
 
         return linearized_aliases
 
+    @cached_while_frozen
     def get_route_io_data_types(self):
         # type: () -> typing.List[UserDefined]
         """
@@ -240,6 +649,7 @@ class ApiNamespace(object):
 
         return sorted(data_types, key=lambda dt: dt.name)
 
+    @cached_while_frozen
     def get_imported_namespaces(self, must_have_imported_data_type=False):
         # type: (bool) -> typing.List[ApiNamespace]
         """
@@ -262,6 +672,7 @@ class ApiNamespace(object):
         imported_namespaces.sort(key=lambda n: n.name)
         return imported_namespaces
 
+    @cached_while_frozen
     def get_namespaces_imported_by_route_io(self):
         # type: () -> typing.List[ApiNamespace]
         """
@@ -292,7 +703,7 @@ class ApiNamespace(object):
         return str('ApiNamespace({!r})').format(self.name)
 
 
-class ApiRoute(object):
+class ApiRoute(Freezable):
     """
     Represents an API endpoint.
     """
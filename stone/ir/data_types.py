@@ -12,6 +12,7 @@ from abc import ABCMeta, abstractmethod
 from collections import OrderedDict, deque
 import copy
 import datetime
+import functools
 import math
 import numbers
 import re
@@ -29,11 +30,110 @@ if _MYPY:
     import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
 
 
+# Marks examples that are being computed, to detect reference cycles.
+_example_in_progress = object()
+
+
 class ParameterError(Exception):
     """Raised when a data type is parameterized with a bad type or value."""
     pass
 
 
+class FrozenError(TypeError):
+    """Raised when modifying an IR that has been frozen by Api.freeze()."""
+    pass
+
+
+class FrozenList(list):
+    """A list held by a frozen IR. Modifying it raises FrozenError."""
+
+    def _read_only(self, *args, **kwargs):
+        raise FrozenError('Cannot modify a list of a frozen IR.')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    if hasattr(list, 'clear'):
+        clear = _read_only
+    if hasattr(list, '__setslice__'):
+        __setslice__ = __delslice__ = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+class Freezable(object):
+    """
+    Base class of the objects of the IR, which Api.freeze() makes read-only.
+
+    Setting or deleting an attribute of a frozen object raises FrozenError,
+    as does modifying one of the lists named by _frozen_lists. The methods
+    decorated with cached_while_frozen() compute their result once while
+    frozen. Frozen objects are pickled and copied as frozen objects.
+    """
+
+    # The attributes holding lists that are read-only while frozen.
+    _frozen_lists = ()  # type: typing.Tuple[str, ...]
+
+    _frozen = False
+
+    def _freeze(self):
+        if self._frozen:
+            return
+        for name in self._frozen_lists:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                setattr(self, name, FrozenList(value))
+        self._frozen = True
+
+    def _thaw(self):
+        self.__dict__.pop('_frozen', None)
+        self.__dict__.pop('_frozen_views', None)
+        for name in self._frozen_lists:
+            value = getattr(self, name)
+            if isinstance(value, FrozenList):
+                setattr(self, name, list(value))
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise FrozenError("Cannot set attribute '%s' of a frozen %s." %
+                              (name, type(self).__name__))
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if self._frozen:
+            raise FrozenError("Cannot delete attribute '%s' of a frozen %s." %
+                              (name, type(self).__name__))
+        object.__delattr__(self, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Cached views are computed again when needed, so that pickles of the
+        # IR don't depend on which views were used.
+        state.pop('_frozen_views', None)
+        return state
+
+
+def cached_while_frozen(method):
+    """
+    Decorates a method of a Freezable that derives a view of the IR, so that
+    the view is only computed once while the IR is frozen. Views that are
+    lists are returned as FrozenLists, since they are shared.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._frozen:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        views = self.__dict__.setdefault('_frozen_views', {})
+        if key not in views:
+            view = method(self, *args, **kwargs)
+            if isinstance(view, list):
+                view = FrozenList(view)
+            views[key] = view
+        return views[key]
+    return wrapper
+
+
 def generic_type_name(v):
     """
     Return a descriptive type name that isn't Python specific. For example, an
@@ -56,7 +156,7 @@ def generic_type_name(v):
         return type(v).__name__
 
 
-class DataType(object):
+class DataType(Freezable):
     """
     Abstract class representing a data type.
     """
@@ -547,7 +647,7 @@ def doc_unwrap(raw_doc):
     return docstring
 
 
-class Field(object):
+class Field(Freezable):
     """
     Represents a field in a composite type.
     """
@@ -659,6 +759,8 @@ class UserDefined(Composite):
 
     DEFAULT_EXAMPLE_LABEL = 'default'
 
+    _frozen_lists = ('fields',)
+
     def __init__(self, name, namespace, ast_node):
         """
         When this is instantiated, the type is treated as a forward reference.
@@ -683,6 +785,11 @@ class UserDefined(Composite):
         self.parent_type = None
         self._raw_examples = None
         self._examples = None
+        # Examples computed so far, while examples are being computed. See
+        # _get_computed_example().
+        self._computed_examples = None
+        # The results of get_examples(), by the compact argument.
+        self._example_views = {}  # type: typing.Dict[bool, OrderedDict]
         self._fields_by_name = None
 
     def set_attributes(self, doc, fields, parent_type=None):
@@ -701,6 +808,8 @@ class UserDefined(Composite):
         self.parent_type = parent_type
         self._raw_examples = OrderedDict()
         self._examples = OrderedDict()
+        self._computed_examples = {}
+        self._example_views = {}
         self._fields_by_name = {}  # Dict[str, Field]
 
         # Check that no two fields share the same name.
@@ -761,47 +870,226 @@ class UserDefined(Composite):
     def prepend_field(self, field):
         self.fields.insert(0, field)
 
+    def _get_computed_example(self, label, compute):
+        """
+        Returns compute(label), only calling compute the first time for each
+        label. Examples referencing the same examples, in a chain or a
+        diamond, are thus computed once rather than for each reference.
+
+        Raises InvalidSpec if computing the example requires computing it
+        again, which means examples reference each other in a cycle.
+        """
+        key = (compute.__name__, label)
+        example = self._computed_examples.get(key)
+        if example is _example_in_progress:
+            raw_example = self._raw_examples.get(label)
+            raise InvalidSpec(
+                "Example for '%s' with label '%s' references itself, "
+                "directly or through other examples." % (self.name, label),
+                raw_example.lineno if raw_example else None,
+                raw_example.path if raw_example else None)
+        elif example is None:
+            self._computed_examples[key] = _example_in_progress
+            try:
+                example = compute(label)
+            finally:
+                del self._computed_examples[key]
+            self._computed_examples[key] = example
+        return example
+
+    def _clear_computed_examples(self):
+        """
+        Forgets the examples computed by :meth:`_compute_examples`, once
+        every type has computed its own.
+        """
+        self._computed_examples = {}
+
     def get_examples(self, compact=False):
         """
         Returns an OrderedDict mapping labels to Example objects.
 
+        The examples are computed once for each value of compact, and shared
+        by all callers. Their values are read-only: modifying them raises
+        TypeError. Callers that need to modify an example must modify a copy,
+        made with copy.deepcopy(), which is writable.
+
         Args:
             compact (bool): If True, union members of void type are converted
                 to their compact representation: no ".tag" key or containing
                 dict, just the tag as a string.
         """
-        # Copy it just in case the caller wants to mutate the object.
-        examples = copy.deepcopy(self._examples)
-        if not compact:
-            return examples
-
-        def make_compact(d):
-            # Traverse through dicts looking for ones that have a lone .tag
-            # key, which can be converted into the compact form.
-            if not isinstance(d, dict):
-                return
-            for key in d:
-                if isinstance(d[key], dict):
-                    inner_d = d[key]
-                    if len(inner_d) == 1 and '.tag' in inner_d:
-                        d[key] = inner_d['.tag']
-                    else:
-                        make_compact(inner_d)
-                if isinstance(d[key], list):
-                    for item in d[key]:
-                        make_compact(item)
-
-        for example in examples.values():
-            if (isinstance(example.value, dict) and
-                    len(example.value) == 1 and '.tag' in example.value):
-                # Handle the case where the top-level of the example can be
-                # made compact.
-                example.value = example.value['.tag']
+        examples = self._example_views.get(compact)
+        if examples is None:
+            if compact:
+                compact_values = {}  # type: typing.Dict[int, typing.Any]
+                examples = _ExampleDict(
+                    (label, _copy_example(example, _compact_example_value(
+                        example.value, compact_values)))
+                    for label, example in self.get_examples().items())
             else:
-                make_compact(example.value)
-
+                # Values that examples share are frozen once.
+                frozen_values = {}  # type: typing.Dict[int, typing.Any]
+                examples = _ExampleDict(
+                    (label, _copy_example(example, _freeze_example_value(
+                        example.value, frozen_values)))
+                    for label, example in self._examples.items())
+            self._example_views[compact] = examples
         return examples
 
+    def __getstate__(self):
+        state = super(UserDefined, self).__getstate__()
+        # The views of examples are recreated when needed, so that copies of
+        # the type are the same whether or not they were used.
+        state['_example_views'] = {}
+        return state
+
+
+class _ExampleDict(OrderedDict):
+    """
+    A read-only OrderedDict, used for the values of the examples returned by
+    :meth:`UserDefined.get_examples`. Deep copies are writable OrderedDicts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_ExampleDict, self).__init__(*args, **kwargs)
+        self._frozen = True
+
+    def _check_writable(self):
+        if getattr(self, '_frozen', False):
+            raise TypeError('Examples are read-only. Modify a copy.deepcopy() '
+                            'of the example instead.')
+
+    def __setitem__(self, *args, **kwargs):  # pylint: disable=signature-differs
+        self._check_writable()
+        super(_ExampleDict, self).__setitem__(*args, **kwargs)
+
+    def __delitem__(self, *args, **kwargs):  # pylint: disable=signature-differs
+        self._check_writable()
+        super(_ExampleDict, self).__delitem__(*args, **kwargs)
+
+    def _make_read_only(name):  # pylint: disable=no-self-argument
+        method = getattr(OrderedDict, name)
+
+        def read_only_method(self, *args, **kwargs):
+            self._check_writable()
+            return method(self, *args, **kwargs)
+        read_only_method.__name__ = str(name)
+        return read_only_method
+
+    clear = _make_read_only('clear')
+    pop = _make_read_only('pop')
+    popitem = _make_read_only('popitem')
+    setdefault = _make_read_only('setdefault')
+    update = _make_read_only('update')
+    if hasattr(OrderedDict, 'move_to_end'):
+        move_to_end = _make_read_only('move_to_end')
+    del _make_read_only
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()),)
+
+    def __copy__(self):
+        return OrderedDict(self)
+
+    def __deepcopy__(self, memo):
+        # Values that examples share are copied for each use, so that
+        # modifying one doesn't modify the others.
+        return OrderedDict(
+            (key, copy.deepcopy(value)) for key, value in self.items())
+
+
+class _ExampleList(list):
+    """
+    A read-only list, used for the values of the examples returned by
+    :meth:`UserDefined.get_examples`. Deep copies are writable lists.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Examples are read-only. Modify a copy.deepcopy() '
+                        'of the example instead.')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    if hasattr(list, 'clear'):
+        clear = _read_only
+    if hasattr(list, '__setslice__'):
+        __setslice__ = __delslice__ = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(item) for item in self]
+
+
+def _copy_example(example, value):
+    """Returns a copy of an Example, with the given value."""
+    example = copy.copy(example)
+    example.value = value
+    return example
+
+
+def _freeze_example_value(value, frozen_values):
+    """
+    Returns a read-only copy of an example value. frozen_values maps the ids
+    of the dicts and lists frozen so far to their copies, so that values
+    shared by examples are only copied once.
+    """
+    if not isinstance(value, (dict, list)):
+        return value
+    frozen_value = frozen_values.get(id(value))
+    if frozen_value is None:
+        if isinstance(value, dict):
+            frozen_value = _ExampleDict(
+                (key, _freeze_example_value(item, frozen_values))
+                for key, item in value.items())
+        else:
+            frozen_value = _ExampleList(
+                _freeze_example_value(item, frozen_values) for item in value)
+        frozen_values[id(value)] = frozen_value
+    return frozen_value
+
+
+def _compact_example_value(value, compact_values):
+    """
+    Returns the compact form of a read-only example value, in which unions
+    with a void tag are replaced by the tag. compact_values maps the ids of
+    the dicts compacted so far to their compact forms.
+    """
+    if isinstance(value, dict) and len(value) == 1 and '.tag' in value:
+        # The top-level of the example can be made compact.
+        return value['.tag']
+    elif isinstance(value, dict):
+        return _compact_example_dict(value, compact_values)
+    return value
+
+
+def _compact_example_dict(d, compact_values):
+    # Dicts with a lone .tag key that are values of d are converted into the
+    # compact form, as are those nested in dicts and lists of dicts.
+    compact_d = compact_values.get(id(d))
+    if compact_d is not None:
+        return compact_d
+    items = []
+    for key, value in d.items():
+        if isinstance(value, dict):
+            if len(value) == 1 and '.tag' in value:
+                value = value['.tag']
+            else:
+                value = _compact_example_dict(value, compact_values)
+        elif isinstance(value, list):
+            value = _ExampleList(
+                _compact_example_dict(item, compact_values)
+                if isinstance(item, dict) else item
+                for item in value)
+        items.append((key, value))
+    compact_d = _ExampleDict(items)
+    compact_values[id(d)] = compact_d
+    return compact_d
+
 
 class Example(object):
     """An example of a struct or union type."""
@@ -871,6 +1159,7 @@ class Struct(UserDefined):
         return validated_attrs
 
     @property
+    @cached_while_frozen
     def all_fields(self):
         """
         Returns an iterator of all fields. Required fields before optional
@@ -893,6 +1182,7 @@ class Struct(UserDefined):
         return fields
 
     @property
+    @cached_while_frozen
     def all_required_fields(self):
         """
         Returns an iterator that traverses required fields in all super types
@@ -903,6 +1193,7 @@ class Struct(UserDefined):
         return self._filter_fields(required_check)
 
     @property
+    @cached_while_frozen
     def all_optional_fields(self):
         """
         Returns an iterator that traverses optional fields in all super types
@@ -1182,14 +1473,17 @@ class Struct(UserDefined):
         this method requires that every type have ``_raw_examples`` assigned
         for resolving example references.
         """
+        self._example_views = {}
         for label in self._raw_examples:
             self._examples[label] = self._compute_example(label)
 
     def _compute_example(self, label):
         if self.has_enumerated_subtypes():
-            return self._compute_example_enumerated_subtypes(label)
+            return self._get_computed_example(
+                label, self._compute_example_enumerated_subtypes)
         else:
-            return self._compute_example_flat_helper(label)
+            return self._get_computed_example(
+                label, self._compute_example_flat_helper)
 
     def _compute_example_flat_helper(self, label):
         """
@@ -1271,10 +1565,12 @@ class Struct(UserDefined):
                 ref.lineno, ref.path)
 
         ordered_value = OrderedDict([('.tag', example_field.name)])
-        flat_example = data_type._compute_example_flat_helper(ref.label)
+        flat_example = data_type._get_computed_example(
+            ref.label, data_type._compute_example_flat_helper)
         ordered_value.update(flat_example.value)
-        flat_example.value = ordered_value
-        return flat_example
+        # The flat example is shared, so a new one is returned.
+        return Example(flat_example.label, flat_example.text, ordered_value,
+                       ast_node=flat_example._ast_node)
 
     def __repr__(self):
         return 'Struct(%r, %r)' % (self.name, self.fields)
@@ -1340,6 +1636,7 @@ class Union(UserDefined):
         return tag_ref
 
     @property
+    @cached_while_frozen
     def all_fields(self):
         """
         Returns a list of all fields. Subtype fields come before this type's
@@ -1418,6 +1715,7 @@ class Union(UserDefined):
         this method requires that every type have ``_raw_examples`` assigned
         for resolving example references.
         """
+        self._example_views = {}
         for label in self._raw_examples:
             self._examples[label] = self._compute_example(label)
 
@@ -1432,11 +1730,15 @@ class Union(UserDefined):
     def _compute_example(self, label):
         """
         From the "raw example," resolves references to examples of other data
-        types to compute the final example.
+        types to compute the final example. Each example is only computed
+        once.
 
         Returns an Example object. The `value` attribute contains a
         JSON-serializable representation of the example.
         """
+        return self._get_computed_example(label, self._compute_example_helper)
+
+    def _compute_example_helper(self, label):
         if label in self._raw_examples:
 
             example = self._raw_examples[label]
@@ -0,0 +1,419 @@
+"""
+Sinks that backends write generated files to.
+
+A backend writes each file to its sink, by path relative to the root of the
+output. The default sink writes to a folder on the filesystem. Other sinks
+keep the files in memory, for tests and for tools embedding stone, or write
+them to a zip or tar archive, without creating a file for each output.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import collections
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from stone.frontend.cache import replace_file, temp_path_for
+
+_MYPY = False
+if _MYPY:
+    import typing  # noqa: F401 # pylint: disable=import-error,unused-import,useless-suppression
+
+# Hack to get around some of Python 2's standard library modules that
+# accept ascii-encodable unicode literals in lieu of strs, but where
+# actually passing such literals results in errors with mypy --py2. See
+# <https://github.com/python/typeshed/issues/756> and
+# <https://github.com/python/mypy/issues/2536>.
+import importlib
+logging = importlib.import_module(str('logging'))  # type: typing.Any
+open = open  # type: typing.Any # pylint: disable=redefined-builtin
+
+logger = logging.getLogger(str('stone.sinks'))
+
+# Archive entries larger than this are spooled to a temporary file rather than
+# kept in memory until they are complete.
+_spool_size = 1 << 22
+
+# The extensions of the archives that sink_for_path() writes, and the tarfile
+# compression they use. None means a zip archive.
+_archive_extensions = [
+    ('.zip', None),
+    ('.tar', ''),
+    ('.tar.gz', 'gz'),
+    ('.tgz', 'gz'),
+]
+
+
+def write_if_changed(path, data):
+    # type: (typing.Text, bytes) -> bool
+    """
+    Writes data to the file at path, unless the file already contains it.
+    Unchanged files keep their modification time, so that tools building the
+    generated code don't redo work for them. Returns whether the file was
+    written.
+    """
+    if os.path.isfile(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def _files_equal(path1, path2):
+    # type: (typing.Text, typing.Text) -> bool
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        while True:
+            chunk = f1.read(1 << 16)
+            if chunk != f2.read(1 << 16):
+                return False
+            if not chunk:
+                return True
+
+
+def is_archive_path(path):
+    # type: (typing.Text) -> bool
+    """Returns whether sink_for_path() writes an archive to path."""
+    return any(path.endswith(ext) for ext, _ in _archive_extensions)
+
+
+def sink_for_path(path):
+    # type: (typing.Text) -> OutputSink
+    """
+    Returns a sink that writes to path: a zip or tar archive if path ends
+    with .zip, .tar, .tar.gz or .tgz, and otherwise a folder. An archive is
+    created when the sink is, and must be finished by closing the sink.
+    """
+    for ext, compression in _archive_extensions:
+        if path.endswith(ext):
+            break
+    else:
+        return FileSystemSink(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    f = open(path, 'wb')
+    try:
+        if compression is None:
+            return ZipSink(f, close_fileobj=True)
+        return TarSink(f, compression, close_fileobj=True)
+    except Exception:
+        f.close()
+        raise
+
+
+class OutputWriter(object):
+    """
+    Writes a file to a sink in chunks. The file is complete once the writer
+    is closed. If it's aborted instead, the file isn't written.
+    """
+
+    def write(self, data):
+        # type: (bytes) -> None
+        raise NotImplementedError
+
+    def close(self):
+        # type: () -> None
+        raise NotImplementedError
+
+    def abort(self):
+        # type: () -> None
+        raise NotImplementedError
+
+
+class OutputSink(object):
+    """
+    The interface of the sinks that backends write generated files to.
+
+    Paths are relative to the root of the output, and may use either / or
+    the separator of the platform.
+    """
+
+    # Whether worker processes may write to the sink. Only sinks that write to
+    # a medium the processes share, like the filesystem, support it. Backends
+    # writing to other sinks run in a single process.
+    shared_by_processes = False
+
+    def open(self, relative_path):
+        # type: (typing.Text) -> OutputWriter
+        """Returns a writer for the file at relative_path."""
+        raise NotImplementedError
+
+    def write_file(self, relative_path, data):
+        # type: (typing.Text, bytes) -> None
+        """Writes the file at relative_path with data."""
+        writer = self.open(relative_path)
+        try:
+            writer.write(data)
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
+
+    def read_file(self, relative_path):
+        # type: (typing.Text) -> bytes
+        """
+        Returns the contents of a file written to the sink. Raises
+        io.UnsupportedOperation if the sink can't read files back.
+        """
+        raise io.UnsupportedOperation('%s cannot read files back' % type(self).__name__)
+
+    def close(self):
+        # type: () -> None
+        """Finishes the output. No files can be written afterwards."""
+
+
+class _FileWriter(OutputWriter):
+    """
+    Writes a file to a temporary file next to it, which replaces the file
+    when closed, unless their contents are the same.
+    """
+
+    def __init__(self, path):
+        # type: (typing.Text) -> None
+        self.path = path
+        self.temp_path = temp_path_for(path)
+        self.f = open(self.temp_path, 'wb')
+
+    def write(self, data):
+        # type: (bytes) -> None
+        self.f.write(data)
+
+    def close(self):
+        # type: () -> None
+        self.f.close()
+        if os.path.isfile(self.path) and _files_equal(self.temp_path, self.path):
+            os.remove(self.temp_path)
+        else:
+            replace_file(self.temp_path, self.path)
+
+    def abort(self):
+        # type: () -> None
+        self.f.close()
+        os.remove(self.temp_path)
+
+
+class FileSystemSink(OutputSink):
+    """
+    Writes files to a folder. Files that already have the same contents are
+    left untouched, and keep their modification time.
+    """
+
+    shared_by_processes = True
+
+    def __init__(self, root):
+        # type: (typing.Text) -> None
+        self.root = root
+
+    def open(self, relative_path):
+        # type: (typing.Text) -> OutputWriter
+        return _FileWriter(self._prepare_path(relative_path))
+
+    def write_file(self, relative_path, data):
+        # type: (typing.Text, bytes) -> None
+        # Small files are compared in memory, without a temporary file.
+        write_if_changed(self._prepare_path(relative_path), data)
+
+    def read_file(self, relative_path):
+        # type: (typing.Text) -> bytes
+        with open(os.path.join(self.root, relative_path), 'rb') as f:
+            return f.read()
+
+    def _prepare_path(self, relative_path):
+        # type: (typing.Text) -> typing.Text
+        full_path = os.path.join(self.root, relative_path)
+        directory = os.path.dirname(full_path)
+        if not os.path.exists(directory):
+            logger.info('Creating %s', directory)
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have created it.
+                if not os.path.isdir(directory):
+                    raise
+        return full_path
+
+
+class _MemoryWriter(OutputWriter):
+
+    def __init__(self, sink, relative_path):
+        # type: (MemorySink, typing.Text) -> None
+        self.sink = sink
+        self.relative_path = relative_path
+        self.chunks = []  # type: typing.List[bytes]
+
+    def write(self, data):
+        # type: (bytes) -> None
+        self.chunks.append(data)
+
+    def close(self):
+        # type: () -> None
+        self.sink.files[self.relative_path] = b''.join(self.chunks)
+
+    def abort(self):
+        # type: () -> None
+        self.chunks = []
+
+
+class MemorySink(OutputSink):
+    """
+    Keeps files in memory. The files attribute maps the relative path of each
+    file, with / as the separator, to its contents, in the order they were
+    first written.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.files = collections.OrderedDict()  # type: typing.Dict[typing.Text, bytes]
+
+    def open(self, relative_path):
+        # type: (typing.Text) -> OutputWriter
+        return _MemoryWriter(self, _normalize_path(relative_path))
+
+    def read_file(self, relative_path):
+        # type: (typing.Text) -> bytes
+        return self.files[_normalize_path(relative_path)]
+
+
+class _ArchiveWriter(OutputWriter):
+    """
+    Spools an entry to memory, or to a temporary file once it's large, since
+    archives need the size of an entry before its contents.
+    """
+
+    def __init__(self, sink, relative_path):
+        # type: (_ArchiveSink, typing.Text) -> None
+        self.sink = sink
+        self.relative_path = relative_path
+        self.f = tempfile.SpooledTemporaryFile(_spool_size)
+        self.size = 0
+
+    def write(self, data):
+        # type: (bytes) -> None
+        self.f.write(data)
+        self.size += len(data)
+
+    def close(self):
+        # type: () -> None
+        try:
+            self.f.seek(0)
+            self.sink._add_entry(  # pylint: disable=protected-access
+                self.relative_path, self.f, self.size)
+        finally:
+            self.f.close()
+
+    def abort(self):
+        # type: () -> None
+        self.f.close()
+
+
+class _ArchiveSink(OutputSink):
+    """
+    Writes files to an archive. Entries are written as the files are closed,
+    so the archive can be streamed, but files can't be read back.
+
+    If a file is written more than once, the archive contains each version,
+    and tools extracting it keep the last one.
+    """
+
+    def __init__(self, fileobj, close_fileobj=False):
+        # type: (typing.Any, bool) -> None
+        self.fileobj = fileobj
+        self.close_fileobj = close_fileobj
+        # All entries are dated when the output was created.
+        self.mtime = time.time()
+
+    def open(self, relative_path):
+        # type: (typing.Text) -> OutputWriter
+        return _ArchiveWriter(self, _normalize_path(relative_path))
+
+    def read_file(self, relative_path):
+        # type: (typing.Text) -> bytes
+        raise io.UnsupportedOperation('Files written to an archive cannot be read back')
+
+    def _add_entry(self, name, f, size):
+        # type: (typing.Text, typing.Any, int) -> None
+        raise NotImplementedError
+
+    def _close_archive(self):
+        # type: () -> None
+        raise NotImplementedError
+
+    def close(self):
+        # type: () -> None
+        try:
+            self._close_archive()
+        finally:
+            if self.close_fileobj:
+                self.fileobj.close()
+
+
+class ZipSink(_ArchiveSink):
+    """
+    Writes files to a zip archive in fileobj, which may be a stream that
+    can't seek. If close_fileobj is set, fileobj is closed with the sink.
+    """
+
+    def __init__(self, fileobj, close_fileobj=False):
+        # type: (typing.Any, bool) -> None
+        super(ZipSink, self).__init__(fileobj, close_fileobj)
+        self.zip_file = zipfile.ZipFile(
+            fileobj, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def _add_entry(self, name, f, size):
+        # type: (typing.Text, typing.Any, int) -> None
+        info = zipfile.ZipInfo(name, time.localtime(self.mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        info.file_size = size
+        try:
+            entry = self.zip_file.open(info, 'w')
+        except (TypeError, ValueError, RuntimeError):
+            # Python 2 can only write an entry from memory.
+            self.zip_file.writestr(info, f.read())
+            return
+        with entry:
+            shutil.copyfileobj(f, entry)
+
+    def _close_archive(self):
+        # type: () -> None
+        self.zip_file.close()
+
+
+class TarSink(_ArchiveSink):
+    """
+    Writes files to a tar archive in fileobj, which may be a stream that
+    can't seek. compression is '' for none, or 'gz', 'bz2' or 'xz'. If
+    close_fileobj is set, fileobj is closed with the sink.
+    """
+
+    def __init__(self, fileobj, compression='', close_fileobj=False):
+        # type: (typing.Any, typing.Text, bool) -> None
+        super(TarSink, self).__init__(fileobj, close_fileobj)
+        self.tar_file = tarfile.open(
+            fileobj=fileobj, mode=str('w|' + compression))
+
+    def _add_entry(self, name, f, size):
+        # type: (typing.Text, typing.Any, int) -> None
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(self.mtime)
+        info.mode = 0o644
+        self.tar_file.addfile(info, f)
+
+    def _close_archive(self):
+        # type: () -> None
+        self.tar_file.close()
+
+
+def _normalize_path(relative_path):
+    # type: (typing.Text) -> typing.Text
+    return relative_path.replace(os.sep, '/')
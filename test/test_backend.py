@@ -2,8 +2,31 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import imp
+import multiprocessing
+import os
+import shutil
+import six
+import sys
+import tarfile
+import tempfile
+import textwrap
 import unittest
-
+import zipfile
+
+try:
+    # Works for Py 3.3+
+    from unittest import mock
+except ImportError:
+    # See https://github.com/python/mypy/issues/1153#issuecomment-253842414
+    import mock  # type: ignore
+
+from stone.compiler import (
+    BackendException,
+    Compiler,
+    remove_stale_outputs,
+)
+from stone.frontend.frontend import specs_to_ir
 from stone.ir import (
     ApiNamespace,
     ApiRoute,
@@ -13,7 +36,16 @@ from stone.ir import (
     Struct,
     StructField,
 )
-from stone.backend import CodeBackend
+from stone.backend import (
+    CodeBackend,
+    NamespaceBackendMixin,
+)
+from stone.sinks import (
+    MemorySink,
+    TarSink,
+    ZipSink,
+    write_if_changed,
+)
 
 _MYPY = False
 if _MYPY:
@@ -32,6 +64,21 @@ class _Tester(CodeBackend):
     def generate(self, api):
         pass
 
+class _NamespaceTester(NamespaceBackendMixin, CodeBackend):
+    """Writes a file for each namespace, in which it prints some state."""
+    def generate(self, api):
+        self.generate_namespaces(api)
+
+    def generate_namespace(self, api, namespace):
+        with self.output_to_relative_path(namespace.name + '.txt'):
+            with self.indent():
+                self.emit('lineno: %d' % self.lineno)
+            self.emit('routes: %d' % len(namespace.routes))
+        if namespace.name == 'bad':
+            raise ValueError(namespace.name)
+        elif namespace.name == 'exit':
+            sys.exit(3)
+
 class _TesterCmdline(CodeBackend):
     cmdline_parser = argparse.ArgumentParser()
     cmdline_parser.add_argument('-v', '--verbose', action='store_true')
@@ -226,5 +273,388 @@ int sq(int x) <
         self.assertTrue(t.args.verbose)
 
 
+_multi_backend_module = """\
+from stone.backend import CodeBackend
+
+
+class _Base(CodeBackend):
+    preserve_aliases = False
+
+    def _generate(self, api):
+        name = type(self).__name__
+        with self.output_to_relative_path(name + '.txt'):
+            for namespace in api.namespaces.values():
+                self.emit('aliases: %s' % [a.name for a in namespace.aliases])
+                for data_type in namespace.data_types:
+                    for field in data_type.fields:
+                        self.emit('%s.%s: %s' % (
+                            data_type.name, field.name, field.data_type.name))
+        if name.startswith('Failing'):
+            raise ValueError(name)
+
+
+class AliasBackend(_Base):
+    preserve_aliases = True
+
+    def generate(self, api):
+        self._generate(api)
+
+
+class FailingBackend(_Base):
+    def generate(self, api):
+        self._generate(api)
+
+
+class FailingAliasBackend(_Base):
+    preserve_aliases = True
+
+    def generate(self, api):
+        self._generate(api)
+
+
+class NoAliasBackend(_Base):
+    def generate(self, api):
+        self._generate(api)
+"""
+
+
+class TestCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        module_path = os.path.join(self.temp_dir, 'multi.stoneg.py')
+        with open(module_path, 'w') as f:
+            f.write(_multi_backend_module)
+        self.backend_module = imp.load_source('multi_backend', module_path)
+
+    def _build(self, jobs):
+        api = specs_to_ir([('test.stone', textwrap.dedent("""\
+            namespace ns
+
+            alias Id = String
+
+            struct S
+                id Id
+            """))])
+        output_path = os.path.join(self.temp_dir, 'output-%d' % jobs)
+        with self.assertRaises(BackendException) as cm:
+            Compiler(api, self.backend_module, [], output_path, jobs=jobs).build()
+        outputs = {}
+        for name in os.listdir(output_path):
+            with open(os.path.join(output_path, name)) as f:
+                outputs[name] = f.read()
+        return api, cm.exception, outputs
+
+    def test_parallel_backends(self):
+        api, exception, outputs = self._build(jobs=1)
+        self.assertEqual(exception.backend_name, 'FailingAliasBackend')
+        self.assertEqual(outputs['AliasBackend.txt'],
+                         "aliases: ['Id']\nS.id: Id\n")
+        self.assertEqual(sorted(outputs), ['AliasBackend.txt', 'FailingAliasBackend.txt'])
+
+        api, parallel_exception, parallel_outputs = self._build(jobs=3)
+        self.assertEqual(parallel_exception.backend_name, 'FailingAliasBackend')
+        self.assertIn('ValueError: FailingAliasBackend', parallel_exception.traceback)
+        # All backends run, even after one fails.
+        self.assertEqual(parallel_outputs['AliasBackend.txt'],
+                         "aliases: ['Id']\nS.id: Id\n")
+        self.assertEqual(parallel_outputs['NoAliasBackend.txt'],
+                         'aliases: []\nS.id: String\n')
+        self.assertEqual(len(parallel_outputs), 4)
+        # The aliases are only removed from a copy of the API.
+        self.assertEqual(
+            [alias.name for alias in api.namespaces['ns'].aliases], ['Id'])
+
+    def test_backend_exit(self):
+        module_path = os.path.join(self.temp_dir, 'exit.stoneg.py')
+        with open(module_path, 'w') as f:
+            f.write(textwrap.dedent("""\
+                import sys
+
+                from stone.backend import CodeBackend
+
+
+                class ExitingBackend(CodeBackend):
+                    def generate(self, api):
+                        sys.exit(3)
+
+
+                class OtherBackend(CodeBackend):
+                    def generate(self, api):
+                        pass
+                """))
+        backend_module = imp.load_source('exit_backend', module_path)
+        api = specs_to_ir([('test.stone', 'namespace ns\n')])
+        output_path = os.path.join(self.temp_dir, 'output')
+        for jobs in (1, 2):
+            # A backend exiting in a worker exits stone, like when backends
+            # run serially, rather than leaving the build waiting for it.
+            with self.assertRaises(SystemExit) as cm:
+                Compiler(api, backend_module, [], output_path, jobs=jobs).build()
+            self.assertEqual(cm.exception.code, 3)
+
+    def test_parallel_namespaces(self):
+        specs = [('%s.stone' % name, textwrap.dedent("""\
+            namespace %s
+
+            import common
+
+            struct S
+                id common.Id
+
+            route get(S, Void, Void)
+            """ % name)) for name in ('a', 'b', 'c', 'd')]
+        specs.append(('common.stone', 'namespace common\nalias Id = String\n'))
+        python_types = importlib.import_module(str('stone.backends.python_types'))
+
+        outputs = []
+        for jobs in (1, 3):
+            output_path = os.path.join(self.temp_dir, 'output-%d' % jobs)
+            Compiler(specs_to_ir(specs), python_types, [], output_path,
+                     jobs=jobs).build()
+            output = {}
+            for name in os.listdir(output_path):
+                with open(os.path.join(output_path, name)) as f:
+                    output[name] = f.read()
+            outputs.append(output)
+        self.assertEqual(len(outputs[0]), 8)
+        self.assertEqual(outputs[0], outputs[1])
+
+        specs.append(('bad.stone', 'namespace bad\nroute fail(Void, Void, Void)\n'))
+        t = _NamespaceTester(os.path.join(self.temp_dir, 'serial'), [])
+        with self.assertRaises(ValueError):
+            t.generate(specs_to_ir(specs))
+
+        output_path = os.path.join(self.temp_dir, 'parallel')
+        t = _NamespaceTester(output_path, [])
+        t.jobs = 3
+        with self.assertRaises(RuntimeError) as cm:
+            t.generate(specs_to_ir(specs))
+        self.assertIn('Generating namespace bad raised', str(cm.exception))
+        self.assertIn('ValueError: bad', str(cm.exception))
+        # Each namespace starts with an empty buffer, at the same line.
+        for name, num_routes in [('a', 1), ('bad', 1), ('common', 0)]:
+            with open(os.path.join(output_path, name + '.txt')) as f:
+                self.assertEqual(f.read(),
+                                 '    lineno: 1\nroutes: %d\n' % num_routes)
+        # The files generated by the workers are known.
+        self.assertEqual(
+            sorted(os.path.basename(path) for path in t.output_paths),
+            ['a.txt', 'b.txt', 'bad.txt', 'c.txt', 'common.txt', 'd.txt'])
+
+        # A namespace exiting in a worker exits stone, like when generating
+        # serially.
+        specs[-1] = ('exit.stone', 'namespace exit\n')
+        for jobs in (1, 3):
+            t = _NamespaceTester(os.path.join(self.temp_dir, 'exit-%d' % jobs), [])
+            t.jobs = jobs
+            with self.assertRaises(SystemExit) as cm:
+                t.generate(specs_to_ir(specs))
+            self.assertEqual(cm.exception.code, 3)
+
+    @unittest.skipIf(six.PY2, 'Python 2 always forks workers on POSIX')
+    def test_parallel_namespaces_spawned(self):
+        module_path = os.path.join(self.temp_dir, 'spawn.stoneg.py')
+        with open(module_path, 'w') as f:
+            f.write(textwrap.dedent("""\
+                from stone.backend import CodeBackend, NamespaceBackendMixin
+
+
+                class SpawnedBackend(NamespaceBackendMixin, CodeBackend):
+                    def generate(self, api):
+                        self.prefix = 'namespace'
+                        self.generate_namespaces(api)
+
+                    def generate_namespace(self, api, namespace):
+                        with self.output_to_relative_path(namespace.name + '.txt'):
+                            self.emit('%s %s' % (self.prefix, namespace.name))
+                """))
+        backend_module = imp.load_source('spawn_backend', module_path)
+        api = specs_to_ir([('%s.stone' % name, 'namespace %s\n' % name)
+                           for name in ('a', 'b', 'c')])
+        output_path = os.path.join(self.temp_dir, 'output')
+
+        # Workers that aren't forked load the backend file before unpickling
+        # the backend, which keeps the state generate() gave it.
+        start_method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            Compiler(api, backend_module, [], output_path, jobs=2).build()
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(output_path, name + '.txt')) as f:
+                self.assertEqual(f.read(), 'namespace %s\n' % name)
+
+    def test_write_if_changed(self):
+        path = os.path.join(self.temp_dir, 'file.txt')
+        self.assertTrue(write_if_changed(path, b'abc'))
+        os.utime(path, (1000000000, 1000000000))
+        self.assertFalse(write_if_changed(path, b'abc'))
+        self.assertEqual(os.path.getmtime(path), 1000000000)
+        for data in (b'abd', b'abcd'):
+            self.assertTrue(write_if_changed(path, data))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_remove_stale_outputs(self):
+        build_path = os.path.join(self.temp_dir, 'build')
+        outside_path = os.path.join(self.temp_dir, 'outside.txt')
+        paths = [os.path.join(build_path, *name.split('/'))
+                 for name in ('a.txt', 'b/c.txt', 'b/d/e.txt', 'f/g.txt', '..h.txt')]
+        for path in paths + [outside_path]:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            write_if_changed(path, b'')
+
+        # Without a manifest, nothing is removed.
+        remove_stale_outputs(build_path, paths + [outside_path])
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        with open(os.path.join(build_path, '.stone-manifest')) as f:
+            self.assertNotIn('outside', f.read())
+
+        remove_stale_outputs(build_path, paths[:2])
+        self.assertEqual(sorted(os.listdir(build_path)),
+                         ['.stone-manifest', 'a.txt', 'b'])
+        self.assertEqual(os.listdir(os.path.join(build_path, 'b')), ['c.txt'])
+        self.assertTrue(os.path.exists(outside_path))
+
+        # Entries outside of the build folder are never removed.
+        with open(os.path.join(build_path, '.stone-manifest'), 'w') as f:
+            f.write('["a.txt", "../outside.txt"]')
+        remove_stale_outputs(build_path, [])
+        self.assertEqual(sorted(os.listdir(build_path)), ['.stone-manifest', 'b'])
+        self.assertTrue(os.path.exists(outside_path))
+
+    def test_output_sinks(self):
+        api = specs_to_ir([
+            ('a.stone', 'namespace a\nroute get(Void, Void, Void)\n'),
+            ('b.stone', 'namespace b\nstruct S\n    f String\n'),
+        ])
+        output_path = os.path.join(self.temp_dir, 'output')
+
+        # Namespaces are generated in this process when the sink isn't
+        # shared by processes.
+        t = _NamespaceTester(output_path, [])
+        t.sink = MemorySink()
+        t.jobs = 3
+        t.generate(api)
+        self.assertEqual(dict(t.sink.files), {
+            'a.txt': b'    lineno: 1\nroutes: 1\n',
+            'b.txt': b'    lineno: 3\nroutes: 0\n',
+        })
+        self.assertFalse(os.path.exists(output_path))
+        self.assertEqual(t.output_paths, [os.path.join(output_path, 'a.txt'),
+                                          os.path.join(output_path, 'b.txt')])
+
+        # Large files are written in chunks.
+        t = _Tester(output_path, [])
+        t.output_chunk_size = 64
+        lines = ['line %d' % i for i in range(100)]
+        with t.output_to_relative_path('big/file.txt'):
+            for line in lines:
+                t.emit(line)
+                self.assertLess(len(t.output_buffer_to_string()), 64)
+        with open(os.path.join(output_path, 'big', 'file.txt')) as f:
+            self.assertEqual(f.read(), '\n'.join(lines) + '\n')
+        # An unchanged file is left untouched, and a failed one isn't written.
+        path = os.path.join(output_path, 'big', 'file.txt')
+        os.utime(path, (1000000000, 1000000000))
+        with t.output_to_relative_path('big/file.txt'):
+            for line in lines:
+                t.emit(line)
+        self.assertEqual(os.path.getmtime(path), 1000000000)
+        with self.assertRaises(ValueError):
+            with t.output_to_relative_path('big/file.txt'):
+                for _ in lines:
+                    t.emit('changed')
+                raise ValueError()
+        self.assertEqual(os.listdir(os.path.join(output_path, 'big')), ['file.txt'])
+        self.assertEqual(os.path.getmtime(path), 1000000000)
+
+        python_types = importlib.import_module(str('stone.backends.python_types'))
+        zip_data = six.BytesIO()
+        tar_data = six.BytesIO()
+        for sink in (ZipSink(zip_data), TarSink(tar_data, 'gz')):
+            Compiler(api, python_types, [], 'output.archive', jobs=2,
+                     sink=sink).build()
+            sink.close()
+        self.assertFalse(os.path.exists('output.archive'))
+        zip_data.seek(0)
+        tar_data.seek(0)
+        with zipfile.ZipFile(zip_data) as zip_file:
+            with tarfile.open(fileobj=tar_data) as tar_file:
+                self.assertEqual(sorted(zip_file.namelist()),
+                                 sorted(tar_file.getnames()))
+                self.assertIn('a.py', zip_file.namelist())
+                self.assertIn('stone_base.py', zip_file.namelist())
+                for name in zip_file.namelist():
+                    self.assertEqual(zip_file.read(name),
+                                     tar_file.extractfile(name).read())
+
+    def test_build_cache(self):
+        specs = {
+            'a': 'namespace a\nimport common\nstruct S\n    id common.Id\n'
+                 'route get(S, Void, Void)\n',
+            'b': 'namespace b\nstruct T\n    f String\n',
+            'common': 'namespace common\nalias Id = String\n',
+        }
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        os.mkdir(cache_dir)
+        python_types = importlib.import_module(str('stone.backends.python_types'))
+        python_client = importlib.import_module(str('stone.backends.python_client'))
+        generated = []
+
+        def build(backend_module, backend_args=()):
+            output_path = os.path.join(self.temp_dir, 'output')
+            if os.path.exists(output_path):
+                shutil.rmtree(output_path)
+            api = specs_to_ir(['%s.stone' % name, text] for name, text in specs.items())
+            Compiler(api, backend_module, list(backend_args), output_path,
+                     cache_dir=cache_dir).build()
+            output = {}
+            for name in os.listdir(output_path):
+                with open(os.path.join(output_path, name)) as f:
+                    output[name] = f.read()
+            return output
+
+        generate_namespace = python_types.PythonTypesBackend.generate_namespace
+
+        def record_namespace(backend, api, namespace):
+            generated.append(namespace.name)
+            generate_namespace(backend, api, namespace)
+
+        with mock.patch.object(python_types.PythonTypesBackend, 'generate_namespace',
+                               autospec=True, side_effect=record_namespace):
+            output = build(python_types)
+            self.assertEqual(sorted(generated), ['a', 'b', 'common'])
+            del generated[:]
+            # The outputs of each namespace are restored from the cache.
+            self.assertEqual(build(python_types), output)
+            self.assertEqual(generated, [])
+            # Arguments are part of the key.
+            build(python_types, ['--no-docstrings'])
+            self.assertEqual(sorted(generated), ['a', 'b', 'common'])
+            del generated[:]
+            # Only the namespaces that reference a changed namespace are
+            # generated again.
+            specs['b'] += '    g String\n'
+            self.assertNotEqual(build(python_types)['b.py'], output['b.py'])
+            self.assertEqual(generated, ['b'])
+            del generated[:]
+            specs['common'] = 'namespace common\nalias Id = String(min_length=1)\n'
+            build(python_types)
+            self.assertEqual(sorted(generated), ['a', 'common'])
+
+        client_args = ['-m', 'client', '-c', 'Client', '-t', '.']
+        client_generate = python_client.PythonClientBackend.generate
+        with mock.patch.object(python_client.PythonClientBackend, 'generate',
+                               autospec=True, side_effect=client_generate) as m:
+            output = build(python_client, client_args)
+            self.assertEqual(build(python_client, client_args), output)
+            self.assertEqual(m.call_count, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
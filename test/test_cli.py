@@ -2,9 +2,31 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import os
+import shutil
+import tempfile
+import textwrap
 import unittest
+import zipfile
 
+import six
+
+try:
+    # Works for Py 3.3+
+    from unittest import mock
+except ImportError:
+    # See https://github.com/python/mypy/issues/1153#issuecomment-253842414
+    import mock  # type: ignore
+
+from stone.cli import (
+    _cmdline_parser,
+    _generate,
+    _get_targets,
+    main,
+    watch,
+)
 from stone.cli_helpers import parse_route_attr_filter
+from stone.frontend.frontend import specs_to_ir
 
 
 class MockRoute():
@@ -127,6 +149,319 @@ class TestCLI(unittest.TestCase):
         self.assertFalse(expr.eval(MockRoute({'a': 1})))
         self.assertFalse(expr.eval(MockRoute({'a': 1, 'b': 3})))
 
+    def test_generate_restores_api(self):
+        text = textwrap.dedent("""\
+            namespace ns
+
+            alias Id = String
+
+            struct S
+                id Id
+
+            route a(S, Void, Void)
+                attrs
+                    hide = true
+
+            route b(Void, Void, Void)
+            """)
+        cfg = textwrap.dedent("""\
+            namespace stone_cfg
+
+            struct Route
+                hide Boolean = false
+                size Int32 = 0
+            """)
+        api = specs_to_ir([('ns.stone', text), ('stone_cfg.stone', cfg)])
+        route_schema = api.route_schema
+        routes = api.namespaces['ns'].routes
+        id_alias = api.namespaces['ns'].alias_by_name['Id']
+        route_filter, _ = parse_route_attr_filter('hide=false')
+        seen = []
+
+        class Backend(object):
+            @staticmethod
+            def build():
+                ns = api.without_aliases().namespaces['ns']
+                seen.append(([r.name for r in ns.routes], sorted(ns.route_by_name),
+                             [r.attrs for r in ns.routes],
+                             [f.name for f in route_schema.fields]))
+
+        for cli_args, expected in [
+                (['-a', 'size'], (['b'], ['b'], [{'size': 0}], ['size'])),
+                (['-b', 'ns'], ([], [], [], [])),
+                (['-w', 'other'], None)]:
+            args = _cmdline_parser.parse_args(cli_args + ['x', 'out'])
+            with mock.patch('stone.cli.Compiler', return_value=Backend), \
+                    mock.patch('sys.stderr', new_callable=six.StringIO):
+                self.assertEqual(
+                    _generate(api, [('x', None, 'out', [])], args, route_filter),
+                    expected is not None)
+            if expected is not None:
+                self.assertEqual(seen, [expected])
+                del seen[:]
+            self.assertEqual(api.namespaces['ns'].routes, routes)
+            self.assertEqual(sorted(api.namespaces['ns'].route_by_name), ['a', 'b'])
+            self.assertEqual(routes[0].attrs, {'hide': True, 'size': 0})
+            self.assertEqual([f.name for f in route_schema.fields], ['hide', 'size'])
+            self.assertEqual(sorted(route_schema._fields_by_name), ['hide', 'size'])
+            self.assertEqual(api.namespaces['ns'].aliases, [id_alias])
+            self.assertIs(routes[0].arg_data_type.fields[0].data_type, id_alias)
+
+    def test_prune_unreachable(self):
+        ns1 = textwrap.dedent("""\
+            namespace ns1
+            import ns2
+
+            alias Id = String
+            alias Other = ns2.Unused
+
+            struct Arg
+                id Id
+                shape Shape?
+
+            struct Shape
+                union
+                    circle Circle
+                radius Float64
+
+            struct Circle extends Shape
+                "Reached as an enumerated subtype."
+
+            union Err
+                bad ns2.Reason
+
+            struct Unused
+                f ns2.Unused
+
+            route a(Arg, Void, Err)
+            """)
+        ns2 = textwrap.dedent("""\
+            namespace ns2
+
+            union Reason
+                invalid
+
+            struct Unused
+                f String
+
+            route b(Unused, Void, Void)
+            """)
+        api = specs_to_ir([('ns1.stone', ns1), ('ns2.stone', ns2)])
+        seen = []
+
+        class Backend(object):
+            @staticmethod
+            def build():
+                seen.append({
+                    namespace.name: (
+                        [data_type.name for data_type in namespace.data_types],
+                        sorted(namespace.data_type_by_name),
+                        [alias.name for alias in namespace.aliases],
+                        [n.name for n in namespace.get_imported_namespaces()])
+                    for namespace in api.namespaces.values()})
+
+        for cli_args, expected in [
+                ([], {
+                    'ns1': (['Arg', 'Circle', 'Err', 'Shape', 'Unused'],
+                            ['Arg', 'Circle', 'Err', 'Shape', 'Unused'],
+                            ['Id', 'Other'], ['ns2']),
+                    'ns2': (['Reason', 'Unused'], ['Reason', 'Unused'], [], [])}),
+                (['-w', 'ns1', '--prune-unreachable'], {
+                    'ns1': (['Arg', 'Circle', 'Err', 'Shape'],
+                            ['Arg', 'Circle', 'Err', 'Shape'], ['Id'], ['ns2']),
+                    'ns2': (['Reason'], ['Reason'], [], [])}),
+                (['-w', 'ns2', '--prune-unreachable'], {
+                    'ns1': ([], [], [], []),
+                    'ns2': (['Unused'], ['Unused'], [], [])})]:
+            args = _cmdline_parser.parse_args(cli_args + ['x', 'out'])
+            with mock.patch('stone.cli.Compiler', return_value=Backend):
+                self.assertTrue(_generate(api, [('x', None, 'out', [])], args, None))
+            self.assertEqual(seen, [expected])
+            del seen[:]
+
+        # The pruned types are restored afterwards.
+        namespace = api.namespaces['ns1']
+        self.assertEqual([data_type.name for data_type in namespace.data_types],
+                         ['Arg', 'Circle', 'Err', 'Shape', 'Unused'])
+        self.assertEqual(sorted(namespace.alias_by_name), ['Id', 'Other'])
+        self.assertEqual(namespace.get_imported_namespaces(), [api.namespaces['ns2']])
+
+    def test_watch(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        spec_path = os.path.join(temp_dir, 'ns.stone')
+        output_path = os.path.join(temp_dir, 'out')
+
+        def write_spec(text):
+            with open(spec_path, 'w') as f:
+                f.write(textwrap.dedent(text))
+
+        def read_output():
+            with open(os.path.join(output_path, 'ns.py')) as f:
+                return f.read()
+
+        write_spec("""\
+            namespace ns
+
+            struct A
+                f String
+            """)
+        edits = [
+            # An error, which is reported like in a normal run.
+            lambda: write_spec("""\
+                namespace ns
+
+                struct A
+                    f Strin
+                """),
+            # The fix is picked up without restarting.
+            lambda: write_spec("""\
+                namespace ns
+
+                struct A
+                    f String
+
+                struct B
+                    g String
+                """),
+        ]
+
+        def sleep(_):
+            if edits:
+                edits.pop(0)()
+
+        args = _cmdline_parser.parse_args(['python_types', output_path, spec_path])
+        targets = [('python_types', output_path, [])]
+        with mock.patch('stone.cli.time.sleep', side_effect=sleep), \
+                mock.patch('sys.stderr', new_callable=six.StringIO) as stderr:
+            watch([(spec_path, open(spec_path).read())], args, targets, None,
+                  max_builds=1)
+            self.assertIn('class A', read_output())
+            self.assertNotIn('class B', read_output())
+            watch([(spec_path, open(spec_path).read())], args, targets, None,
+                  max_builds=3)
+        self.assertIn('class B', read_output())
+        self.assertIn("%s:4: error: Symbol 'Strin' is undefined." % spec_path,
+                      stderr.getvalue())
+
+    def test_get_targets(self):
+        for target, expected in [
+                ('python_types:out', ('python_types', 'out', [])),
+                ('python_client:out:-m client -c C',
+                 ('python_client', 'out', ['-m', 'client', '-c', 'C'])),
+                # The colon of a drive letter doesn't end the output.
+                ('python_types:C:\\out', ('python_types', 'C:\\out', [])),
+                ('python_client:c:/out:-m client',
+                 ('python_client', 'c:/out', ['-m', 'client']))]:
+            args = _cmdline_parser.parse_args(['-t', target])
+            self.assertEqual(_get_targets(args, []), [expected])
+        for target in ['python_types', 'python_types:', ':out']:
+            args = _cmdline_parser.parse_args(['-t', target])
+            with mock.patch('sys.stderr', new_callable=six.StringIO), \
+                    self.assertRaises(SystemExit):
+                _get_targets(args, [])
+
+    def test_multiple_targets(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        spec_path = os.path.join(temp_dir, 'ns.stone')
+        with open(spec_path, 'w') as f:
+            f.write(textwrap.dedent("""\
+                namespace ns
+
+                alias Id = String(min_length=1)
+
+                struct A
+                    id Id
+
+                route r(A, Void, Void)
+                """))
+        types_path = os.path.join(temp_dir, 'types')
+        client_path = os.path.join(temp_dir, 'client')
+
+        # The client backend removes aliases, yet the types backend still sees
+        # them.
+        argv = ['stone',
+                '-t', 'python_client:%s:-m client -c Client -t .' % client_path,
+                '-t', 'python_types:%s' % types_path,
+                spec_path]
+        with mock.patch('sys.argv', argv):
+            main()
+        with open(os.path.join(types_path, 'ns.py')) as f:
+            self.assertIn('A._id_validator = Id_validator', f.read())
+        with open(os.path.join(client_path, 'client.py')) as f:
+            self.assertIn('def ns_r(self', f.read())
+
+        for argv in [['stone', '-t', 'python_types', spec_path],
+                     ['stone', '-t', 'python_types:%s' % types_path, spec_path,
+                      '--', '-h'],
+                     ['stone', 'python_types']]:
+            with mock.patch('sys.argv', argv), \
+                    mock.patch('sys.stderr', new_callable=six.StringIO):
+                with self.assertRaises(SystemExit):
+                    main()
+
+        # Targets can write to the same archive.
+        archive_path = os.path.join(temp_dir, 'out', 'sdk.zip')
+        argv = ['stone', '--remove-stale', '-j', '2',
+                '-t', 'python_client:%s:-m client -c Client -t .' % archive_path,
+                '-t', 'python_types:%s' % archive_path,
+                spec_path]
+        with mock.patch('sys.argv', argv):
+            main()
+        self.assertEqual(os.listdir(os.path.join(temp_dir, 'out')), ['sdk.zip'])
+        with zipfile.ZipFile(archive_path) as zip_file:
+            self.assertEqual(
+                sorted(zip_file.namelist()),
+                ['client.py', 'ns.py', 'stone_base.py', 'stone_serializers.py',
+                 'stone_validators.py'])
+            with open(os.path.join(types_path, 'ns.py'), 'rb') as f:
+                self.assertEqual(zip_file.read('ns.py'), f.read())
+
+    def test_remove_stale(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        output_path = os.path.join(temp_dir, 'out')
+        spec_paths = []
+        for name in ('a', 'b'):
+            spec_paths.append(os.path.join(temp_dir, '%s.stone' % name))
+            with open(spec_paths[-1], 'w') as f:
+                f.write('namespace %s\n\nstruct S\n    f String\n' % name)
+
+        def run(*spec_paths):
+            argv = ['stone', '--remove-stale', 'python_types', output_path]
+            with mock.patch('sys.argv', argv + list(spec_paths)):
+                main()
+            return sorted(os.listdir(output_path))
+
+        rsrc = ['.stone-manifest', 'stone_base.py', 'stone_serializers.py',
+                'stone_validators.py']
+        self.assertEqual(run(*spec_paths), sorted(rsrc + ['a.py', 'b.py']))
+        a_path = os.path.join(output_path, 'a.py')
+        os.utime(a_path, (1000000000, 1000000000))
+        self.assertEqual(run(spec_paths[0]), sorted(rsrc + ['a.py']))
+        # Unchanged files aren't written again.
+        self.assertEqual(os.path.getmtime(a_path), 1000000000)
+
+    def test_cache_dir(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        spec_path = os.path.join(temp_dir, 'ns.stone')
+        with open(spec_path, 'w') as f:
+            f.write('namespace ns\n\nstruct S\n    f String\n')
+        cache_dir = os.path.join(temp_dir, 'cache')
+
+        argv = ['stone', '--cache-dir', cache_dir, 'python_types',
+                os.path.join(temp_dir, 'out'), spec_path]
+        with mock.patch('sys.argv', argv), \
+                mock.patch.dict(os.environ):
+            os.environ.pop('STONE_CACHE_DIR', None)
+            main()
+            self.assertNotIn('STONE_CACHE_DIR', os.environ)
+        self.assertEqual(
+            sorted(name.split('-')[0] for name in os.listdir(cache_dir)),
+            ['ast', 'outputs', 'parsetab'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,12 +5,26 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import base64
 import datetime
 import json
+import os
+import pickle
 import shutil
 import six
 import subprocess
 import sys
+import tempfile
+import textwrap
 import unittest
 
+from six.moves import copyreg
+
+try:
+    # Works for Py 3.3+
+    from unittest import mock
+except ImportError:
+    # See https://github.com/python/mypy/issues/1153#issuecomment-253842414
+    import mock  # type: ignore
+
+import stone.backends.python_rsrc.stone_base as bb
 import stone.backends.python_rsrc.stone_validators as bv
 
 from stone.backends.python_rsrc.stone_serializers import (
@@ -205,6 +219,46 @@ class TestDropInModules(unittest.TestCase):
         s = bv.Struct(C)
         self.assertRaises(bv.ValidationError, lambda: s.validate(object()))
 
+    def test_string_validator_pattern_cache(self):
+        s1 = bv.String(pattern='[a-z]+')
+        s2 = bv.String(max_length=5, pattern='[a-z]+')
+        self.assertIs(s1.pattern_re, s2.pattern_re)
+        self.assertRaises(AssertionError, bv.String, pattern='[')
+
+    def test_stone_field(self):
+        class C(object):
+            __slots__ = ['_f_value', '_f_present', '_g_value', '_g_present']
+            _f_validator = bv.String(max_length=3)
+            _g_validator = bv.Int32()
+            f = bb.StoneField('f', doc='The f field.')
+            g = bb.StoneField('g', default=5)
+
+            def __init__(self):
+                self._f_value = None
+                self._f_present = False
+                self._g_value = None
+                self._g_present = False
+
+        self.assertEqual(C.f.__doc__, 'The f field.')
+        c = C()
+        with self.assertRaises(AttributeError) as cm:
+            c.f  # pylint: disable=pointless-statement
+        self.assertEqual("missing required field 'f'", str(cm.exception))
+        self.assertEqual(c.g, 5)
+        c.f = 'abc'
+        self.assertEqual(c.f, 'abc')
+        self.assertRaises(bv.ValidationError, setattr, c, 'f', 'abcd')
+        self.assertEqual(c.f, 'abc')
+        del c.f
+        self.assertFalse(c._f_present)
+        self.assertRaises(bv.ValidationError, setattr, c, 'g', None)
+
+        C.f.nullable = True
+        self.assertIsNone(c.f)
+        c.f = 'a'
+        c.f = None
+        self.assertFalse(c._f_present)
+
     def test_json_encoder(self):
         self.assertEqual(json_encode(bv.Void(), None), json.dumps(None))
         self.assertEqual(json_encode(bv.String(), 'abc'), json.dumps('abc'))
@@ -727,8 +781,21 @@ alias AliasedBaseU = BaseU
 """
 
 
+_generated_module_names = (
+    'ns',
+    'ns2',
+    'stone_base',
+    'stone_descriptors',
+    'stone_serializers',
+    'stone_validators',
+)
+
+
 class TestGeneratedPython(unittest.TestCase):
 
+    backend = 'python_types'
+    backend_args = []
+
     def setUp(self):
 
         # Sanity check: stone must be importable for the compiler to work
@@ -739,9 +806,9 @@ class TestGeneratedPython(unittest.TestCase):
             [sys.executable,
              '-m',
              'stone.cli',
-             'python_types',
+             self.backend,
              'output',
-             '-'],
+             '-'] + self.backend_args,
             stdin=subprocess.PIPE,
             stderr=subprocess.PIPE)
         _, stderr = p.communicate(
@@ -750,6 +817,10 @@ class TestGeneratedPython(unittest.TestCase):
             raise AssertionError('Could not execute stone tool: %s' %
                                  stderr.decode('utf-8'))
 
+        # Drop modules generated by a previous test case, which may have
+        # used a different backend.
+        for name in _generated_module_names:
+            sys.modules.pop(name, None)
         sys.path.append('output')
         self.ns2 = __import__('ns2')
         self.ns = __import__('ns')
@@ -1420,6 +1491,145 @@ class TestGeneratedPython(unittest.TestCase):
         s = self.ns.S3()
         assert s.u == self.ns2.BaseU.z
 
+    def test_pickle(self):
+        c = self.ns.C(a='a', b=1, c=b'x', d=1.5)
+        e = self.ns.E(c=3)
+        v = self.ns.V.t1('hi')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            c2 = pickle.loads(pickle.dumps(c, protocol))
+            self.assertIsInstance(c2, self.ns.C)
+            self.assertEqual(repr(c), repr(c2))
+            e2 = pickle.loads(pickle.dumps(e, protocol))
+            self.assertEqual(e2.a, 'test')
+            self.assertFalse(e2._a_present)
+            self.assertEqual(e2.c, 3)
+            self.assertEqual(pickle.loads(pickle.dumps(v, protocol)), v)
+            self.assertEqual(
+                pickle.loads(pickle.dumps(self.ns.U.t0, protocol)),
+                self.ns.U.t0)
+
+        # Only the field values are stored, not the name of every slot as
+        # with the default protocol.
+        slots = {}
+        for field_name, _ in self.ns.C._all_fields_:
+            for slot in ('_%s_value', '_%s_present'):
+                slots[slot % field_name] = getattr(c, slot % field_name)
+        self.assertLess(len(pickle.dumps(c, 2)),
+                        len(pickle.dumps((self.ns.C, (None, slots)), 2)))
+
+    def test_unpickle_slots(self):
+        # Instances pickled by the default protocol, as they were before
+        # structs and unions defined __getstate__, can still be unpickled.
+        for obj in (self.ns.A(a='a', b=1), self.ns.C(a='a', b=1, c=b'x', d=1.5),
+                    self.ns.E(c=3), self.ns.V.t1('hi'), self.ns.U.t0):
+            slots = {}
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(obj, slot):
+                        slots[slot] = getattr(obj, slot)
+            reduce_value = copyreg.__newobj__, (type(obj),), (None, slots)
+            with mock.patch.object(type(obj), '__reduce__', return_value=reduce_value):
+                data = pickle.dumps(obj, 2)
+            self.assertEqual(repr(pickle.loads(data)), repr(obj))
+
+        # A state with the wrong number of field values is rejected.
+        for obj, state in [(self.ns.A(a='a', b=1), ('a', 1, b'x')),
+                           (self.ns.C(a='a', b=1, c=b'x', d=1.5), ('a', 1, b'x'))]:
+            with self.assertRaises(ValueError):
+                obj.__setstate__(state)
+
+    def test_shared_validators(self):
+        # Identical validators are constructed once per namespace.
+        self.assertIs(self.ns.A._a_validator, self.ns.D._a_validator)
+        self.assertIs(self.ns.D._c_validator,
+                      self.ns.D._e_validator.value_validator)
+
+
+class TestGeneratedPythonNoDocstrings(TestGeneratedPython):
+    """Runs the generated code tests against code without docstrings."""
+
+    backend_args = ['--', '--no-docstrings']
+
+    def test_docstring(self):
+        self.assertIsNone(self.ns.A.__doc__)
+        self.assertIsNone(self.ns.A.a.__doc__)
+        self.assertIsNone(self.ns.U.__doc__)
+        self.assertIsNone(self.ns.U.is_t0.__doc__)
+        self.assertIsNone(self.ns.V.t1.__doc__)
+        self.assertIsNone(self.ns.V.get_t1.__doc__)
+
+
+class TestGeneratedPythonClient(unittest.TestCase):
+    """Tests the client that the python_client backend generates."""
+
+    spec = textwrap.dedent("""\
+        namespace ns
+
+        struct Arg
+            f String
+                "Doc of f."
+
+        route get(Arg, Void, Void)
+            "Doc of get."
+        """)
+
+    def _generate(self, backend_args):
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        p = subprocess.Popen(
+            [sys.executable,
+             '-m',
+             'stone.cli',
+             'python_client',
+             output_path,
+             '-',
+             '--',
+             '-m', 'client',
+             '-c', 'Client',
+             '-t', '.'] + backend_args,
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        _, stderr = p.communicate(input=self.spec.encode('utf-8'))
+        if p.wait() != 0:
+            raise AssertionError('Could not execute stone tool: %s' %
+                                 stderr.decode('utf-8'))
+        with open(os.path.join(output_path, 'client.py')) as f:
+            return f.read()
+
+    def test_no_docstrings(self):
+        client = self._generate([])
+        self.assertIn('Doc of get.', client)
+        self.assertIn(':param str f: Doc of f.', client)
+        # The route methods are generated without their docstrings.
+        client = self._generate(['--no-docstrings'])
+        self.assertIn('def ns_get(', client)
+        self.assertNotIn('"""', client)
+        self.assertNotIn('Doc of', client)
+
+
+class TestGeneratedPythonDescriptors(TestGeneratedPython):
+    """Runs the generated code tests against the python_descriptors backend."""
+
+    backend = 'python_descriptors'
+
+    def test_docstring(self):
+        # Docstrings are not part of the data table, so the synthesized
+        # classes and fields have none.
+        self.assertIsNone(self.ns.A.__doc__)
+        self.assertIsNone(self.ns.A.a.__doc__)
+        self.assertIsNone(self.ns.U.__doc__)
+        self.assertIsNone(self.ns.DocTest.b.__doc__)
+
+    def test_lazy_synthesis(self):
+        self.assertNotIn('A', self.ns.__dict__)
+        self.assertIn('A', dir(self.ns))
+        a = self.ns.A(a='hi', b=1)
+        self.assertIn('A', self.ns.__dict__)
+        self.assertEqual(self.ns.A.__module__, 'ns')
+        self.assertEqual(repr(a), "A(a='hi', b=1)")
+        with self.assertRaises(AttributeError):
+            self.ns.DoesNotExist  # pylint: disable=pointless-statement
+
 # Adapted from:
 # http://code.activestate.com/recipes/306860-proleptic-gregorian-dates-and-strftime-before-1900/
 # Make sure that the day names are in order from 0001/01/01 until
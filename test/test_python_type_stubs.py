@@ -221,7 +221,7 @@ class TestPythonTypeStubs(unittest.TestCase):
         expected = textwrap.dedent("""\
             {headers}
 
-            class Struct1(object):
+            class Struct1(bb.Struct):
                 def __init__(self,
                              f1: bool = ...) -> None: ...
 
@@ -235,7 +235,7 @@ class TestPythonTypeStubs(unittest.TestCase):
                 def f1(self) -> None: ...
 
 
-            class Struct2(object):
+            class Struct2(bb.Struct):
                 def __init__(self,
                              f2: List[long] = ...,
                              f3: datetime.datetime = ...,
@@ -288,7 +288,7 @@ class TestPythonTypeStubs(unittest.TestCase):
         expected = textwrap.dedent("""\
             {headers}
 
-            class NestedTypes(object):
+            class NestedTypes(bb.Struct):
                 def __init__(self,
                              list_of_nullables: List[Optional[long]] = ...,
                              nullable_list: Optional[List[long]] = ...) -> None: ...
@@ -373,7 +373,7 @@ class TestPythonTypeStubs(unittest.TestCase):
         expected = textwrap.dedent("""\
             {headers}
 
-            class Struct1(object):
+            class Struct1(bb.Struct):
                 def __init__(self,
                              f1: bool = ...) -> None: ...
 
@@ -4,26 +4,58 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # pylint: disable=deprecated-method,useless-suppression
 
+from collections import OrderedDict
+import copy
 import datetime
+import os
+import pickle
+import shutil
+import tempfile
 import textwrap
+import time
 import unittest
 
+import six
+
+try:
+    # Works for Py 3.3+
+    from unittest import mock
+except ImportError:
+    # See https://github.com/python/mypy/issues/1153#issuecomment-253842414
+    import mock  # type: ignore
+
 from stone.frontend.ast import (
+    ASTNode,
     AstNamespace,
     AstAlias,
     AstVoidField,
     AstTagRef,
 )
+from stone.frontend.cache import (
+    grammar_hash,
+    prune_cache,
+    read_cache_entry,
+    write_cache_entry,
+)
 from stone.frontend.exception import InvalidSpec
-from stone.frontend.frontend import specs_to_ir
+from stone.frontend.frontend import (
+    IRBuilder,
+    specs_to_ir,
+)
+from stone.frontend.lexer import Lexer
 from stone.frontend.parser import ParserFactory
 from stone.ir import (
     Alias,
+    ApiNamespace,
+    ApiRoute,
+    FrozenError,
+    UserDefined,
     is_boolean_type,
     is_integer_type,
     is_void_type,
     Nullable,
     String,
+    Struct,
     Map
 )
 
@@ -2777,6 +2809,131 @@ class TestStone(unittest.TestCase):
             example.text,
             "This is the text for the example. And I guess it's kind of long.")
 
+    def test_examples_reference_chain(self):
+        # Each struct's example references the previous struct's example
+        # twice, so computing references without memoization would take
+        # exponential time.
+        depth = 40
+        parts = ['namespace test\n\n'
+                 'struct T0\n    s String\n\n'
+                 '    example default\n        s = "leaf"\n\n']
+        for i in range(1, depth + 1):
+            parts.append('struct T%d\n    a T%d\n    b T%d\n\n'
+                         '    example default\n        a = default\n'
+                         '        b = default\n\n' % (i, i - 1, i - 1))
+        parts.append('union U\n    t T%d\n\n'
+                     '    example default\n        t = default\n' % depth)
+
+        computed = []
+        compute_example = Struct._compute_example_flat_helper
+
+        def record_example(data_type, label):
+            computed.append((data_type.name, label))
+            return compute_example(data_type, label)
+
+        with mock.patch.object(Struct, '_compute_example_flat_helper',
+                               record_example):
+            api = specs_to_ir([('test.stone', ''.join(parts))])
+        self.assertEqual(len(computed), depth + 1)
+
+        example = api.namespaces['test'].data_type_by_name['U'].get_examples()
+        value = example['default'].value
+        self.assertEqual(value['.tag'], 't')
+        for _ in range(depth):
+            self.assertEqual(value['a'], value['b'])
+            value = value['a']
+        self.assertEqual(value, {'s': 'leaf'})
+
+    def test_examples_read_only(self):
+        text = textwrap.dedent("""\
+            namespace test
+
+            union U
+                a
+                b String
+
+                example b
+                    b = "b"
+
+            struct S
+                u U
+                us List(U)
+                s String
+
+                example default
+                    u = a
+                    us = [a, b]
+                    s = "s"
+
+                example b
+                    u = b
+                    us = []
+                    s = "t"
+
+            struct T
+                s1 S
+                s2 S
+
+                example default
+                    s1 = default
+                    s2 = default
+            """)
+        api = specs_to_ir([('test.stone', text)])
+        s_dt = api.namespaces['test'].data_type_by_name['S']
+        t_dt = api.namespaces['test'].data_type_by_name['T']
+
+        # Examples are computed once, and can't be modified.
+        examples = t_dt.get_examples()
+        self.assertIs(t_dt.get_examples(), examples)
+        self.assertIs(t_dt.get_examples(compact=True),
+                      t_dt.get_examples(compact=True))
+        value = examples['default'].value
+        self.assertIsInstance(value, dict)
+        for modify in [lambda: value.update(s1={}),
+                       lambda: value['s1'].pop('s'),
+                       lambda: value['s1']['us'].append({}),
+                       examples.clear]:
+            with self.assertRaises(TypeError):
+                modify()
+
+        # Copies can be modified, and are independent of the examples.
+        example = copy.deepcopy(examples['default'])
+        example.value['s1']['s'] = 'changed'
+        example.value['s1']['us'].append({'.tag': 'a'})
+        self.assertEqual(value['s1']['s'], 's')
+        self.assertEqual(len(value['s1']['us']), 2)
+        self.assertEqual(example.value['s2']['s'], 's')
+
+        # Void tags are compacted in dicts, but not directly in lists.
+        self.assertEqual(
+            t_dt.get_examples(compact=True)['default'].value['s1'],
+            {'u': 'a', 'us': [{'.tag': 'a'}, {'.tag': 'b', 'b': 'b'}], 's': 's'})
+        self.assertEqual(value['s1']['u'], {'.tag': 'a'})
+        self.assertEqual(s_dt.get_examples(compact=True)['b'].value,
+                         {'u': {'.tag': 'b', 'b': 'b'}, 'us': [], 's': 't'})
+
+    def test_examples_reference_cycle(self):
+        text = textwrap.dedent("""\
+            namespace test
+
+            struct S
+                u U?
+
+                example default
+                    u = default
+
+            union U
+                s S
+
+                example default
+                    s = default
+            """)
+        with self.assertRaises(InvalidSpec) as cm:
+            specs_to_ir([('test.stone', text)])
+        self.assertIn('references itself, directly or through other examples',
+                      cm.exception.msg)
+        self.assertEqual(cm.exception.lineno, 6)
+
     def test_examples_enumerated_subtypes(self):
         # Test missing custom example
         text = textwrap.dedent("""\
@@ -3495,6 +3652,249 @@ class TestStone(unittest.TestCase):
         # Check that type that is wrapped by a list and/or nullable is present
         self.assertIn(s4, route_data_types)
 
+    def test_interned_data_types(self):
+        text1 = textwrap.dedent("""\
+            namespace ns1
+            alias Id = String(min_length=1)
+            struct S1
+                f1 String
+                f2 String?
+                f3 List(String)?
+                f4 String(min_length=1)
+                f5 List(String, min_items=1)
+                f6 Map(String, List(String))
+                f7 Id?
+            union U1
+                a
+                b Int64
+            """)
+        text2 = textwrap.dedent("""\
+            namespace ns2
+            import ns1
+            struct S2
+                f1 String?
+                f2 List(String)?
+                f3 String(max_length=1)
+                f4 Int32
+                f5 ns1.Id?
+                f6 Int64(min_value=1)
+                f7 Int64
+            route r(S2, Void, ns1.U1)
+            """)
+        api = specs_to_ir([('ns1.stone', text1), ('ns2.stone', text2)])
+        ns1 = api.namespaces['ns1']
+        s1 = ns1.data_type_by_name['S1']
+        s2 = api.namespaces['ns2'].data_type_by_name['S2']
+        u1 = ns1.data_type_by_name['U1']
+        f1, f2, f3, f4, f5, f6, f7 = [f.data_type for f in s1.fields]
+
+        # Identical types are the same instance, in every namespace.
+        self.assertIs(f2.data_type, f1)
+        self.assertIs(f3.data_type.data_type, f1)
+        self.assertIs(f6.key_data_type, f1)
+        self.assertIs(f6.value_data_type, f3.data_type)
+        self.assertIs(s2.fields[0].data_type, f2)
+        self.assertIs(s2.fields[1].data_type, f3)
+        self.assertIs(s2.fields[4].data_type, f7)
+        self.assertIs(s2.fields[6].data_type, u1.fields[1].data_type)
+        self.assertIs(api.namespaces['ns2'].routes[0].result_data_type,
+                      u1.fields[0].data_type)
+        self.assertIs(f4, ns1.alias_by_name['Id'].data_type)
+
+        # Types with different arguments are different instances.
+        self.assertIsNot(f4, f1)
+        self.assertIsNot(f5, f3.data_type)
+        self.assertIsNot(s2.fields[2].data_type, f4)
+        self.assertIsNot(s2.fields[3].data_type, s2.fields[6].data_type)
+        self.assertIsNot(s2.fields[5].data_type, s2.fields[6].data_type)
+
+    def test_api_without_aliases(self):
+        text1 = textwrap.dedent("""\
+            namespace ns1
+            alias Id = String
+            alias Ids = List(Id)
+            struct S1
+                id Id
+                ids Ids?
+                names List(String)?
+                by_id Map(String, Id)
+                next S1?
+            union U
+                a
+                b Id
+            route r(S1, Id, U)
+            """)
+        text2 = textwrap.dedent("""\
+            namespace ns2
+            import ns1
+            alias Ref = ns1.S1
+            struct S2
+                ref Ref
+                u ns1.U = a
+            """)
+        api = specs_to_ir([('ns1.stone', text1), ('ns2.stone', text2)])
+        view = api.without_aliases()
+        ns1, ns2 = view.namespaces['ns1'], view.namespaces['ns2']
+        s1, u, s2 = (ns1.data_type_by_name['S1'], ns1.data_type_by_name['U'],
+                     ns2.data_type_by_name['S2'])
+        string = api.namespaces['ns1'].alias_by_name['Id'].data_type
+
+        # References to aliases are replaced by the types they alias.
+        self.assertEqual(ns1.aliases, [])
+        self.assertEqual(ns2.alias_by_name, {})
+        self.assertIs(s1.fields[0].data_type, string)
+        self.assertIs(s1.fields[1].data_type.data_type.data_type, string)
+        self.assertIs(s1.fields[3].data_type.value_data_type, string)
+        self.assertIs(u.fields[1].data_type, string)
+        self.assertIs(ns1.routes[0].result_data_type, string)
+        # Types that only differed by an alias are the same in the view.
+        self.assertIs(s1.fields[1].data_type, s1.fields[2].data_type)
+
+        # References between objects stay within the view.
+        self.assertIs(s2.fields[0].data_type, s1)
+        self.assertIs(s1.fields[4].data_type.data_type, s1)
+        self.assertIs(s2.fields[1].default.union_data_type, u)
+        self.assertIs(s1.namespace, ns1)
+        self.assertIs(ns1.routes[0].arg_data_type, s1)
+        self.assertIs(ns1.route_by_name['r'], ns1.routes[0])
+        self.assertIs(view.route_schema, view.route_schema)
+        self.assertEqual(ns2.get_imported_namespaces(), [ns1])
+        self.assertEqual(ns1.linearize_data_types(), [s1, u])
+
+        # The API is unchanged.
+        orig_s1 = api.namespaces['ns1'].data_type_by_name['S1']
+        self.assertIsNot(orig_s1, s1)
+        self.assertEqual([a.name for a in api.namespaces['ns1'].aliases],
+                         ['Id', 'Ids'])
+        self.assertIs(orig_s1.fields[0].data_type,
+                      api.namespaces['ns1'].alias_by_name['Id'])
+
+        # The view is computed once while the API is frozen.
+        self.assertIsNot(api.without_aliases(), view)
+        api.freeze()
+        view = api.without_aliases()
+        self.assertTrue(view.frozen)
+        self.assertIs(api.without_aliases(), view)
+        with self.assertRaises(FrozenError):
+            view.namespaces['ns1'].data_types.pop()
+
+    def test_reference_index(self):
+        ns1_text = textwrap.dedent("""\
+            namespace ns1
+            struct Base
+                union
+                    sub Sub
+                b String
+            struct Sub extends Base
+                m Map(String, List(U1?))
+            union U1
+                a
+                s Sub
+            alias A1 = U1
+            route r(Sub, A1, Void)
+            """)
+        ns2_text = textwrap.dedent("""\
+            namespace ns2
+            import ns1
+            struct S2
+                f ns1.A1
+            route r2(S2, Void, ns1.U1)
+            """)
+        api = specs_to_ir([('ns1.stone', ns1_text), ('ns2.stone', ns2_text)])
+        ns1 = api.namespaces['ns1']
+        ns2 = api.namespaces['ns2']
+        base = ns1.data_type_by_name['Base']
+        sub = ns1.data_type_by_name['Sub']
+        u1 = ns1.data_type_by_name['U1']
+        a1 = ns1.alias_by_name['A1']
+        s2 = ns2.data_type_by_name['S2']
+        r = ns1.route_by_name['r']
+        r2 = ns2.route_by_name['r2']
+
+        index = api.get_reference_index()
+        self.assertEqual(index.get_references(sub), [base, u1])
+        self.assertEqual(index.get_references(sub.fields[0]), [u1])
+        self.assertEqual(index.get_references(base), [])
+        self.assertEqual(index.get_references(a1), [u1])
+        self.assertEqual(index.get_references(r), [sub, a1])
+        self.assertEqual(index.get_references(ns2), [a1, s2, u1])
+        self.assertEqual(index.get_route_io_references(r2, arg=False), [u1])
+        self.assertEqual(index.get_route_io_references(r, error=False), [sub, a1])
+
+        self.assertEqual(index.get_referencing_fields(u1), [sub.fields[0]])
+        self.assertEqual(index.get_referencing_fields(a1), [s2.fields[0]])
+        self.assertEqual(index.get_referencing_aliases(u1), [a1])
+        self.assertEqual(index.get_referencing_routes(u1), [r2])
+        self.assertEqual(index.get_referencing_routes(a1), [r])
+        self.assertEqual(index.get_referencing_namespaces(a1), [ns1, ns2])
+        self.assertEqual(index.get_subtypes(base), [sub])
+        self.assertEqual(index.get_subtypes(sub), [])
+        self.assertIs(index.get_owner(sub.fields[0]), sub)
+        self.assertIs(index.get_owner(a1), ns1)
+        self.assertIs(index.get_owner(r2), ns2)
+
+        # The index is built once while the API is frozen.
+        self.assertIsNot(api.get_reference_index(), index)
+        api.freeze()
+        self.assertIs(api.get_reference_index(), api.get_reference_index())
+
+    def test_frozen_api(self):
+        text = textwrap.dedent("""\
+            namespace ns1
+            struct S1
+                f1 String
+            struct S2 extends S1
+                f2 S3?
+            struct S3
+                f3 String
+            route r(S2, S3, Void)
+            """)
+        api = specs_to_ir([('ns1.stone', text)])
+        ns1 = api.namespaces['ns1']
+        s2 = ns1.data_type_by_name['S2']
+        self.assertFalse(api.frozen)
+        self.assertIsNot(ns1.linearize_data_types(), ns1.linearize_data_types())
+
+        # Views are computed once while frozen.
+        api.freeze()
+        self.assertTrue(api.frozen)
+        # Frozen objects keep their class, which backends look types up by.
+        self.assertIs(type(s2), Struct)
+        self.assertIs(s2.all_fields[0].data_type.__class__, String)
+        self.assertEqual([f.name for f in s2.all_fields], ['f1', 'f2'])
+        self.assertIs(s2.all_fields, s2.all_fields)
+        self.assertIs(ns1.linearize_data_types(), ns1.linearize_data_types())
+        self.assertIs(ns1.get_route_io_data_types(),
+                      ns1.get_route_io_data_types())
+        self.assertIs(ns1.get_imported_namespaces(),
+                      ns1.get_imported_namespaces())
+
+        # The IR can't be modified while frozen.
+        for modify in [lambda: setattr(s2, 'name', 'S4'),
+                       lambda: delattr(s2, 'name'),
+                       lambda: setattr(s2.fields[0], 'name', 'f4'),
+                       lambda: setattr(ns1.routes[0], 'arg_data_type', s2),
+                       lambda: s2.fields.append(s2.fields[0]),
+                       ns1.data_types.pop,
+                       s2.all_fields.pop]:
+            with self.assertRaises(FrozenError):
+                modify()
+
+        # Pickles and copies of a frozen IR are frozen.
+        for api_copy in [pickle.loads(pickle.dumps(api)), copy.deepcopy(api)]:
+            self.assertTrue(api_copy.frozen)
+            s2_copy = api_copy.namespaces['ns1'].data_type_by_name['S2']
+            self.assertEqual([f.name for f in s2_copy.all_fields], ['f1', 'f2'])
+            with self.assertRaises(FrozenError):
+                s2_copy.name = 'S4'
+
+        # Thawing the IR allows modifying it again.
+        api.thaw()
+        self.assertFalse(api.frozen)
+        s2.fields.append(s2.fields[0])
+        self.assertEqual(len(s2.all_fields), 3)
+        self.assertIs(type(s2), Struct)
+
     def test_whitespace(self):
         text = textwrap.dedent("""\
             namespace test
@@ -3906,6 +4306,542 @@ class TestStone(unittest.TestCase):
         self.assertEqual(cm.exception.lineno, 9)
         self.assertEqual(cm.exception.path, 'ns1.stone')
 
+    def test_parallel_parsing(self):
+        specs = [
+            ('ns%d.stone' % i,
+             'namespace ns%d\n\nstruct S\n    f String\n' % i)
+            for i in range(4)
+        ]
+        specs.append(('empty.stone', '# Empty.\n'))
+        specs.append(('ns0_more.stone', 'namespace ns0\n\nstruct T\n    g S\n'))
+        api = specs_to_ir(specs, jobs=3)
+        self.assertEqual(list(api.namespaces), ['ns0', 'ns1', 'ns2', 'ns3'])
+        self.assertEqual([dt.name for dt in api.namespaces['ns0'].data_types],
+                         ['S', 'T'])
+        self.assertEqual(
+            api.namespaces['ns0'].data_type_by_name['T'].fields[0].data_type,
+            api.namespaces['ns0'].data_type_by_name['S'])
+
+        # The first error in the order of the specs is reported.
+        specs[1] = ('bad1.stone', 'namespace ns1\n\nstruct S\n  f String\n')
+        specs[3] = ('bad3.stone', 'namespace ns3\n\nstruct $\n')
+        for jobs in (1, 3):
+            with self.assertRaises(InvalidSpec) as cm:
+                specs_to_ir(specs, jobs=jobs)
+            self.assertEqual(cm.exception.path, 'bad1.stone')
+            self.assertEqual(cm.exception.lineno, 4)
+            self.assertIn('Indent', cm.exception.msg)
+
+
+class TestParseTableCache(unittest.TestCase):
+    """
+    Tests caching of the parse tables between ParserFactory instances.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_cache_dir = os.environ.get('STONE_CACHE_DIR')
+        os.environ['STONE_CACHE_DIR'] = self.cache_dir
+
+    def tearDown(self):
+        if self.old_cache_dir is None:
+            del os.environ['STONE_CACHE_DIR']
+        else:
+            os.environ['STONE_CACHE_DIR'] = self.old_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def _parse(self):
+        parser = ParserFactory().get_parser()
+        return parser.parse('namespace test\n\nstruct S\n    f String\n')
+
+    def test_tables_are_cached(self):
+        self._parse()
+        cached = os.listdir(self.cache_dir)
+        self.assertEqual(
+            cached,
+            ['parsetab-%s.pickle' % grammar_hash(ParserFactory)])
+        # The second parser reads the tables, rather than writing them again,
+        # and marks them as recently used.
+        path = os.path.join(self.cache_dir, cached[0])
+        inode = os.stat(path).st_ino
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime - 10, mtime - 10))
+        self.assertEqual(self._parse()[1].name, 'S')
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertGreater(os.path.getmtime(path), mtime - 10)
+        self.assertEqual(os.listdir(self.cache_dir), cached)
+
+    def test_corrupt_tables_are_regenerated(self):
+        self._parse()
+        path = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(path, 'wb') as f:
+            f.write(b'corrupt')
+        self.assertEqual(self._parse()[1].name, 'S')
+        self.assertGreater(os.path.getsize(path), len(b'corrupt'))
+
+    def test_grammar_hash(self):
+        class Grammar(object):
+            tokens = ('A',)
+
+            def p_rule(self, p):
+                """rule : A"""
+
+        class ChangedGrammar(Grammar):
+
+            def p_rule(self, p):
+                """rule : A A"""
+
+        self.assertEqual(grammar_hash(Grammar), grammar_hash(Grammar()))
+        self.assertNotEqual(grammar_hash(Grammar), grammar_hash(ChangedGrammar))
+
+    def test_explicit_cache_dir(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        parser = ParserFactory(cache_dir=cache_dir).get_parser()
+        parser.parse('namespace test\n')
+        self.assertEqual(
+            os.listdir(cache_dir),
+            ['parsetab-%s.pickle' % grammar_hash(ParserFactory)])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+class TestAstCache(unittest.TestCase):
+    """
+    Tests caching of the ASTs of parsed specs.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _entries(self):
+        return sorted(os.path.join(self.cache_dir, name)
+                      for name in os.listdir(self.cache_dir)
+                      if name.startswith('ast-'))
+
+    def test_unchanged_specs_are_not_parsed(self):
+        specs = [
+            ('ns1.stone', 'namespace ns1\n    "Doc."\n\nstruct S\n    f String\n'),
+            ('ns2.stone', 'namespace ns2\n\nimport ns1\n\nalias A = ns1.S\n'),
+        ]
+        api = specs_to_ir(specs, cache_dir=self.cache_dir)
+        self.assertEqual(api.namespaces['ns1'].doc, 'Doc.\n')
+        self.assertEqual(len(self._entries()), 2)
+
+        # The cached AST is used instead of parsing the spec.
+        for path in self._entries():
+            partial_ast = read_cache_entry(path)
+            if partial_ast[0].name == 'ns1':
+                partial_ast[0].doc = 'Cached doc.\n'
+                write_cache_entry(path, partial_ast)
+        api = specs_to_ir(specs, cache_dir=self.cache_dir)
+        self.assertEqual(api.namespaces['ns1'].doc, 'Cached doc.\n')
+        self.assertIs(api.namespaces['ns2'].alias_by_name['A'].data_type,
+                      api.namespaces['ns1'].data_type_by_name['S'])
+
+        # A changed spec is parsed again.
+        specs[0] = ('ns1.stone', specs[0][1].replace('Doc.', 'New doc.'))
+        api = specs_to_ir(specs, cache_dir=self.cache_dir)
+        self.assertEqual(api.namespaces['ns1'].doc, 'New doc.\n')
+        self.assertEqual(len(self._entries()), 3)
+
+    def test_error_locations(self):
+        text = textwrap.dedent("""\
+            namespace test
+
+            struct S
+                f Undefined
+            """)
+        for path in ('a.stone', 'a.stone', 'b.stone'):
+            with self.assertRaises(InvalidSpec) as cm:
+                specs_to_ir([(path, text)], cache_dir=self.cache_dir)
+            self.assertEqual(cm.exception.path, path)
+            self.assertEqual(cm.exception.lineno, 4)
+        self.assertEqual(len(self._entries()), 2)
+
+        # Specs that fail to parse aren't cached.
+        with self.assertRaises(InvalidSpec):
+            specs_to_ir([('c.stone', 'namespace test\n$\n')],
+                        cache_dir=self.cache_dir)
+        self.assertEqual(len(self._entries()), 2)
+
+    def test_corrupt_entries_are_ignored(self):
+        specs = [('ns.stone', 'namespace ns\n\nstruct S\n    f String\n')]
+        specs_to_ir(specs, cache_dir=self.cache_dir)
+        path, = self._entries()
+        for data in (b'corrupt', b''):
+            with open(path, 'wb') as f:
+                f.write(data)
+            api = specs_to_ir(specs, cache_dir=self.cache_dir)
+            self.assertIn('S', api.namespaces['ns'].data_type_by_name)
+            self.assertIsInstance(read_cache_entry(path), list)
+
+    def test_parse_tables_are_cached_in_cache_dir(self):
+        specs = [('ns.stone', 'namespace ns\n\nstruct S\n    f String\n')]
+        specs_to_ir(specs, cache_dir=self.cache_dir)
+        self.assertIn('parsetab-%s.pickle' % grammar_hash(ParserFactory),
+                      os.listdir(self.cache_dir))
+
+
+class TestPruneCache(unittest.TestCase):
+    """
+    Tests removing the least recently used cache entries.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _write(self, name, size, age):
+        path = os.path.join(self.cache_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_prune_cache(self):
+        key = 'a' * 40
+        temp_suffix = '.%s.tmp' % ('b' * 32)
+        self._write('ast-%s.pickle' % key, 100, 30)
+        self._write('outputs-%s.pickle' % key, 100, 20)
+        self._write('parsetab-%s.pickle' % key, 100, 10)
+        self._write('ast-%s.pickle%s' % (key, temp_suffix), 1000, 10)
+        self._write('outputs-%s.pickle%s' % (key, temp_suffix), 1000, 7200)
+        self._write('other.pickle', 1000, 7200)
+
+        prune_cache(self.cache_dir, 250)
+        # The oldest entry is removed, as well as the temporary file of an
+        # interrupted write. Other files are kept.
+        self.assertEqual(
+            sorted(os.listdir(self.cache_dir)),
+            ['ast-%s.pickle%s' % (key, temp_suffix),
+             'other.pickle',
+             'outputs-%s.pickle' % key,
+             'parsetab-%s.pickle' % key])
+
+        # Reading an entry marks it as recently used.
+        path = os.path.join(self.cache_dir, 'ast-%s.pickle' % ('c' * 40))
+        write_cache_entry(path, [])
+        mtime = time.time() - 30
+        os.utime(path, (mtime, mtime))
+        self.assertEqual(read_cache_entry(path), [])
+        prune_cache(self.cache_dir, 150)
+        self.assertEqual(
+            sorted(os.listdir(self.cache_dir)),
+            ['ast-%s.pickle%s' % (key, temp_suffix),
+             'ast-%s.pickle' % ('c' * 40),
+             'other.pickle',
+             'parsetab-%s.pickle' % key])
+
+
+def _dump_ir(value, expand=False):
+    """
+    Returns a representation of value, which is part of the IR, that can be
+    compared with the one of another IR. Namespaces, data types, aliases and
+    routes are only expanded where they are declared.
+    """
+    if isinstance(value, ApiNamespace):
+        if not expand:
+            return 'namespace %s' % value.name
+        return (value.name, [
+            (name, _dump_ir(attr, expand=name in (
+                'data_types', 'aliases', 'routes', 'data_type_by_name',
+                'alias_by_name', 'route_by_name')))
+            for name, attr in sorted(vars(value).items())])
+    elif isinstance(value, (UserDefined, Alias)) and not expand:
+        return '%s %s.%s' % (
+            type(value).__name__, value.namespace.name, value.name)
+    elif isinstance(value, ApiRoute) and not expand:
+        return 'route %s' % value.name
+    elif isinstance(value, ASTNode):
+        return (type(value).__name__, value.path, value.lineno, value.lexpos)
+    elif isinstance(value, dict):
+        return [(_dump_ir(k), _dump_ir(v, expand)) for k, v in value.items()]
+    elif isinstance(value, (list, tuple, set)):
+        if isinstance(value, set):
+            value = sorted(value, key=repr)
+        return [_dump_ir(v, expand) for v in value]
+    elif hasattr(value, '__dict__'):
+        return (type(value).__name__, [
+            (name, _dump_ir(attr)) for name, attr in sorted(vars(value).items())])
+    return value
+
+
+class TestIRBuilder(unittest.TestCase):
+    """
+    Tests regenerating the IR of the namespaces affected by changed specs.
+    """
+
+    def setUp(self):
+        self.specs = OrderedDict([
+            ('a.stone', textwrap.dedent("""\
+                namespace a
+
+                struct Base
+                    f String
+
+                struct Point extends Base
+                    x Int32
+                    example default
+                        f = "p"
+                        x = 1
+                """)),
+            ('b.stone', textwrap.dedent("""\
+                namespace b
+
+                import a
+
+                struct Child extends a.Base
+                    g a.Point
+
+                route get(a.Point, Child, Void)
+                """)),
+            ('c.stone', textwrap.dedent("""\
+                namespace c
+
+                alias Id = String(min_length=1)
+
+                union Status
+                    ok
+                    failed Id
+                """)),
+            ('d.stone', textwrap.dedent("""\
+                namespace d
+
+                import b
+
+                struct Holder
+                    "See :type:`b.Child`."
+                    child b.Child
+                """)),
+        ])
+        self.builder = IRBuilder()
+
+    def _build(self):
+        specs = list(self.specs.items())
+        api = self.builder.build(specs)
+        self.assertEqual(_dump_ir(list(api.namespaces.values()), True),
+                         _dump_ir(list(specs_to_ir(specs).namespaces.values()),
+                                  True))
+        return api
+
+    def test_affected_namespaces(self):
+        api = self._build()
+        generator = self.builder._generator
+        self.assertEqual(generator.get_affected_namespaces(['c']), {'c'})
+        self.assertEqual(generator.get_affected_namespaces(['d']), {'d'})
+        self.assertEqual(generator.get_affected_namespaces(['a']),
+                         {'a', 'b', 'd'})
+        # b extends a struct of a, which keeps track of its subtypes.
+        self.assertEqual(generator.get_affected_namespaces(['b']),
+                         {'a', 'b', 'd'})
+
+        # Namespaces that aren't affected are reused.
+        self.specs['c.stone'] += '    pending\n'
+        new_api = self._build()
+        self.assertIsNot(new_api, api)
+        for name in ('a', 'b', 'd'):
+            self.assertIs(new_api.namespaces[name], api.namespaces[name])
+        self.assertIsNot(new_api.namespaces['c'], api.namespaces['c'])
+        self.assertEqual(len(new_api.namespaces['c'].data_types[0].fields), 4)
+        # Interned data types are shared with the reused namespaces.
+        self.assertIs(
+            new_api.namespaces['c'].data_types[0].fields[0].data_type,
+            new_api.namespaces['b'].route_by_name['get'].error_data_type)
+
+        api = new_api
+        self.specs['d.stone'] += '    count UInt64\n'
+        new_api = self._build()
+        self.assertIs(new_api.namespaces['c'], api.namespaces['c'])
+        self.assertIs(new_api.namespaces['b'], api.namespaces['b'])
+        self.assertIs(
+            new_api.namespaces['d'].data_types[0].fields[0].data_type,
+            api.namespaces['b'].data_type_by_name['Child'])
+
+        api = new_api
+        self.specs['a.stone'] = self.specs['a.stone'].replace(
+            'x Int32', 'x Int64')
+        new_api = self._build()
+        self.assertIs(new_api.namespaces['c'], api.namespaces['c'])
+        subtypes = new_api.namespaces['a'].data_type_by_name['Base'].subtypes
+        self.assertEqual([dt.name for dt in subtypes], ['Point', 'Child'])
+        self.assertIs(subtypes[1],
+                      new_api.namespaces['b'].data_type_by_name['Child'])
+
+        # Unchanged specs return the same IR.
+        self.assertIs(self._build(), new_api)
+
+    def test_added_and_removed_specs(self):
+        api = self._build()
+        self.specs['e.stone'] = textwrap.dedent("""\
+            namespace e
+
+            import c
+
+            route check(Void, c.Status, Void)
+            """)
+        self.specs['c2.stone'] = 'namespace c\n\nalias Other = Int32\n'
+        self.specs['empty.stone'] = '# Nothing here.\n'
+        new_api = self._build()
+        self.assertIs(new_api.namespaces['a'], api.namespaces['a'])
+        self.assertEqual([alias.name for alias in new_api.namespaces['c'].aliases],
+                         ['Id', 'Other'])
+
+        del self.specs['c2.stone']
+        del self.specs['e.stone']
+        new_api = self._build()
+        self.assertNotIn('e', new_api.namespaces)
+        self.assertIs(new_api.namespaces['a'], api.namespaces['a'])
+
+        # The order of the specs of a namespace matters.
+        self.specs['c2.stone'] = 'namespace c\n    "Second."\n'
+        self.specs['c.stone'] = self.specs['c.stone'].replace(
+            'namespace c\n', 'namespace c\n    "First."\n')
+        self._build()
+        self.specs['c.stone'] = self.specs.pop('c.stone')
+        self.assertEqual(self._build().namespaces['c'].doc, 'Second.\nFirst.\n')
+
+        # So does the order of the namespaces, which can change the order of
+        # subtypes.
+        self.specs['a.stone'] = self.specs.pop('a.stone')
+        subtypes = self._build().namespaces['a'].data_type_by_name['Base'].subtypes
+        self.assertEqual([dt.name for dt in subtypes], ['Child', 'Point'])
+
+    def test_full_rebuilds(self):
+        self._build()
+        # A new subtype of a struct in a namespace that isn't affected.
+        self.specs['c.stone'] += textwrap.dedent("""\
+
+            import a
+
+            struct Point3d extends a.Point
+                z Int32
+            """)
+        api = self._build()
+        subtypes = api.namespaces['a'].data_type_by_name['Point'].subtypes
+        self.assertEqual([dt.name for dt in subtypes], ['Point3d'])
+
+        # Changes to the route schema.
+        self.specs['stone_cfg.stone'] = textwrap.dedent("""\
+            namespace stone_cfg
+
+            struct Route
+                auth String = "user"
+            """)
+        api = self._build()
+        self.assertEqual(api.namespaces['b'].routes[0].attrs, {'auth': 'user'})
+
+    def test_errors(self):
+        api = self._build()
+        good_spec = self.specs['a.stone']
+        for bad_spec in (good_spec.replace('f String', 'f Undefined'),
+                         good_spec.replace('    x Int32', '  x Int32'),
+                         good_spec.replace('namespace a', 'struct S')):
+            self.specs['a.stone'] = bad_spec
+            with self.assertRaises(InvalidSpec) as cm:
+                self.builder.build(list(self.specs.items()))
+            with self.assertRaises(InvalidSpec) as full_cm:
+                specs_to_ir(list(self.specs.items()))
+            self.assertEqual(cm.exception.args, full_cm.exception.args)
+
+        # Removing a namespace that is imported.
+        self.specs['a.stone'] = ''
+        with self.assertRaises(InvalidSpec) as cm:
+            self.builder.build(list(self.specs.items()))
+        self.assertIn("Namespace 'a' is not defined", cm.exception.msg)
+
+        # Builds after errors still reuse the namespaces of the last
+        # successful build.
+        self.specs['a.stone'] = good_spec
+        self.assertIs(self._build(), api)
+        self.specs['d.stone'] += '    count UInt64\n'
+        self.assertIs(self._build().namespaces['c'], api.namespaces['c'])
+
+
+def _synthetic_spec(num_structs):
+    """Returns a spec with num_structs structs, each with a few fields."""
+    lines = ['namespace synthetic', '']
+    for i in range(num_structs):
+        lines.extend([
+            '# Struct number %d.' % i,
+            'struct S%d' % i,
+            '    "Doc for S%d."' % i,
+            '',
+            '    a String(min_length=1)  # Trailing comment.',
+            '    b UInt64 = %d' % i,
+            '    c List(String)?',
+            '        "Doc for c."',
+            '',
+        ])
+    return '\n'.join(lines)
+
+
+def _lex(lexer, data, **kwargs):
+    lexer.input(data, **kwargs)
+    tokens = []
+    while True:
+        token = lexer.token()
+        if not token:
+            return tokens
+        tokens.append((token.type, token.value, token.lineno, token.lexpos))
+
+
+class TestLexer(unittest.TestCase):
+    """
+    Tests reuse of the PLY lexer between Lexer instances and inputs.
+    """
+
+    def test_lexer_is_shared(self):
+        data = _synthetic_spec(500)
+        lexer = Lexer()
+        tokens = _lex(lexer, data)
+        self.assertEqual(len(tokens), 500 * 31 + 3)
+
+        # A PLY lexer built from scratch produces the same tokens.
+        fresh_lexer = Lexer()
+        self.assertEqual(_lex(fresh_lexer, data, debug=False), tokens)
+
+        # Lexing again restarts from the first line.
+        self.assertEqual(_lex(lexer, data), tokens)
+
+        # Other lexers share the compiled rules, but are bound to their own
+        # instance.
+        other_lexer = Lexer()
+        self.assertEqual(_lex(other_lexer, data), tokens)
+        self.assertIsNot(other_lexer.lex, lexer.lex)
+        self.assertIs(other_lexer.lex.lexre[0][0], lexer.lex.lexre[0][0])
+        self.assertIs(other_lexer.lex.lexre[0][1][1][0].__self__, other_lexer)
+        _lex(other_lexer, 'namespace test\n$')
+        self.assertEqual(len(other_lexer.errors), 1)
+        self.assertEqual(lexer.errors, [])
+
+    def test_linear_time(self):
+        class CountingText(six.text_type):
+            """Counts the characters of the substrings taken from it."""
+            copied = 0
+
+            def __getitem__(self, key):
+                value = super(CountingText, self).__getitem__(key)
+                CountingText.copied += len(value)
+                return value
+
+        def lex_work(num_structs):
+            lexer = Lexer()
+            lexer.input(_synthetic_spec(num_structs))
+            lexer.lex.lexdata = CountingText(lexer.lex.lexdata)
+            CountingText.copied = 0
+            while lexer.token():
+                pass
+            return CountingText.copied
+
+        # Lexing 8 times the input should copy about 8 times as much of it,
+        # rather than the 64 times it would if lexing were quadratic.
+        self.assertLess(lex_work(800), lex_work(100) * 10)
+
 
 if __name__ == '__main__':
     unittest.main()